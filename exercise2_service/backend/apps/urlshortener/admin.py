@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ShortURL, URLVisit
+from .models import BulkUploadJob, ShortURL, URLVisit, URLVisitDaily
 
 
 @admin.register(ShortURL)
@@ -22,3 +22,20 @@ class URLVisitAdmin(admin.ModelAdmin):
     search_fields = ['short_url__short_code', 'user__email', 'ip_address']
     readonly_fields = ['short_url', 'user', 'ip_address', 'user_agent', 'accessed_at']
     date_hierarchy = 'accessed_at'
+
+
+@admin.register(URLVisitDaily)
+class URLVisitDailyAdmin(admin.ModelAdmin):
+    list_display = ['short_url', 'date', 'count', 'unique_ips']
+    search_fields = ['short_url__short_code']
+    readonly_fields = ['short_url', 'date', 'count', 'unique_ips']
+    date_hierarchy = 'date'
+
+
+@admin.register(BulkUploadJob)
+class BulkUploadJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'owner', 'status', 'total', 'processed', 'success', 'failed', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['id', 'owner__email']
+    readonly_fields = ['id', 'owner', 'file', 'status', 'total', 'processed', 'success',
+                       'failed', 'error', 'created_at', 'started_at', 'finished_at']
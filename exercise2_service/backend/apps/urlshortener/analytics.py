@@ -0,0 +1,434 @@
+"""
+Incrementally maintained visit aggregates.
+
+The visit pipeline calls ``update_rollups()`` with every batch it writes, so
+``ShortURL.last_visited_at`` and the ``URLVisitDaily``, ``URLVisitHourly``
+and ``URLVisitBreakdown`` rows stay current without anyone scanning the raw
+``URLVisit`` log. Distinct visitors are tracked with HyperLogLog sketches
+(see hll.py), one per URL per day in ``URLVisitDaily`` and one per URL in
+``URLVisitorSketch``. ``backfill_rollups()`` rebuilds everything from the log
+(see the ``backfill_visit_rollups`` command) and ``visit_stats()`` answers
+the stats endpoint from it.
+"""
+import re
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from functools import reduce
+from operator import or_
+from urllib.parse import urlsplit
+
+from django.db.models import Case, Count, DateTimeField, F, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, TruncDate, TruncHour
+
+from .hll import HyperLogLog, merged
+from .models import (
+    ShortURL,
+    URLVisit,
+    URLVisitBreakdown,
+    URLVisitDaily,
+    URLVisitHourly,
+    URLVisitorSketch,
+)
+
+UPDATE_CHUNK_SIZE = 200
+
+DIRECT = '(direct)'
+UNKNOWN = 'Unknown'
+
+# First match wins, so more specific families come before the ones they imitate
+BROWSER_FAMILIES = [
+    ('Bot', re.compile(r'bot|crawl|spider|slurp|preview', re.IGNORECASE)),
+    ('Edge', re.compile(r'Edg(e|A|iOS)?/')),
+    ('Opera', re.compile(r'OPR/|Opera')),
+    ('Samsung Internet', re.compile(r'SamsungBrowser/')),
+    ('Chrome', re.compile(r'Chrome/|CriOS/')),
+    ('Firefox', re.compile(r'Firefox/|FxiOS/')),
+    ('Safari', re.compile(r'Safari/')),
+    ('curl', re.compile(r'^curl/')),
+    ('Python', re.compile(r'python-requests|Python-urllib|aiohttp')),
+]
+
+
+def browser_family(user_agent):
+    if not user_agent:
+        return UNKNOWN
+    for family, pattern in BROWSER_FAMILIES:
+        if pattern.search(user_agent):
+            return family
+    return 'Other'
+
+
+def referrer_host(referrer):
+    """Reduce a Referer header to its host, e.g. 'news.ycombinator.com'"""
+    try:
+        host = urlsplit(referrer).hostname if referrer else None
+    except ValueError:
+        host = None
+    if not host:
+        return DIRECT
+    return host[4:] if host.startswith('www.') else host
+
+
+def _increment(model, key_fields, deltas):
+    """
+    Add ``deltas`` ({key tuple: {field: amount}}) to the rows of ``model``
+    identified by ``key_fields``, creating missing rows first. One UPDATE per
+    chunk of keys, however many keys there are.
+    """
+    if not deltas:
+        return
+    model.objects.bulk_create(
+        [model(**dict(zip(key_fields, key))) for key in deltas],
+        ignore_conflicts=True,
+    )
+    items = list(deltas.items())
+    for start in range(0, len(items), UPDATE_CHUNK_SIZE):
+        chunk = items[start:start + UPDATE_CHUNK_SIZE]
+        conditions = [Q(**dict(zip(key_fields, key))) for key, _ in chunk]
+        fields = {field for _, amounts in chunk for field in amounts}
+        model.objects.filter(reduce(or_, conditions)).update(**{
+            field: F(field) + Case(
+                *[
+                    When(condition, then=Value(amounts.get(field, 0)))
+                    for condition, (_, amounts) in zip(conditions, chunk)
+                ],
+                default=Value(0),
+            )
+            for field in fields
+        })
+
+
+def _locked_rows(model, key_fields, keys, fields):
+    """Fetch the rows with the given keys, locked for update in primary key order"""
+    rows = []
+    for start in range(0, len(keys), UPDATE_CHUNK_SIZE):
+        conditions = [
+            Q(**dict(zip(key_fields, key))) for key in keys[start:start + UPDATE_CHUNK_SIZE]
+        ]
+        rows += (
+            model.objects
+            .select_for_update()
+            .filter(reduce(or_, conditions))
+            .order_by('pk')
+            .only(*key_fields, *fields)
+        )
+    return rows
+
+
+def update_rollups(events):
+    """
+    Fold a batch of visit events into last_visited_at, the rollup tables
+    and the visitor sketches. Must run inside a transaction.
+    """
+    if not events:
+        return
+
+    daily_ips = defaultdict(list)
+    hourly = Counter()
+    breakdown = Counter()
+    last_visits = {}
+    for event in events:
+        accessed_at = event.accessed_at.astimezone(dt_timezone.utc)
+        day = accessed_at.date()
+        daily_ips[(event.short_url_id, day)].append(event.ip_address)
+        hourly[(event.short_url_id, accessed_at.replace(minute=0, second=0, microsecond=0))] += 1
+        breakdown[(
+            event.short_url_id, day, URLVisitBreakdown.DIMENSION_REFERRER,
+            referrer_host(event.referrer)[:255],
+        )] += 1
+        breakdown[(
+            event.short_url_id, day, URLVisitBreakdown.DIMENSION_BROWSER,
+            browser_family(event.user_agent),
+        )] += 1
+        latest = last_visits.get(event.short_url_id)
+        if latest is None or event.accessed_at > latest:
+            last_visits[event.short_url_id] = event.accessed_at
+
+    # Sketch rows are read, merged and written back under a row lock, so
+    # concurrent pipelines (one per worker process) can't lose each other's IPs
+    URLVisitDaily.objects.bulk_create(
+        [URLVisitDaily(short_url_id=short_url_id, date=day) for short_url_id, day in daily_ips],
+        ignore_conflicts=True,
+    )
+    daily_rows = _locked_rows(
+        URLVisitDaily, ['short_url_id', 'date'], list(daily_ips),
+        ['count', 'visitor_sketch'],
+    )
+    for row in daily_rows:
+        ips = daily_ips[(row.short_url_id, row.date)]
+        sketch = HyperLogLog.from_bytes(row.visitor_sketch)
+        sketch.update(ips)
+        row.count += len(ips)
+        row.visitor_sketch = sketch.to_bytes()
+        row.unique_ips = sketch.count()
+    URLVisitDaily.objects.bulk_update(
+        daily_rows, ['count', 'unique_ips', 'visitor_sketch'], batch_size=UPDATE_CHUNK_SIZE
+    )
+
+    url_ips = defaultdict(list)
+    for (short_url_id, _), ips in daily_ips.items():
+        url_ips[short_url_id] += ips
+    URLVisitorSketch.objects.bulk_create(
+        [URLVisitorSketch(short_url_id=short_url_id) for short_url_id in url_ips],
+        ignore_conflicts=True,
+    )
+    url_rows = _locked_rows(
+        URLVisitorSketch, ['short_url_id'], [(pk,) for pk in url_ips], ['sketch']
+    )
+    for row in url_rows:
+        sketch = HyperLogLog.from_bytes(row.sketch)
+        sketch.update(url_ips[row.short_url_id])
+        row.sketch = sketch.to_bytes()
+        row.unique_visitors = sketch.count()
+    URLVisitorSketch.objects.bulk_update(
+        url_rows, ['sketch', 'unique_visitors'], batch_size=UPDATE_CHUNK_SIZE
+    )
+
+    _increment(
+        URLVisitHourly, ['short_url_id', 'hour'],
+        {key: {'count': count} for key, count in hourly.items()},
+    )
+    _increment(
+        URLVisitBreakdown, ['short_url_id', 'date', 'dimension', 'value'],
+        {key: {'count': count} for key, count in breakdown.items()},
+    )
+
+    ShortURL.objects.filter(pk__in=list(last_visits)).update(
+        last_visited_at=Case(
+            *[
+                When(pk=pk, then=Greatest(
+                    Coalesce(F('last_visited_at'), Value(accessed_at)), Value(accessed_at)
+                ))
+                for pk, accessed_at in last_visits.items()
+            ],
+            output_field=DateTimeField(),
+        )
+    )
+
+
+def backfill_rollups(short_url_ids):
+    """
+    Recompute rollups for the given URLs from the raw visit log.
+
+    Idempotent: rows are overwritten, not incremented. Returns the number of
+    daily rows written.
+    """
+    visits = URLVisit.objects.filter(short_url_id__in=short_url_ids)
+    daily = (
+        visits
+        .annotate(date=TruncDate('accessed_at', tzinfo=dt_timezone.utc))
+        .values('short_url_id', 'date')
+        .annotate(count=Count('id'), unique_ips=Count('ip_address', distinct=True))
+    )
+    daily_sketches = defaultdict(HyperLogLog)
+    url_sketches = defaultdict(HyperLogLog)
+    distinct_ips = (
+        visits
+        .annotate(date=TruncDate('accessed_at', tzinfo=dt_timezone.utc))
+        .values_list('short_url_id', 'date', 'ip_address')
+        .distinct()
+        .order_by()
+    )
+    for short_url_id, day, ip_address in distinct_ips.iterator():
+        daily_sketches[(short_url_id, day)].add(ip_address)
+        url_sketches[short_url_id].add(ip_address)
+
+    # The exact distinct count is cheap here, so it is stored instead of the estimate
+    rows = [
+        URLVisitDaily(
+            short_url_id=row['short_url_id'],
+            date=row['date'],
+            count=row['count'],
+            unique_ips=row['unique_ips'],
+            visitor_sketch=daily_sketches[(row['short_url_id'], row['date'])].to_bytes(),
+        )
+        for row in daily
+    ]
+    URLVisitDaily.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['short_url', 'date'],
+        update_fields=['count', 'unique_ips', 'visitor_sketch'],
+    )
+    URLVisitorSketch.objects.bulk_create(
+        [
+            URLVisitorSketch(
+                short_url_id=short_url_id,
+                sketch=sketch.to_bytes(),
+                unique_visitors=sketch.count(),
+            )
+            for short_url_id, sketch in url_sketches.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['short_url'],
+        update_fields=['sketch', 'unique_visitors'],
+    )
+
+    hourly = (
+        visits
+        .annotate(hour=TruncHour('accessed_at', tzinfo=dt_timezone.utc))
+        .values('short_url_id', 'hour')
+        .annotate(count=Count('id'))
+    )
+    URLVisitHourly.objects.bulk_create(
+        [URLVisitHourly(**row) for row in hourly],
+        update_conflicts=True,
+        unique_fields=['short_url', 'hour'],
+        update_fields=['count'],
+    )
+
+    # Group in the database first; only the distinct header values are classified here
+    breakdown = Counter()
+    grouped = (
+        visits
+        .annotate(date=TruncDate('accessed_at', tzinfo=dt_timezone.utc))
+        .values_list('short_url_id', 'date', 'referrer', 'user_agent')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    for short_url_id, day, referrer, user_agent, count in grouped.iterator():
+        breakdown[(
+            short_url_id, day, URLVisitBreakdown.DIMENSION_REFERRER,
+            referrer_host(referrer)[:255],
+        )] += count
+        breakdown[(
+            short_url_id, day, URLVisitBreakdown.DIMENSION_BROWSER,
+            browser_family(user_agent),
+        )] += count
+    URLVisitBreakdown.objects.bulk_create(
+        [
+            URLVisitBreakdown(
+                short_url_id=short_url_id, date=day, dimension=dimension,
+                value=value, count=count,
+            )
+            for (short_url_id, day, dimension, value), count in breakdown.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['short_url', 'date', 'dimension', 'value'],
+        update_fields=['count'],
+    )
+
+    last_visits = dict(
+        visits
+        .values('short_url_id')
+        .annotate(last=Max('accessed_at'))
+        .values_list('short_url_id', 'last')
+    )
+    if last_visits:
+        ShortURL.objects.filter(pk__in=list(last_visits)).update(
+            last_visited_at=Case(
+                *[When(pk=pk, then=Value(last)) for pk, last in last_visits.items()],
+                output_field=DateTimeField(),
+            )
+        )
+    return len(rows)
+
+
+BUCKET_HOUR = 'hour'
+BUCKET_DAY = 'day'
+BUCKET_WEEK = 'week'
+BUCKET_SIZES = {
+    BUCKET_HOUR: timedelta(hours=1),
+    BUCKET_DAY: timedelta(days=1),
+    BUCKET_WEEK: timedelta(weeks=1),
+}
+
+
+def bucket_window(bucket, count, now):
+    """
+    Return (start, end) covering ``count`` whole buckets up to the one
+    containing ``now``; weeks start on Monday. Times are UTC.
+    """
+    now = now.astimezone(dt_timezone.utc)
+    if bucket == BUCKET_HOUR:
+        current = now.replace(minute=0, second=0, microsecond=0)
+    else:
+        current = datetime.combine(now.date(), time.min, tzinfo=dt_timezone.utc)
+        if bucket == BUCKET_WEEK:
+            current -= timedelta(days=current.weekday())
+    size = BUCKET_SIZES[bucket]
+    end = current + size
+    return end - size * count, end
+
+
+def _top(short_url, dimension, start_date, end_date, limit):
+    rows = (
+        URLVisitBreakdown.objects
+        .filter(
+            short_url=short_url,
+            dimension=dimension,
+            date__gte=start_date,
+            date__lt=end_date,
+        )
+        .values('value')
+        .annotate(visits=Sum('count'))
+        .order_by('-visits', 'value')[:limit]
+    )
+    return [{'value': row['value'], 'visits': row['visits']} for row in rows]
+
+
+def visit_stats(short_url, bucket, count, top, now):
+    """
+    Visit statistics for ``count`` buckets ending with the current one.
+
+    Everything comes from the rollup tables. Unique visitors are estimated
+    by merging the daily HyperLogLog sketches of each bucket (and of the
+    whole window), so they are not reported for hour buckets. Top referrers
+    and browsers cover the whole days touched by the window.
+    """
+    start, end = bucket_window(bucket, count, now)
+    size = BUCKET_SIZES[bucket]
+    buckets = {start + size * index: 0 for index in range(count)}
+    sketches = defaultdict(list)
+
+    if bucket == BUCKET_HOUR:
+        rows = URLVisitHourly.objects.filter(
+            short_url=short_url, hour__gte=start, hour__lt=end
+        ).values_list('hour', 'count')
+        for hour, visits in rows:
+            buckets[hour.astimezone(dt_timezone.utc)] += visits
+    else:
+        rows = URLVisitDaily.objects.filter(
+            short_url=short_url, date__gte=start.date(), date__lt=end.date()
+        ).values_list('date', 'count', 'visitor_sketch')
+        for day, visits, sketch in rows:
+            day_start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+            key = start + size * ((day_start - start) // size)
+            buckets[key] += visits
+            sketches[key].append(sketch)
+
+    daily_unique = bucket != BUCKET_HOUR
+    window_sketch = merged(sketch for day_sketches in sketches.values() for sketch in day_sketches)
+    all_time = (
+        URLVisitorSketch.objects
+        .filter(short_url=short_url)
+        .values_list('unique_visitors', flat=True)
+        .first()
+    )
+    start_date = start.date()
+    end_date = (end - timedelta(microseconds=1)).date() + timedelta(days=1)
+    return {
+        'short_code': short_url.short_code,
+        'bucket': bucket,
+        'start': start,
+        'end': end,
+        'total_visits': sum(buckets.values()),
+        'unique_visitors': window_sketch.count() if daily_unique else None,
+        'all_time_unique_visitors': all_time or 0,
+        'buckets': [
+            {
+                'start': bucket_start,
+                'visits': visits,
+                'unique_visitors': (
+                    merged(sketches[bucket_start]).count() if daily_unique else None
+                ),
+            }
+            for bucket_start, visits in buckets.items()
+        ],
+        'top_referrers': _top(
+            short_url, URLVisitBreakdown.DIMENSION_REFERRER, start_date, end_date, top
+        ),
+        'top_browsers': _top(
+            short_url, URLVisitBreakdown.DIMENSION_BROWSER, start_date, end_date, top
+        ),
+    }
@@ -4,4 +4,7 @@ from django.apps import AppConfig
 class UrlshortenerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.urlshortener'
-    label = 'urlshortener'  # This is the app_label used in model references
\ No newline at end of file
+    label = 'urlshortener'  # This is the app_label used in model references
+
+    def ready(self):
+        from . import signals  # noqa: F401
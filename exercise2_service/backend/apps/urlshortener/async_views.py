@@ -0,0 +1,121 @@
+"""
+Async redirect and shorten views for ASGI deployments.
+
+Used instead of ``RedirectView`` and ``ShortenURLView`` when
+``settings.ASYNC_VIEWS`` is on (project/asgi.py turns it on by default).
+Cache and ORM access is awaited (``aresolve()``, ``acreate()``), so a worker
+keeps serving other requests while one waits on Redis or the database.
+
+DRF has no async views, so the parts that only exist synchronously run in a
+single ``sync_to_async`` hop: authentication, permissions, throttling and
+validation of shorten requests (through the regular ``ShortenURLView``), and
+redirects that need the user, which go to the DRF ``RedirectView``: private
+ones, and any request carrying credentials, so its visit is attributed to
+the user as under WSGI. Anonymous public redirects never leave the event
+loop.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from django.http import Http404
+from django.shortcuts import redirect
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .bulk import duplicate_of
+from .cache import resolution_cache
+from .codegen import get_code_generator
+from .models import ShortURL
+from .tracking import visit_event_from_meta, visit_pipeline
+from .views import RedirectView, ShortenURLView
+
+_drf_redirect = RedirectView.as_view()
+
+
+def _carries_credentials(request):
+    # What JWTAuthentication and SessionAuthentication look at
+    return 'HTTP_AUTHORIZATION' in request.META or settings.SESSION_COOKIE_NAME in request.COOKIES
+
+
+class AsyncRedirectView(View):
+    """Redirect short URL to target; public URLs never leave the event loop"""
+
+    async def get(self, request, short_code):
+        short_url = await resolution_cache.aresolve(short_code)
+        if short_url is None:
+            raise Http404
+
+        if short_url.is_private or _carries_credentials(request):
+            return await sync_to_async(_drf_redirect)(request, short_code=short_code)
+
+        await visit_pipeline.arecord(visit_event_from_meta(request.META, short_url.pk))
+        return redirect(short_url.target_url)
+
+
+class AsyncShortenURLView(View):
+    """Create shortened URL (async ShortenURLView)"""
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # Like DRF: SessionAuthentication enforces CSRF itself
+        view.csrf_exempt = True
+        return view
+
+    async def post(self, request):
+        drf_view, serializer, response = await sync_to_async(self.prepare)(request)
+        if response is not None:
+            return response
+
+        data = dict(serializer.validated_data)
+        if drf_view.request.user.is_authenticated:
+            data['owner'] = drf_view.request.user
+
+        if settings.SHORT_URL_DEDUP:
+            existing = await duplicate_of(
+                data.get('owner'), data['target_url'], data.get('is_private', False)
+            ).afirst()
+            if existing is not None:
+                return self.respond(drf_view, Response(
+                    serializer.to_representation(existing), status=status.HTTP_201_CREATED
+                ))
+
+        # Same retry on legacy code collisions as ShortURLCreateSerializer.create
+        for _ in range(settings.SHORT_CODE_MAX_ATTEMPTS):
+            data['short_code'] = await sync_to_async(ShortURL.generate_short_code)(
+                length=settings.SHORT_CODE_LENGTH
+            )
+            try:
+                short_url = await ShortURL.objects.acreate(**data)
+            except IntegrityError:
+                get_code_generator().discard_reserved()
+            else:
+                return self.respond(drf_view, Response(
+                    serializer.to_representation(short_url), status=status.HTTP_201_CREATED
+                ))
+
+        return self.respond(drf_view, drf_view.handle_exception(ValidationError(
+            'Could not allocate a unique short code. Please try again.'
+        )))
+
+    @classmethod
+    def prepare(cls, request):
+        """Run ShortenURLView's auth, permission, throttle and validation steps"""
+        drf_view = ShortenURLView()
+        drf_view.args, drf_view.kwargs = (), {}
+        drf_view.request = drf_view.initialize_request(request)
+        drf_view.headers = drf_view.default_response_headers
+        try:
+            drf_view.initial(drf_view.request)
+            serializer = drf_view.get_serializer(data=drf_view.request.data)
+            serializer.is_valid(raise_exception=True)
+        except Exception as exc:
+            return drf_view, None, cls.respond(drf_view, drf_view.handle_exception(exc))
+        return drf_view, serializer, None
+
+    @staticmethod
+    def respond(drf_view, response):
+        response = drf_view.finalize_response(drf_view.request, response)
+        return response.render()
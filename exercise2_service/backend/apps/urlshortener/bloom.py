@@ -0,0 +1,224 @@
+"""
+In-memory Bloom filter of existing short codes.
+
+``code_filter`` lets ``RandomCodeGenerator`` skip the uniqueness query for
+candidates that are probably free (the unique constraint catches the rest).
+The redirect path doesn't trust it: the filter lags behind codes created
+elsewhere, so a miss there is confirmed by the database and negative-cached
+(see cache.py).
+
+The filter is built by a background thread from a streaming scan of
+``ShortURL.short_code`` (until then every code is a "maybe"). Codes created
+in this process are added when their transaction commits; codes created by
+other processes are picked up by a delta scan of new primary keys every
+``SHORT_CODE_FILTER_REFRESH_INTERVAL`` seconds; a row committed far out of
+id order is only picked up by the next full rebuild.
+
+Bloom filters can't forget, so deleted codes stay "maybe" (costing one
+lookup, then a negative cache entry) until the periodic full rebuild.
+"""
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .sharding import SHARD_BUCKETS, is_sharded, on_shard, shards
+
+logger = logging.getLogger(__name__)
+
+# Rows with ids this far below the newest one seen are re-read on every
+# refresh, for transactions that committed out of id order. Sharded ids come
+# from per-process blocks (see sharding.py), so there the overlap is this
+# many blocks
+REFRESH_ID_OVERLAP = 1000
+REFRESH_BLOCK_OVERLAP = 50
+
+
+def _refresh_overlap():
+    if not is_sharded():
+        return REFRESH_ID_OVERLAP
+    blocks = REFRESH_BLOCK_OVERLAP * settings.SHORT_CODE_BLOCK_SIZE
+    return max(REFRESH_ID_OVERLAP, blocks) * SHARD_BUCKETS
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over one blake2b digest"""
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.capacity = capacity
+        self.count = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(value)
+        )
+
+
+class ShortCodeFilter:
+    """Process-wide Bloom filter of short codes, kept fresh by a daemon thread"""
+
+    def __init__(self, autostart=True):
+        self.autostart = autostart
+        self._filter = None
+        self._lock = threading.Lock()
+        self._pending = None
+        self._watermark = 0
+        self._thread = None
+        self._pid = None
+        self.built_at = None
+        self.rejections = 0
+
+    @property
+    def ready(self):
+        return self._filter is not None and self._pid == os.getpid()
+
+    def might_exist(self, short_code):
+        """False if the code didn't exist as of the last build or refresh"""
+        if not settings.SHORT_CODE_FILTER_ENABLED:
+            return True
+        if self.autostart:
+            self.start()
+        current = self._filter
+        if current is None or self._pid != os.getpid():
+            return True
+        if short_code in current:
+            return True
+        self.rejections += 1
+        return False
+
+    def add_many(self, short_codes):
+        with self._lock:
+            if self._pending is not None:
+                # A build is in progress; replay these once it swaps in
+                self._pending.extend(short_codes)
+            if self._filter is not None:
+                for short_code in short_codes:
+                    self._filter.add(short_code)
+
+    def add(self, short_code):
+        self.add_many([short_code])
+
+    def build(self):
+        """Rebuild from a full scan of the table and swap it in"""
+        from .models import ShortURL
+
+        with self._lock:
+            self._pending = []
+        try:
+            total = 0
+            for alias in shards():
+                with on_shard(alias):
+                    total += ShortURL.objects.count()
+            bloom = BloomFilter(
+                max(total * 2, settings.SHORT_CODE_FILTER_MIN_CAPACITY),
+                settings.SHORT_CODE_FILTER_ERROR_RATE,
+            )
+            watermark = 0
+            for alias in shards():
+                with on_shard(alias):
+                    rows = ShortURL.objects.order_by().values_list('pk', 'short_code')
+                    for pk, short_code in rows.iterator(chunk_size=10000):
+                        bloom.add(short_code)
+                        watermark = max(watermark, pk)
+            with self._lock:
+                for short_code in self._pending:
+                    bloom.add(short_code)
+                self._filter = bloom
+                self._watermark = watermark
+                self._pid = os.getpid()
+                self.built_at = time.time()
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def refresh(self):
+        """Add codes created since the last build or refresh (by any process)"""
+        from .models import ShortURL
+
+        if self._filter is None:
+            return
+        since = self._watermark - _refresh_overlap()
+        rows = []
+        for alias in shards():
+            with on_shard(alias):
+                rows += (
+                    ShortURL.objects
+                    .filter(pk__gt=since)
+                    .order_by('pk')
+                    .values_list('pk', 'short_code')
+                )
+        if rows:
+            self.add_many([short_code for _, short_code in rows])
+            self._watermark = max(self._watermark, max(pk for pk, _ in rows))
+
+    def start(self):
+        """Start the builder thread (again, after a fork) if it isn't running"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            # A forked worker builds its own filter; it can't trust its parent's thread
+            self._filter = None
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name='short-code-filter', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        next_rebuild = 0
+        while True:
+            try:
+                close_old_connections()
+                if time.monotonic() >= next_rebuild:
+                    self.build()
+                    next_rebuild = time.monotonic() + settings.SHORT_CODE_FILTER_REBUILD_INTERVAL
+                else:
+                    self.refresh()
+            except Exception:
+                logger.exception('Short code filter update failed')
+            finally:
+                close_old_connections()
+            time.sleep(settings.SHORT_CODE_FILTER_REFRESH_INTERVAL)
+
+    def stats(self):
+        current = self._filter
+        return {
+            'ready': self.ready,
+            'codes': current.count if current else 0,
+            'capacity': current.capacity if current else 0,
+            'size_bytes': len(current.bits) if current else 0,
+            'rejections': self.rejections,
+        }
+
+    def reset(self):
+        """Forget the filter (tests); the next lookup starts a new build"""
+        with self._lock:
+            self._filter = None
+            self._watermark = 0
+            self.rejections = 0
+
+
+code_filter = ShortCodeFilter()
@@ -0,0 +1,182 @@
+"""
+Set-based creation of many short URLs at once.
+
+Used by bulk uploads: uploads are read line by line straight from the
+upload chunks, short codes are allocated per batch and rows are inserted
+with ``bulk_create`` inside a transaction, so a 1000-URL upload costs a
+handful of queries instead of two per URL and memory stays bounded by the
+batch size rather than the file size.
+
+With ``settings.SHORT_URL_DEDUP`` on, a URL the owner already shortened
+(same normalized target and privacy, see urlnorm.py) gets its existing
+short URL back instead of a new row.
+"""
+import codecs
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+
+from .bloom import code_filter
+from .cache import resolution_cache
+from .codegen import get_code_generator
+from .models import ShortURL
+from .sharding import (
+    across_shards, allocate_ids, codes_in_use, group_by_shard, is_sharded, shard_for_code,
+)
+from .urlnorm import hash_url
+
+INSERT_CHUNK_SIZE = 500
+
+# Longer lines can't be valid URLs; only this much of them is kept
+MAX_LINE_LENGTH = 2049
+
+
+def _ends_line(text):
+    return len(text.splitlines()[0]) < len(text)
+
+
+def _decoded_chunks(upload, decoder):
+    for chunk in upload.chunks():
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+def iter_upload_lines(upload, max_line_length=MAX_LINE_LENGTH):
+    """
+    Yield the lines of an UploadedFile, decoding UTF-8 incrementally.
+
+    Lines break where str.splitlines() breaks them (LF, CRLF, a lone CR as
+    in classic Mac exports, ...), also when a CRLF is split between chunks.
+    Over-long lines are cut to ``max_line_length`` characters (so they fail
+    validation) and the rest is skipped without being buffered. Raises
+    UnicodeDecodeError for invalid UTF-8.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    skipping = False
+    after_cr = False
+    for text in _decoded_chunks(upload, decoder):
+        if not text:
+            continue
+        if after_cr and text.startswith('\n'):
+            # The LF of a CRLF that ended the previous chunk
+            text = text[1:]
+        lines = (pending + text).splitlines(keepends=True)
+        pending = lines.pop() if lines and not _ends_line(lines[-1]) else ''
+        after_cr = not pending and bool(lines) and lines[-1].endswith('\r')
+        for line in lines:
+            if skipping:
+                skipping = False
+                continue
+            yield line.splitlines()[0]
+        if len(pending) > max_line_length:
+            if not skipping:
+                yield pending[:max_line_length]
+                skipping = True
+            pending = ''
+    if not skipping:
+        yield pending
+
+
+def _replace_taken(codes, length):
+    """Swap out generated codes that collide with existing (legacy) ones"""
+    generator = get_code_generator()
+    for _ in range(settings.SHORT_CODE_MAX_ATTEMPTS):
+        taken = codes_in_use(codes)
+        if not taken:
+            return codes
+        generator.discard_reserved()
+        replacements = iter(generator.generate_many(len(taken), length))
+        codes = [next(replacements) if code in taken else code for code in codes]
+    raise RuntimeError('Could not allocate unique short codes')
+
+
+def _created(rows):
+    code_filter.add_many([row[0] for row in rows])
+    resolution_cache.prime_many(rows)
+
+
+def duplicate_of(owner, target_url, is_private):
+    """Queryset of the owner's existing short URL for this target, oldest first"""
+    return across_shards(ShortURL.objects.filter(
+        owner=owner, target_url_hash=hash_url(target_url), is_private=is_private
+    ), 'pk')
+
+
+def find_duplicates(owner, entries):
+    """Map (target_url_hash, is_private) to the owner's existing ShortURL"""
+    hashes = sorted({hash_url(target_url) for target_url, _ in entries})
+    found = {}
+    for start in range(0, len(hashes), INSERT_CHUNK_SIZE):
+        rows = across_shards(
+            ShortURL.objects
+            .filter(owner=owner, target_url_hash__in=hashes[start:start + INSERT_CHUNK_SIZE]),
+            'pk',
+        )
+        for short_url in rows:
+            found.setdefault((short_url.target_url_hash, short_url.is_private), short_url)
+    return found
+
+
+def create_short_urls(entries, owner=None, dedup=None):
+    """
+    Create one ShortURL per ``(target_url, is_private)`` entry.
+
+    Entries must already be validated. Returns one object per entry, in the
+    same order as ``entries``. In dedup mode (``settings.SHORT_URL_DEDUP``
+    unless ``dedup`` says otherwise) entries the owner already shortened, or
+    that repeat an earlier entry, get the existing object.
+    """
+    entries = list(entries)
+    if not entries:
+        return []
+    if dedup is None:
+        dedup = settings.SHORT_URL_DEDUP
+    if not dedup:
+        return _insert(entries, owner)
+
+    keys = [(hash_url(target_url), is_private) for target_url, is_private in entries]
+    found = find_duplicates(owner, entries)
+    new_entries = {}
+    for key, entry in zip(keys, entries):
+        if key not in found:
+            new_entries.setdefault(key, entry)
+    found.update(zip(new_entries, _insert(list(new_entries.values()), owner)))
+    return [found[key] for key in keys]
+
+
+def _insert(entries, owner):
+    if not entries:
+        return []
+
+    length = settings.SHORT_CODE_LENGTH
+    codes = get_code_generator().generate_many(len(entries), length)
+    codes = [
+        code
+        for start in range(0, len(codes), INSERT_CHUNK_SIZE)
+        for code in _replace_taken(codes[start:start + INSERT_CHUNK_SIZE], length)
+    ]
+    objects = [
+        ShortURL(
+            short_code=code,
+            target_url=target_url,
+            target_url_hash=hash_url(target_url),
+            is_private=is_private,
+            owner=owner,
+        )
+        for code, (target_url, is_private) in zip(codes, entries)
+    ]
+    if is_sharded():
+        for obj, pk in zip(objects, allocate_ids(codes)):
+            obj.pk = pk
+
+    for alias, group in group_by_shard(objects, lambda obj: shard_for_code(obj.short_code)).items():
+        with transaction.atomic(using=alias):
+            for start in range(0, len(group), INSERT_CHUNK_SIZE):
+                ShortURL.objects.using(alias).bulk_create(group[start:start + INSERT_CHUNK_SIZE])
+            # bulk_create skips post_save, so do what its handler does here
+            transaction.on_commit(partial(_created, [
+                (obj.short_code, obj.pk, obj.target_url, obj.is_private) for obj in group
+            ]), using=alias)
+    return objects
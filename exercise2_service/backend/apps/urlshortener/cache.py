@@ -0,0 +1,291 @@
+"""
+Tiered short-code resolution cache for the redirect path.
+
+Lookups go through a small in-process LRU (per worker, short TTL) and then
+Django's cache framework (shared between workers when backed by Redis or
+memcached) and the shared redirect snapshot (see snapshot.py) before falling
+back to the database. Unknown codes are cached negatively so repeated misses
+don't reach the database either. The short code Bloom filter (see bloom.py)
+lags behind other workers' creations, so a code it has never seen is still
+looked up; it only counts how often that found nothing.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+from .bloom import code_filter
+from .replicas import reading_from_replica
+from .sharding import is_sharded, on_shard, shard_for_code
+from .snapshot import redirect_snapshot
+
+
+ResolvedURL = namedtuple('ResolvedURL', ['pk', 'short_code', 'target_url', 'is_private'])
+
+_MISSING = object()
+_NEGATIVE = ()
+
+
+class LocalLRUCache:
+    """Thread-safe LRU dict with per-entry expiry"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return _MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResolutionCache:
+    """Resolve short codes to (pk, target_url, is_private) with caching"""
+
+    key_prefix = 'shorturl:resolve:'
+
+    def __init__(self):
+        self.local = LocalLRUCache(settings.REDIRECT_CACHE_LOCAL_SIZE)
+        self._counter_lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def shared(self):
+        return caches[settings.REDIRECT_CACHE_ALIAS]
+
+    def _count(self, name):
+        with self._counter_lock:
+            self._counters[name] += 1
+
+    def reset_stats(self):
+        self._counters = {
+            'local_hits': 0,
+            'shared_hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'filter_rejections': 0,
+            'filter_stale': 0,
+            'invalidations': 0,
+        }
+
+    def stats(self):
+        """Counters used to size the cache tiers"""
+        data = dict(self._counters)
+        lookups = data['local_hits'] + data['shared_hits'] + data['misses']
+        data['hit_ratio'] = (
+            (data['local_hits'] + data['shared_hits']) / lookups if lookups else 0.0
+        )
+        data['local_size'] = len(self.local)
+        data['local_max_size'] = self.local.max_size
+        data['local_evictions'] = self.local.evictions
+        data['local_expirations'] = self.local.expirations
+        data['filter'] = code_filter.stats()
+        data['snapshot'] = redirect_snapshot.stats()
+        return data
+
+    def _from_cached(self, short_code, value):
+        if value == _NEGATIVE:
+            self._count('negative_hits')
+            return None
+        return _build(short_code, value)
+
+    def _load(self, short_code):
+        """(row or None, shared-tier TTL) from the snapshot or the database"""
+        from .models import ShortURL
+
+        row = redirect_snapshot.lookup(short_code)
+        if row is not None:
+            return row, _snapshot_ttl()
+        alias = shard_for_code(short_code)
+        query = ShortURL.objects.filter(short_code=short_code).values_list(
+            'pk', 'target_url', 'is_private'
+        )
+        with on_shard(alias):
+            row = query.first()
+        if row is None and reading_from_replica() and not is_sharded():
+            # The replica may not have caught up with a code created moments ago
+            row = query.using(alias).first()
+        return row, None
+
+    def _shared_ttl(self, ttl):
+        if isinstance(self.shared, LocMemCache):
+            # Per process after all: it only hears of this worker's edits
+            return min(ttl, settings.REDIRECT_CACHE_LOCAL_TTL)
+        return ttl
+
+    def _entry(self, row, ttl=None):
+        """Cache value and shared-tier TTL for a loaded row (None if missing)"""
+        if row is None:
+            return _NEGATIVE, self._shared_ttl(settings.REDIRECT_CACHE_NEGATIVE_TTL)
+        return tuple(row), self._shared_ttl(ttl or settings.REDIRECT_CACHE_SHARED_TTL)
+
+    def _store(self, short_code, row, ttl=None):
+        value, ttl = self._entry(row, ttl)
+        self.shared.set(self.key_prefix + short_code, value, ttl)
+        self.local.set(short_code, value, self._local_ttl(value))
+        return value
+
+    def _check_filter(self, short_code, row):
+        # A code missing from the filter may have been created by another
+        # worker since the filter's last refresh, so the lookup always runs;
+        # if it found the code the filter is behind and learns it now
+        if code_filter.might_exist(short_code):
+            return
+        if row is None:
+            self._count('filter_rejections')
+        else:
+            self._count('filter_stale')
+            code_filter.add(short_code)
+
+    def _local_ttl(self, value):
+        if value == _NEGATIVE:
+            return min(settings.REDIRECT_CACHE_NEGATIVE_TTL, settings.REDIRECT_CACHE_LOCAL_TTL)
+        return settings.REDIRECT_CACHE_LOCAL_TTL
+
+    def resolve(self, short_code):
+        """Return a ResolvedURL for the code, or None when it doesn't exist"""
+        if not settings.REDIRECT_CACHE_ENABLED:
+            row, _ = self._load(short_code)
+            return _build(short_code, row) if row else None
+
+        value = self.local.get(short_code)
+        if value is not _MISSING:
+            self._count('local_hits')
+            return self._from_cached(short_code, value)
+
+        value = self.shared.get(self.key_prefix + short_code)
+        if value is not None:
+            self._count('shared_hits')
+            self.local.set(short_code, value, self._local_ttl(value))
+            return self._from_cached(short_code, value)
+
+        self._count('misses')
+        row, ttl = self._load(short_code)
+        self._check_filter(short_code, row)
+        value = self._store(short_code, row, ttl)
+        return None if value == _NEGATIVE else _build(short_code, value)
+
+    async def _aload(self, short_code):
+        from .models import ShortURL
+
+        row = redirect_snapshot.lookup(short_code)
+        if row is not None:
+            return row, _snapshot_ttl()
+        row = await (
+            ShortURL.objects
+            .using(shard_for_code(short_code))
+            .filter(short_code=short_code)
+            .values_list('pk', 'target_url', 'is_private')
+            .afirst()
+        )
+        return row, None
+
+    async def aresolve(self, short_code):
+        """resolve() for async views; the shared tier and database are awaited"""
+        if not settings.REDIRECT_CACHE_ENABLED:
+            row, _ = await self._aload(short_code)
+            return _build(short_code, row) if row else None
+
+        # The local tier is an in-process dict: no I/O, safe on the event loop
+        value = self.local.get(short_code)
+        if value is not _MISSING:
+            self._count('local_hits')
+            return self._from_cached(short_code, value)
+
+        value = await self.shared.aget(self.key_prefix + short_code)
+        if value is not None:
+            self._count('shared_hits')
+            self.local.set(short_code, value, self._local_ttl(value))
+            return self._from_cached(short_code, value)
+
+        self._count('misses')
+        row, ttl = await self._aload(short_code)
+        self._check_filter(short_code, row)
+        value, ttl = self._entry(row, ttl)
+        await self.shared.aset(self.key_prefix + short_code, value, ttl)
+        self.local.set(short_code, value, self._local_ttl(value))
+        return None if value == _NEGATIVE else _build(short_code, value)
+
+    def prime_many(self, rows):
+        """
+        Store (short_code, pk, target_url, is_private) rows in both tiers, e.g.
+        right after creating them, so no worker has to look them up
+        """
+        if not settings.REDIRECT_CACHE_ENABLED:
+            return
+        entries = {}
+        for short_code, *row in rows:
+            value, _ = self._entry(row)
+            entries[self.key_prefix + short_code] = value
+            self.local.set(short_code, value, self._local_ttl(value))
+        if entries:
+            self.shared.set_many(entries, self._shared_ttl(settings.REDIRECT_CACHE_SHARED_TTL))
+
+    def replace(self, short_code, row):
+        """Cache a code's new (pk, target_url, is_private) row, or None once deleted"""
+        if settings.REDIRECT_CACHE_ENABLED:
+            self._store(short_code, row)
+
+    def invalidate(self, short_code):
+        """Drop a code from both tiers (after create, update or delete)"""
+        self._count('invalidations')
+        self.local.delete(short_code)
+        self.shared.delete(self.key_prefix + short_code)
+
+    def invalidate_many(self, short_codes):
+        short_codes = list(short_codes)
+        for short_code in short_codes:
+            self._count('invalidations')
+            self.local.delete(short_code)
+        self.shared.delete_many([self.key_prefix + code for code in short_codes])
+
+    def clear(self):
+        self.local.clear()
+
+
+def _snapshot_ttl():
+    # Edits reach the snapshot with the next delta; don't outlive the time
+    # the snapshot itself is trusted
+    ttl = min(settings.REDIRECT_CACHE_SHARED_TTL, settings.REDIRECT_SNAPSHOT_DELTA_INTERVAL)
+    return max(1, min(ttl, int(redirect_snapshot.trusted_for())))
+
+
+def _build(short_code, row):
+    pk, target_url, is_private = row
+    return ResolvedURL(pk, short_code, target_url, is_private)
+
+
+resolution_cache = ResolutionCache()
@@ -0,0 +1,310 @@
+"""
+Short code generation.
+
+The generator class is chosen by ``settings.SHORT_CODE_GENERATOR``:
+
+- ``SequenceCodeGenerator`` (default) base62-encodes IDs taken from a
+  database sequence. Each process reserves a block of IDs at a time, so most
+  codes cost no query at all, and codes never collide with each other. IDs
+  are optionally run through a keyed bijective permutation of the keyspace
+  so consecutive codes don't look consecutive. This is obfuscation, not
+  security: keep private URLs private with ``is_private``.
+- ``RandomCodeGenerator`` is the original random-retry strategy. It is also
+  the fallback for lengths other than ``SHORT_CODE_LENGTH`` and for a
+  sequence whose keyspace is exhausted.
+"""
+import hashlib
+import logging
+import os
+import random
+import string
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+ALPHABET = string.digits + string.ascii_letters
+BASE = len(ALPHABET)
+MAX_CODE_LENGTH = 10
+
+
+def encode_base62(number, length):
+    """Fixed-width base62 encoding of a non-negative integer"""
+    if number < 0 or number >= BASE ** length:
+        raise ValueError(f'{number} does not fit in {length} base62 digits')
+    digits = []
+    for _ in range(length):
+        number, digit = divmod(number, BASE)
+        digits.append(ALPHABET[digit])
+    return ''.join(reversed(digits))
+
+
+def decode_base62(code):
+    number = 0
+    for char in code:
+        number = number * BASE + ALPHABET.index(char)
+    return number
+
+
+class KeyspacePermutation:
+    """
+    Keyed bijection on [0, 62**length).
+
+    Each round is an affine map modulo the keyspace size followed by a keyed
+    substitution of every base62 digit and a digit reversal; every step is a
+    bijection, so the composition is too.
+    """
+
+    rounds = 3
+
+    def __init__(self, length, key):
+        self.length = length
+        self.size = BASE ** length
+        seed = hashlib.sha256(f'{key}:{length}'.encode()).digest()
+        rng = random.Random(seed)
+        self._rounds = []
+        for _ in range(self.rounds):
+            multiplier = rng.randrange(1, self.size)
+            # 62**n = 2**n * 31**n: coprime means odd and not a multiple of 31
+            while multiplier % 2 == 0 or multiplier % 31 == 0:
+                multiplier = rng.randrange(1, self.size)
+            offset = rng.randrange(self.size)
+            tables = []
+            for _ in range(length):
+                table = list(range(BASE))
+                rng.shuffle(table)
+                tables.append(table)
+            self._rounds.append((multiplier, offset, tables))
+
+    def __call__(self, number):
+        for multiplier, offset, tables in self._rounds:
+            number = (number * multiplier + offset) % self.size
+            digits = []
+            for table in tables:
+                number, digit = divmod(number, BASE)
+                digits.append(table[digit])
+            # digits are least significant first; rebuilding in that order reverses them
+            for digit in digits:
+                number = number * BASE + digit
+        return number
+
+
+class CodeGenerator:
+    """Base class for pluggable short code generators"""
+
+    def generate(self, length):
+        return self.generate_many(1, length)[0]
+
+    def generate_many(self, count, length):
+        raise NotImplementedError
+
+    def discard_reserved(self):
+        """Forget any reserved state after a unique constraint collision"""
+
+
+class RandomCodeGenerator(CodeGenerator):
+    """Random codes, checked against the database for collisions"""
+
+    characters = string.ascii_letters + string.digits
+
+    def generate_many(self, count, length):
+        from .bloom import code_filter
+        from .sharding import codes_in_use
+
+        codes = []
+        while len(codes) < count:
+            candidates = {
+                ''.join(random.choices(self.characters, k=length))
+                for _ in range(count - len(codes))
+            }
+            candidates.difference_update(codes)
+            # Codes the filter has never seen need no query; the unique
+            # constraint still catches one created elsewhere since its refresh
+            maybe_taken = {code for code in candidates if code_filter.might_exist(code)}
+            taken = codes_in_use(maybe_taken) if maybe_taken else set()
+            codes.extend(candidates - taken)
+        return codes
+
+
+def _in_callers_transaction(connection):
+    # TestCase wraps every test in atomic blocks of its own; as for
+    # atomic(durable=True), only blocks opened inside those count
+    return connection.in_atomic_block and bool(connection.atomic_blocks) and not (
+        connection.atomic_blocks[-1]._from_testcase
+    )
+
+
+class IDBlockAllocator:
+    """
+    Hands out IDs from per-process blocks reserved in ShortCodeSequence.
+    ``initial`` returns the first ID of a sequence that doesn't exist yet;
+    the rest of a block is given up after ``max_age`` seconds, if set.
+    """
+
+    def __init__(self, name, block_size, initial=None, max_age=None):
+        self.name = name
+        self.block_size = block_size
+        self.initial = initial
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+        self._pid = None
+        self._reserved_at = 0
+
+    def _reserve_block(self, size, needed):
+        """
+        Advance the sequence by ``size`` and keep the IDs it skipped over.
+
+        The reservation commits on its own: inside the caller's transaction
+        the sequence row would stay locked until that commits, and a rollback
+        would hand this block out again while this process still uses it. So
+        there it runs on a connection of its own, except on SQLite (one
+        writer at a time), where it joins the caller's transaction and takes
+        only the ``needed`` IDs, keeping none a rollback could recycle.
+        """
+        connection = transaction.get_connection()
+        if not _in_callers_transaction(connection):
+            with transaction.atomic():
+                end = self._advance(size)
+        elif connection.vendor != 'sqlite':
+            end = self._advance_separately(size)
+        else:
+            size = needed
+            with transaction.atomic():
+                end = self._advance(size)
+        self._next, self._end = end - size, end
+        self._pid = os.getpid()
+        self._reserved_at = time.monotonic()
+
+    def _initial(self):
+        return self.initial() if self.initial else 0
+
+    def _advance(self, size):
+        from .models import ShortCodeSequence
+
+        sequence = ShortCodeSequence.objects.filter(name=self.name)
+        if not sequence.update(next_value=F('next_value') + size):
+            ShortCodeSequence.objects.get_or_create(
+                name=self.name, defaults={'next_value': self._initial()}
+            )
+            sequence.update(next_value=F('next_value') + size)
+        return sequence.values_list('next_value', flat=True).get()
+
+    def _advance_separately(self, size):
+        """_advance() on a new autocommit connection to the default database"""
+        from .models import ShortCodeSequence
+
+        initial = self._initial()
+        other = connections.create_connection(DEFAULT_DB_ALIAS)
+        table = other.ops.quote_name(ShortCodeSequence._meta.db_table)
+        try:
+            with other.cursor() as cursor:
+                cursor.execute(f'SELECT 1 FROM {table} WHERE name = %s', [self.name])
+                if cursor.fetchone() is None:
+                    try:
+                        cursor.execute(
+                            f'INSERT INTO {table} (name, next_value) VALUES (%s, %s)',
+                            [self.name, initial],
+                        )
+                    except IntegrityError:
+                        pass  # Created by another process meanwhile
+                other.set_autocommit(False)
+                cursor.execute(
+                    f'UPDATE {table} SET next_value = next_value + %s WHERE name = %s',
+                    [size, self.name],
+                )
+                cursor.execute(f'SELECT next_value FROM {table} WHERE name = %s', [self.name])
+                end = cursor.fetchone()[0]
+                other.commit()
+        finally:
+            other.close()
+        return end
+
+    def take(self, count):
+        """Return a list of ``count`` unused IDs"""
+        ids = []
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked worker must not reuse its parent's block
+                self._next = self._end = 0
+            if self.max_age is not None and time.monotonic() - self._reserved_at > self.max_age:
+                self._next = self._end = 0
+            while len(ids) < count:
+                if self._next >= self._end:
+                    # Large requests (bulk uploads) get one block of their own size
+                    needed = count - len(ids)
+                    self._reserve_block(max(self.block_size, needed), needed)
+                take = min(count - len(ids), self._end - self._next)
+                ids.extend(range(self._next, self._next + take))
+                self._next += take
+        return ids
+
+    def discard(self):
+        with self._lock:
+            self._next = self._end = 0
+
+
+class SequenceCodeGenerator(CodeGenerator):
+    """Base62 codes from a block-allocated ID sequence; no uniqueness queries"""
+
+    fallback_class = RandomCodeGenerator
+
+    def __init__(self):
+        self.length = settings.SHORT_CODE_LENGTH
+        self.allocator = IDBlockAllocator(
+            f'short_code:{self.length}', settings.SHORT_CODE_BLOCK_SIZE
+        )
+        self.permutation = (
+            KeyspacePermutation(self.length, settings.SHORT_CODE_SCRAMBLE_KEY)
+            if settings.SHORT_CODE_SCRAMBLE else None
+        )
+        self.fallback = self.fallback_class()
+
+    def encode(self, number):
+        if self.permutation is not None:
+            number = self.permutation(number)
+        return encode_base62(number, self.length)
+
+    def generate_many(self, count, length):
+        if length != self.length:
+            return self.fallback.generate_many(count, length)
+
+        ids = self.allocator.take(count)
+        keyspace = BASE ** self.length
+        codes = [self.encode(number) for number in ids if number < keyspace]
+        if len(codes) < count:
+            logger.warning(
+                'Short code keyspace for length %d is exhausted; using %d-character codes',
+                self.length, min(self.length + 1, MAX_CODE_LENGTH),
+            )
+            codes += self.fallback.generate_many(
+                count - len(codes), min(self.length + 1, MAX_CODE_LENGTH)
+            )
+        return codes
+
+    def discard_reserved(self):
+        self.allocator.discard()
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def get_code_generator():
+    """Return the process-wide generator configured in settings"""
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                _generator = import_string(settings.SHORT_CODE_GENERATOR)()
+    return _generator
+
+
+def reset_code_generator():
+    global _generator
+    _generator = None
@@ -0,0 +1,185 @@
+"""
+Redirects served by nginx, and counting the visits it served.
+
+``write_nginx_map()`` (the ``export_nginx_map`` command) writes an nginx
+``map`` of the busiest public short codes to their targets, e.g.::
+
+    map $uri $short_code_target {
+        default "";
+        /abc123/ "https://example.com/";
+    }
+
+frontend/nginx.conf includes it and answers mapped codes with a 302 itself
+in its ``location /``, leaving every other path (SPA routes included) as it
+was. The file is replaced atomically, so it
+can be regenerated from cron followed by ``nginx -s reload``. Targets nginx
+would misread (quotes, ``$``, braces, whitespace...) are left out and keep
+going through Django.
+
+nginx logs the redirects it served as JSON lines (the ``shortener_edge``
+log format). ``import_edge_visits()`` (the ``import_edge_visits`` command)
+reads them into the visit log and its rollups through ``write_visits()``,
+like the visit pipeline does, remembering how far it got so it can run
+against the live log every few minutes. The view counts are flushed before
+it returns, so they don't wait for the command process to exit.
+"""
+import json
+import os
+import re
+import tempfile
+from datetime import datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+from .counters import view_counter
+from .models import ShortURL
+from .sharding import group_by_shard, on_shard, shard_for_code, shard_for_pk
+from .tracking import VisitEvent, write_visits
+from .warmup import ranked_ids_across_shards
+
+# Characters that would need escaping inside a quoted nginx string
+UNSAFE_TARGET = re.compile(r'["\\$;{}\s]')
+EDGE_URI = re.compile(r'^/([0-9A-Za-z]{1,10})/$')
+LOOKUP_CHUNK_SIZE = 500
+
+
+def _atomic_write(path, text):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, partial = tempfile.mkstemp(dir=directory, prefix='.edge-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(partial, 0o644)
+        os.replace(partial, path)
+    except BaseException:
+        os.unlink(partial)
+        raise
+
+
+def render_nginx_map(limit, ranking='recent', days=7):
+    """The map file's contents and the number of codes in it"""
+    public = ShortURL.objects.filter(is_private=False)
+    ids = ranked_ids_across_shards(limit, ranking, days, queryset=public)
+    targets = {}
+    for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+        chunk = ids[start:start + LOOKUP_CHUNK_SIZE]
+        for alias, pks in group_by_shard(chunk, shard_for_pk).items():
+            with on_shard(alias):
+                rows = public.filter(pk__in=pks)
+                targets.update(rows.values_list('short_code', 'target_url'))
+
+    lines = [
+        f'# Generated by export_nginx_map at {timezone.now().isoformat()}; do not edit.',
+        'map $uri $short_code_target {',
+        '    default "";',
+    ]
+    count = 0
+    for short_code in sorted(targets):
+        target_url = targets[short_code]
+        if UNSAFE_TARGET.search(target_url):
+            continue
+        lines.append(f'    /{short_code}/ "{target_url}";')
+        count += 1
+    lines.append('}')
+    return '\n'.join(lines) + '\n', count
+
+
+def write_nginx_map(path=None, limit=None, ranking='recent', days=7):
+    """Replace the map file atomically; returns the number of codes in it"""
+    path = path or settings.NGINX_MAP_PATH
+    limit = settings.NGINX_MAP_LIMIT if limit is None else limit
+    text, count = render_nginx_map(limit, ranking, days)
+    _atomic_write(path, text)
+    return count
+
+
+def parse_edge_line(line):
+    """(short_code, VisitEvent fields) of one shortener_edge log line, or None"""
+    try:
+        entry = json.loads(line)
+        match = EDGE_URI.match(entry['uri'])
+        accessed_at = datetime.fromisoformat(entry['time'])
+    except (ValueError, KeyError, TypeError):
+        return None
+    if match is None or int(entry.get('status', 0)) != 302:
+        return None
+    return match.group(1), {
+        'user_id': None,
+        'ip_address': entry.get('ip') or '0.0.0.0',
+        'user_agent': (entry.get('user_agent') or '')[:500],
+        'accessed_at': accessed_at,
+        'referrer': (entry.get('referrer') or '')[:500],
+    }
+
+
+def _write_batch(parsed):
+    """Resolve the codes of parsed lines and write their visits"""
+    codes = {short_code for short_code, _ in parsed}
+    ids = {}
+    for alias, shard_codes in group_by_shard(codes, shard_for_code).items():
+        with on_shard(alias):
+            ids.update(
+                ShortURL.objects
+                .filter(short_code__in=shard_codes)
+                .values_list('short_code', 'pk')
+            )
+    events = [
+        VisitEvent(short_url_id=ids[short_code], **fields)
+        for short_code, fields in parsed
+        if short_code in ids
+    ]
+    if events:
+        write_visits(events)
+    return len(events)
+
+
+def _read_state(state_path):
+    try:
+        with open(state_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def import_edge_visits(log_path, state_path=None, batch_size=None):
+    """
+    Import the redirects nginx logged since the last run.
+
+    Progress (inode and byte offset) is kept in ``state_path`` (default
+    ``<log>.offset``); a rotated or truncated log is read from the start.
+    Only complete lines are consumed. Returns (visits imported, lines
+    skipped).
+    """
+    state_path = state_path or f'{log_path}.offset'
+    batch_size = batch_size or settings.VISIT_BATCH_SIZE
+    state = _read_state(state_path)
+    stat = os.stat(log_path)
+    offset = state.get('offset', 0)
+    if state.get('inode') != stat.st_ino or offset > stat.st_size:
+        offset = 0
+
+    imported = skipped = 0
+    parsed = []
+    with open(log_path, 'rb') as f:
+        f.seek(offset)
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break  # still being written
+            offset += len(raw)
+            line = parse_edge_line(raw.decode('utf-8', 'replace'))
+            if line is None:
+                skipped += 1
+                continue
+            parsed.append(line)
+            if len(parsed) >= batch_size:
+                imported += _write_batch(parsed)
+                parsed = []
+                _atomic_write(state_path, json.dumps({'inode': stat.st_ino, 'offset': offset}))
+    imported += _write_batch(parsed) if parsed else 0
+    _atomic_write(state_path, json.dumps({'inode': stat.st_ino, 'offset': offset}))
+    view_counter.flush()
+    return imported, skipped
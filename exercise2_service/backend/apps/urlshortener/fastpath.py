@@ -0,0 +1,87 @@
+"""
+Redirect fast path in front of the Django WSGI application.
+
+``RedirectFastPath`` wraps the WSGI app (see project/wsgi.py) and answers
+``GET``/``HEAD /<short_code>/`` for public URLs straight from the
+resolution cache: no URL routing, middleware, DRF content negotiation,
+authentication or throttling. Visits are still recorded through the visit
+pipeline, without a user since no authentication happens here.
+
+Everything else is passed to Django untouched: other paths and methods,
+private URLs (which need the authenticated DRF ``RedirectView``), unknown
+codes (so Django renders the 404) and requests for hosts not in
+``ALLOWED_HOSTS``.
+"""
+import re
+
+from django.conf import settings
+from django.core import signals
+from django.http.request import split_domain_port, validate_host
+from django.utils.encoding import iri_to_uri
+
+from .cache import resolution_cache
+from .replicas import replica_reads
+from .tracking import visit_event_from_meta, visit_pipeline
+
+SHORT_CODE_PATH = re.compile(r'^/([0-9A-Za-z]{1,10})/$')
+
+
+class RedirectFastPath:
+    """WSGI middleware serving public short code redirects"""
+
+    def __init__(self, application):
+        self.application = application
+        self.reserved = set(settings.REDIRECT_FAST_PATH_RESERVED)
+
+    def __call__(self, environ, start_response):
+        short_code = self._match(environ)
+        if short_code is None:
+            return self.application(environ, start_response)
+
+        # Keep Django's per-request connection housekeeping (CONN_MAX_AGE etc.)
+        signals.request_started.send(sender=self.__class__, environ=environ)
+        try:
+            with replica_reads():
+                short_url = resolution_cache.resolve(short_code)
+            if short_url is not None and not short_url.is_private:
+                visit_pipeline.record(visit_event_from_meta(environ, short_url.pk))
+        finally:
+            signals.request_finished.send(sender=self.__class__)
+
+        if short_url is None or short_url.is_private:
+            return self.application(environ, start_response)
+        start_response('302 Found', self._headers(short_url.target_url))
+        return [b'']
+
+    def _match(self, environ):
+        if environ.get('REQUEST_METHOD') not in ('GET', 'HEAD'):
+            return None
+        match = SHORT_CODE_PATH.match(environ.get('PATH_INFO', ''))
+        if match is None or match.group(1) in self.reserved:
+            return None
+        if not self._host_allowed(environ):
+            return None
+        return match.group(1)
+
+    @staticmethod
+    def _host_allowed(environ):
+        host = environ.get('HTTP_HOST') or environ.get('SERVER_NAME', '')
+        domain, _ = split_domain_port(host)
+        return bool(domain) and validate_host(domain, settings.ALLOWED_HOSTS)
+
+    @staticmethod
+    def _headers(target_url):
+        headers = [
+            ('Location', iri_to_uri(target_url)),
+            ('Content-Type', 'text/html; charset=utf-8'),
+            ('Content-Length', '0'),
+        ]
+        # What SecurityMiddleware would have added to the redirect
+        if settings.SECURE_CONTENT_TYPE_NOSNIFF:
+            headers.append(('X-Content-Type-Options', 'nosniff'))
+        policy = settings.SECURE_REFERRER_POLICY
+        if policy:
+            if not isinstance(policy, str):
+                policy = ','.join(policy)
+            headers.append(('Referrer-Policy', policy))
+        return headers
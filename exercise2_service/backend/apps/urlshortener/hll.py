@@ -0,0 +1,143 @@
+"""
+HyperLogLog sketches for approximate distinct counting.
+
+A sketch with precision ``p`` has ``2**p`` one-byte registers; the default
+p=12 gives a standard error of about 1.6%, however many values are added.
+Sketches with the same precision merge by taking the register-wise maximum,
+so per-day sketches combine into any date range and sketches built in
+different processes combine into one.
+
+A sketch starts sparse: only the registers that were set, stored as sorted
+(index, rank) pairs of 3 bytes each, so a URL's daily sketch costs a few
+bytes per distinct visitor. Past ``2**p / 4`` set registers it turns dense,
+all registers at one byte each (4 KB at p=12), and stays that way. Stored
+sketches of either kind load and merge with each other.
+"""
+import hashlib
+import math
+import struct
+
+DEFAULT_PRECISION = 12
+HASH_BITS = 64
+
+SPARSE_MARKER = b'S'
+PAIR = struct.Struct('<HB')
+
+
+def _hash(value):
+    if not isinstance(value, bytes):
+        value = str(value).encode()
+    return int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """Mergeable distinct-count estimator"""
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError('precision must be between 4 and 16')
+        self.precision = precision
+        self.size = 1 << precision
+        self.sparse_limit = self.size // 4
+        # Set registers while sparse (registers is None), else None
+        self.sparse = None
+        if registers is None:
+            self.sparse = {}
+            self.registers = None
+        elif len(registers) != self.size:
+            raise ValueError(f'expected {self.size} registers, got {len(registers)}')
+        else:
+            self.registers = bytearray(registers)
+
+    @classmethod
+    def from_bytes(cls, data, precision=DEFAULT_PRECISION):
+        """Load a stored sketch; empty or missing data gives an empty sketch"""
+        sketch = cls(precision)
+        if not data:
+            return sketch
+        data = bytes(data)
+        if len(data) == sketch.size:
+            return cls(precision, data)
+        if data[:1] != SPARSE_MARKER or (len(data) - 1) % PAIR.size:
+            raise ValueError(f'not a sketch of precision {precision}')
+        for index, rank in PAIR.iter_unpack(data[1:]):
+            sketch._raise(index, rank)
+        return sketch
+
+    def to_bytes(self):
+        if self.sparse is not None:
+            return SPARSE_MARKER + b''.join(
+                PAIR.pack(index, self.sparse[index]) for index in sorted(self.sparse)
+            )
+        return bytes(self.registers)
+
+    def _densify(self):
+        self.registers = bytearray(self.size)
+        for index, rank in self.sparse.items():
+            self.registers[index] = rank
+        self.sparse = None
+
+    def _raise(self, index, rank):
+        if self.sparse is None:
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+        elif rank > self.sparse.get(index, 0):
+            self.sparse[index] = rank
+            if len(self.sparse) > self.sparse_limit:
+                self._densify()
+
+    def add(self, value):
+        hashed = _hash(value)
+        index = hashed >> (HASH_BITS - self.precision)
+        rest_bits = HASH_BITS - self.precision
+        rest = hashed & ((1 << rest_bits) - 1)
+        self._raise(index, rest_bits - rest.bit_length() + 1)
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        """Fold another sketch into this one, in place"""
+        if other.precision != self.precision:
+            raise ValueError('cannot merge sketches with different precision')
+        if other.sparse is not None:
+            for index, rank in other.sparse.items():
+                self._raise(index, rank)
+        else:
+            if self.sparse is not None:
+                self._densify()
+            self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        """Estimated number of distinct values added"""
+        size = self.size
+        if size == 16:
+            alpha = 0.673
+        elif size == 32:
+            alpha = 0.697
+        elif size == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / size)
+        if self.sparse is not None:
+            zeros = size - len(self.sparse)
+            total = zeros + sum(2.0 ** -rank for rank in self.sparse.values())
+        else:
+            zeros = self.registers.count(0)
+            total = sum(2.0 ** -register for register in self.registers)
+        estimate = alpha * size * size / total
+        if estimate <= 2.5 * size and zeros:
+            # Small cardinalities: linear counting is much more accurate
+            estimate = size * math.log(size / zeros)
+        return round(estimate)
+
+
+def merged(sketches, precision=DEFAULT_PRECISION):
+    """Merge stored sketches (bytes or None) into one HyperLogLog"""
+    result = HyperLogLog(precision)
+    for data in sketches:
+        if data:
+            result.merge(HyperLogLog.from_bytes(data, precision))
+    return result
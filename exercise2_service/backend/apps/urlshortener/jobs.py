@@ -0,0 +1,231 @@
+"""
+Background processing of large bulk uploads.
+
+``BulkUploadView`` stores the upload as a ``BulkUploadJob`` and returns the
+job ID straight away; the job then runs in a local thread pool (no external
+broker). Every batch of lines commits its URLs, its per-line
+``BulkUploadResult`` rows and the job's progress counters together, so
+clients can poll progress and page through results while the job runs.
+
+The thread pool doesn't survive a restart, so jobs keep a heartbeat: at
+startup (and with the recover_upload_jobs command) pending or running jobs
+whose heartbeat is older than ``BULK_UPLOAD_STALE_AFTER`` are queued again
+and pick up after the last committed batch.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import serializers
+
+from .bulk import INSERT_CHUNK_SIZE, create_short_urls, iter_upload_lines
+from .models import BulkUploadJob, BulkUploadResult
+from .sharding import atomic_on_shards
+from .validation import validate_many
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.BULK_UPLOAD_WORKERS,
+                    thread_name_prefix='bulk-upload',
+                )
+    return _executor
+
+
+def submit_job(job):
+    """Queue a saved job once the surrounding transaction commits"""
+    transaction.on_commit(partial(_queue, job.pk))
+
+
+def _queue(job_id):
+    if settings.BULK_UPLOAD_WORKERS <= 0:
+        run_job(job_id)
+    else:
+        _get_executor().submit(_run_in_worker, job_id)
+
+
+def _run_in_worker(job_id):
+    close_old_connections()
+    try:
+        run_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def _iter_urls(upload):
+    for line in iter_upload_lines(upload):
+        url = line.strip()
+        if url:
+            yield url
+
+
+def run_job(job_id):
+    """
+    Process a stored upload batch by batch, committing progress as it goes.
+
+    A job that was interrupted resumes after the lines it had committed. Jobs
+    another call has already started (e.g. queued twice by a recovery) are
+    left alone.
+    """
+    now = timezone.now()
+    claimed = BulkUploadJob.objects.filter(
+        pk=job_id, status=BulkUploadJob.STATUS_PENDING
+    ).update(status=BulkUploadJob.STATUS_RUNNING, heartbeat_at=now)
+    if not claimed:
+        return
+    BulkUploadJob.objects.filter(pk=job_id, started_at__isnull=True).update(started_at=now)
+    job = BulkUploadJob.objects.select_related('owner').get(pk=job_id)
+    try:
+        with job.file.open('rb') as upload:
+            total = sum(1 for _ in _iter_urls(upload))
+        if total > settings.MAX_URLS_PER_ASYNC_UPLOAD:
+            raise serializers.ValidationError(
+                f'Maximum {settings.MAX_URLS_PER_ASYNC_UPLOAD} URLs allowed per upload. '
+                f'Your file contains {total} URLs.'
+            )
+        BulkUploadJob.objects.filter(pk=job.pk).update(
+            total=total, heartbeat_at=timezone.now()
+        )
+
+        batch = []
+        with job.file.open('rb') as upload:
+            for line_number, url in enumerate(_iter_urls(upload), start=1):
+                if line_number <= job.processed:
+                    continue  # Committed before the job was interrupted
+                batch.append((line_number, url))
+                if len(batch) >= INSERT_CHUNK_SIZE:
+                    _process_batch(job, batch)
+                    batch = []
+            _process_batch(job, batch)
+    except Exception as e:
+        if isinstance(e, UnicodeDecodeError):
+            error = 'File must be UTF-8 encoded text.'
+        elif isinstance(e, serializers.ValidationError):
+            error = ' '.join(str(message) for message in e.detail)
+        else:
+            logger.exception('Bulk upload job %s failed', job.pk)
+            error = 'Unexpected error while processing the upload.'
+        BulkUploadJob.objects.filter(pk=job.pk).update(
+            status=BulkUploadJob.STATUS_FAILED, error=error, finished_at=timezone.now()
+        )
+    else:
+        BulkUploadJob.objects.filter(pk=job.pk).update(
+            status=BulkUploadJob.STATUS_COMPLETED, finished_at=timezone.now()
+        )
+    finally:
+        job.file.delete(save=False)
+        BulkUploadJob.objects.filter(pk=job.pk).update(file='')
+
+
+def _process_batch(job, batch):
+    if not batch:
+        return
+    results = []
+    valid = []
+    errors = validate_many([url for _, url in batch])
+    for (line_number, url), error in zip(batch, errors):
+        if error is not None:
+            results.append(BulkUploadResult(
+                job=job,
+                line_number=line_number,
+                original_url=url,
+                status='failed',
+                error=error,
+            ))
+        else:
+            valid.append((line_number, url))
+
+    with atomic_on_shards():
+        created = create_short_urls([(url, False) for _, url in valid], owner=job.owner)
+        results += [
+            BulkUploadResult(
+                job=job,
+                line_number=line_number,
+                original_url=url,
+                short_code=short_url.short_code,
+                status='success',
+            )
+            for (line_number, url), short_url in zip(valid, created)
+        ]
+        BulkUploadResult.objects.bulk_create(results)
+        BulkUploadJob.objects.filter(pk=job.pk).update(
+            processed=F('processed') + len(batch),
+            success=F('success') + len(created),
+            failed=F('failed') + len(batch) - len(created),
+            heartbeat_at=timezone.now(),
+        )
+
+
+def recover_stale_jobs(stale_after=None, dry_run=False, inline=False):
+    """
+    Queue pending or running jobs again whose heartbeat is older than
+    ``stale_after`` seconds (default ``BULK_UPLOAD_STALE_AFTER``), i.e. jobs
+    lost with the thread pool of a worker that was restarted. Jobs whose
+    stored file is gone are failed instead. With ``inline`` the jobs run in
+    the calling thread. Returns the jobs queued again (every stale job with
+    ``dry_run``).
+    """
+    if stale_after is None:
+        stale_after = settings.BULK_UPLOAD_STALE_AFTER
+    stale = list(BulkUploadJob.objects.filter(
+        status__in=[BulkUploadJob.STATUS_PENDING, BulkUploadJob.STATUS_RUNNING],
+        heartbeat_at__lt=timezone.now() - timedelta(seconds=stale_after),
+    ))
+    if dry_run:
+        return stale
+
+    recovered = []
+    for job in stale:
+        # Only one worker takes over a job when several start at once
+        claim = BulkUploadJob.objects.filter(pk=job.pk, heartbeat_at=job.heartbeat_at)
+        if not job.file or not job.file.storage.exists(job.file.name):
+            claim.update(
+                status=BulkUploadJob.STATUS_FAILED,
+                error='The upload was interrupted and its file is no longer available.',
+                finished_at=timezone.now(),
+                file='',
+            )
+            continue
+        if not claim.update(status=BulkUploadJob.STATUS_PENDING, heartbeat_at=timezone.now()):
+            continue
+        logger.warning('Resuming bulk upload job %s after %s lines', job.pk, job.processed)
+        recovered.append(job)
+        if inline:
+            run_job(job.pk)
+        else:
+            _queue(job.pk)
+    return recovered
+
+
+def _recover_in_worker():
+    close_old_connections()
+    try:
+        recover_stale_jobs()
+    except Exception:
+        logger.exception('Recovering stale bulk upload jobs failed')
+    finally:
+        close_old_connections()
+
+
+def recover_in_background():
+    """Queue stale jobs again without blocking worker startup"""
+    thread = threading.Thread(
+        target=_recover_in_worker, name='bulk-upload-recovery', daemon=True
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.urlshortener.partitions import archive_visits
+from apps.urlshortener.sharding import shards
+
+
+class Command(BaseCommand):
+    help = (
+        'Move visits older than the retention period to gzipped CSV files, one '
+        'per month and shard (other shards than default write to a subdirectory '
+        'named after it). On PostgreSQL each month is a partition that is '
+        'detached and dropped after export; elsewhere rows are deleted in '
+        'chunks. Daily rollups are kept.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-months', type=int,
+                            default=settings.VISIT_RETENTION_MONTHS,
+                            help='Full months to keep besides the current one')
+        parser.add_argument('--archive-dir', default=settings.VISIT_ARCHIVE_DIR,
+                            help='Directory the archive files are written to')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list the months that would be archived')
+        parser.add_argument('--database', choices=shards(),
+                            help='Only this shard (default: all of them)')
+
+    def handle(self, *args, **options):
+        if options['retention_months'] < 0:
+            raise CommandError('--retention-months cannot be negative')
+        aliases = [options['database']] if options['database'] else shards()
+        archived = []
+        for alias in aliases:
+            try:
+                months = archive_visits(
+                    options['retention_months'],
+                    options['archive_dir'],
+                    dry_run=options['dry_run'],
+                    using=alias,
+                )
+            except FileExistsError as e:
+                raise CommandError(str(e))
+            for month, path, rows in months:
+                if rows is None:
+                    self.stdout.write(f'Would archive {month:%Y-%m} of {alias} to {path}')
+                else:
+                    self.stdout.write(
+                        f'Archived {rows} visits from {month:%Y-%m} of {alias} to {path}'
+                    )
+            archived += months
+        verb = 'would be archived' if options['dry_run'] else 'archived'
+        self.stdout.write(self.style.SUCCESS(f'{len(archived)} months {verb}.'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.urlshortener.analytics import backfill_rollups
+from apps.urlshortener.models import ShortURL
+from apps.urlshortener.sharding import on_shard, shards
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild URLVisitDaily rows and ShortURL.last_visited_at from the raw '
+        'URLVisit log, a chunk of short URLs at a time. Safe to re-run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Short URLs processed per transaction')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        urls = rows = 0
+        for alias in shards():
+            last_pk = 0
+            while True:
+                with on_shard(alias):
+                    ids = list(
+                        ShortURL.objects.filter(pk__gt=last_pk)
+                        .order_by('pk')
+                        .values_list('pk', flat=True)[:chunk_size]
+                    )
+                    if not ids:
+                        break
+                    with transaction.atomic(using=alias):
+                        rows += backfill_rollups(ids)
+                urls += len(ids)
+                last_pk = ids[-1]
+                self.stdout.write(f'{urls} URLs processed, {rows} daily rows written')
+        self.stdout.write(self.style.SUCCESS(f'Backfilled rollups for {urls} URLs.'))
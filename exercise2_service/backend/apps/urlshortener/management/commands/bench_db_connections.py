@@ -0,0 +1,74 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import load_backend
+
+from apps.urlshortener.models import ShortURL
+
+MODES = {
+    # name: (ENGINE, CONN_MAX_AGE)
+    'new connection': ('django.db.backends.postgresql', 0),
+    'persistent': ('django.db.backends.postgresql', 60),
+    'pooled': ('project.pooled_postgresql', 0),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the database side of a redirect (connection handling plus '
+        'the short code lookup) with a new connection per request, with '
+        'persistent connections (CONN_MAX_AGE) and with the pooled backend, '
+        'against the configured PostgreSQL database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Simulated requests per mode')
+        parser.add_argument('--health-checks', action='store_true',
+                            help='Enable CONN_HEALTH_CHECKS for every mode')
+
+    def handle(self, *args, **options):
+        default = connections['default']
+        if default.vendor != 'postgresql':
+            raise CommandError('This benchmark needs a PostgreSQL database')
+        code = ShortURL.objects.values_list('short_code', flat=True).first()
+        if code is None:
+            raise CommandError('Create at least one short URL first')
+        sql = (
+            f'SELECT id, target_url, is_private FROM {ShortURL._meta.db_table} '
+            f'WHERE short_code = %s'
+        )
+
+        self.stdout.write(f"{'mode':<16} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for name, (engine, max_age) in MODES.items():
+            settings_dict = {
+                **default.settings_dict,
+                'ENGINE': engine,
+                'CONN_MAX_AGE': max_age,
+                'CONN_HEALTH_CHECKS': options['health_checks'],
+            }
+            wrapper = load_backend(engine).DatabaseWrapper(settings_dict, alias=f'bench-{name}')
+            latencies = self.measure(wrapper, sql, code, options['requests'])
+            wrapper.close()
+            latencies.sort()
+            self.stdout.write(
+                f'{name:<16} {len(latencies) / sum(latencies):>8.0f} '
+                f'{statistics.median(latencies) * 1000:>8.2f} '
+                f'{latencies[int(len(latencies) * 0.99) - 1] * 1000:>8.2f}'
+            )
+
+    @staticmethod
+    def measure(wrapper, sql, code, count):
+        latencies = []
+        for _ in range(count):
+            started = time.perf_counter()
+            # What request_started / request_finished do via close_old_connections()
+            wrapper.close_if_unusable_or_obsolete()
+            with wrapper.cursor() as cursor:
+                cursor.execute(sql, [code])
+                cursor.fetchone()
+            wrapper.close_if_unusable_or_obsolete()
+            latencies.append(time.perf_counter() - started)
+        return latencies
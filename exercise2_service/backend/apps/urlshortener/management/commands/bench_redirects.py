@@ -0,0 +1,72 @@
+import io
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+
+from apps.urlshortener.fastpath import RedirectFastPath
+from apps.urlshortener.models import ShortURL
+from apps.urlshortener.tracking import visit_pipeline
+
+
+def _start_response(status, headers, exc_info=None):
+    _start_response.status = status
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure redirects per second through the full Django/DRF stack and '
+        'through the WSGI fast path, calling the WSGI applications in-process '
+        '(no HTTP server or network in the measurement). Visits are recorded '
+        'as usual and removed afterwards with the temporary short URL.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests per measurement')
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        host = next(
+            (h for h in settings.ALLOWED_HOSTS if h != '*' and not h.startswith('.')),
+            'localhost',
+        )
+        short_url = ShortURL.objects.create(
+            short_code=ShortURL.generate_short_code(),
+            target_url='https://example.com/bench',
+        )
+        try:
+            django_app = get_wsgi_application()
+            fast_app = RedirectFastPath(django_app)
+            for label, app in (('django + drf', django_app), ('fast path', fast_app)):
+                rate, status = self.measure(app, short_url.short_code, host, count)
+                self.stdout.write(f'{label:<14} {rate:>10,.0f} req/s  ({status})')
+        finally:
+            visit_pipeline.shutdown()
+            short_url.delete()
+
+    def measure(self, app, short_code, host, count):
+        # Unique client IPs keep DRF's anonymous throttle out of the way
+        def environ(n):
+            return {
+                'REQUEST_METHOD': 'GET',
+                'PATH_INFO': f'/{short_code}/',
+                'QUERY_STRING': '',
+                'SERVER_NAME': host,
+                'SERVER_PORT': '80',
+                'HTTP_HOST': host,
+                'REMOTE_ADDR': f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}',
+                'HTTP_USER_AGENT': 'bench_redirects',
+                'wsgi.url_scheme': 'http',
+                'wsgi.input': io.BytesIO(),
+            }
+
+        # Warm up caches and lazily built state first
+        for n in range(min(count, 100)):
+            b''.join(app(environ(n), _start_response))
+        start = time.perf_counter()
+        for n in range(count):
+            b''.join(app(environ(n + 100), _start_response))
+        elapsed = time.perf_counter() - start
+        return count / elapsed, _start_response.status
@@ -0,0 +1,95 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models.functions import Length
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from apps.urlshortener.codegen import (
+    BASE,
+    RandomCodeGenerator,
+    SequenceCodeGenerator,
+    encode_base62,
+)
+from apps.urlshortener.models import ShortCodeSequence, ShortURL
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare short URL creation throughput of the random and sequence '
+        'code generators at 10%, 50% and 90% keyspace fill. Runs inside a '
+        'transaction that is rolled back, using a small code length so the '
+        'keyspace can actually be filled.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--length', type=int, default=2,
+                            help='Code length to benchmark (keyspace is 62**length)')
+        parser.add_argument('--count', type=int, default=200,
+                            help='URLs to create per measurement')
+        parser.add_argument('--fills', default='10,50,90',
+                            help='Comma-separated keyspace fill percentages')
+
+    def handle(self, *args, **options):
+        length = options['length']
+        keyspace = BASE ** length
+        fills = [int(value) for value in options['fills'].split(',')]
+
+        self.stdout.write(f'Keyspace: {keyspace} codes of length {length}\n')
+        self.stdout.write(f"{'strategy':<10} {'fill':>5} {'urls/s':>10} {'queries/url':>12}")
+        for fill in fills:
+            for name in ('random', 'sequence'):
+                rate, queries = self.measure(name, length, keyspace, fill, options['count'])
+                self.stdout.write(f'{name:<10} {fill:>4}% {rate:>10.1f} {queries:>12.2f}')
+
+    def measure(self, name, length, keyspace, fill, count):
+        filled = keyspace * fill // 100
+        if filled + count > keyspace:
+            count = keyspace - filled
+        try:
+            with transaction.atomic(), override_settings(SHORT_CODE_LENGTH=length):
+                generator = self.build(name, length, filled, keyspace)
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    for _ in range(count):
+                        ShortURL.objects.create(
+                            short_code=generator.generate(length),
+                            target_url='https://example.com/bench',
+                        )
+                    elapsed = time.perf_counter() - started
+                raise _Rollback
+        except _Rollback:
+            pass
+        return count / elapsed, len(queries) / count
+
+    def build(self, name, length, filled, keyspace):
+        # Codes of this length that already exist count towards the fill
+        existing = set(
+            ShortURL.objects.annotate(code_length=Length('short_code'))
+            .filter(code_length=length)
+            .values_list('short_code', flat=True)
+        )
+        filled = max(filled - len(existing), 0)
+        if name == 'random':
+            generator = RandomCodeGenerator()
+            numbers = random.sample(range(keyspace), filled)
+            codes = [encode_base62(number, length) for number in numbers]
+        else:
+            generator = SequenceCodeGenerator()
+            ShortCodeSequence.objects.update_or_create(
+                name=generator.allocator.name, defaults={'next_value': filled}
+            )
+            codes = [generator.encode(number) for number in range(filled)]
+        ShortURL.objects.bulk_create(
+            [
+                ShortURL(short_code=code, target_url='https://example.com/fill')
+                for code in codes if code not in existing
+            ],
+            batch_size=1000,
+        )
+        return generator
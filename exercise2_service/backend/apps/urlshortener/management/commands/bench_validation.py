@@ -0,0 +1,83 @@
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import URLValidator
+
+from apps.urlshortener.validation import check_target_url, validate_many
+
+# A test_urls.txt-style upload: mostly valid URLs, some repeats, some junk
+SAMPLE_URLS = [
+    'https://www.google.com',
+    'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+    'https://github.com/django/django/blob/main/django/core/validators.py#L70',
+    'https://stackoverflow.com/questions/7160737/how-to-validate-a-url-in-python',
+    'https://en.wikipedia.org/wiki/Uniform_Resource_Locator',
+    'http://example.com:8080/path/to/page?query=string&other=1',
+    'https://sub.domain.example.co.uk/a/b/c',
+    'https://www.google.com',
+    'www.example.com',
+    'ftp://files.example.com/archive.zip',
+    'not a url',
+    'https://' + 'a' * 2050 + '.com',
+]
+
+
+def legacy_check(value):
+    """ShortURLCreateSerializer.validate_target_url before validation.py"""
+    validator = URLValidator()
+    try:
+        validator(value)
+    except ValidationError:
+        return 'invalid'
+    if not value.startswith(('http://', 'https://')):
+        return 'scheme'
+    if len(value) > 2048:
+        return 'length'
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Microbenchmark of target URL validation: the old per-call validator '
+        'against check_target_url() and the batch validate_many(), over the '
+        'lines of a test_urls.txt-style file (or a built-in sample).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='Text file with one URL per line')
+        parser.add_argument('--count', type=int, default=1000,
+                            help='URLs per batch (the input is repeated to fill it)')
+        parser.add_argument('--rounds', type=int, default=20,
+                            help='Batches timed per implementation')
+
+    def handle(self, *args, **options):
+        if options['file']:
+            try:
+                with open(options['file'], encoding='utf-8') as f:
+                    urls = [line.strip() for line in f if line.strip()]
+            except OSError as e:
+                raise CommandError(str(e))
+        else:
+            urls = SAMPLE_URLS
+        if not urls:
+            raise CommandError('No URLs to validate')
+        batch = (urls * (options['count'] // len(urls) + 1))[:options['count']]
+
+        implementations = [
+            ('legacy', lambda values: [legacy_check(value) for value in values]),
+            ('check_target_url', lambda values: [check_target_url(value) for value in values]),
+            ('validate_many', validate_many),
+        ]
+        self.stdout.write(f'{len(batch)} URLs per batch ({len(set(batch))} distinct)\n')
+        self.stdout.write(f"{'implementation':<18} {'urls/s':>12} {'us/url':>8}")
+        for name, run in implementations:
+            run(batch)  # warm up
+            started = time.perf_counter()
+            for _ in range(options['rounds']):
+                run(batch)
+            elapsed = time.perf_counter() - started
+            checked = len(batch) * options['rounds']
+            self.stdout.write(
+                f'{name:<18} {checked / elapsed:>12.0f} {elapsed / checked * 1e6:>8.1f}'
+            )
@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.urlshortener.snapshot import build_snapshot, delta_path
+
+
+class Command(BaseCommand):
+    help = (
+        'Compile all public short code -> target URL mappings into the '
+        'memory-mapped redirect snapshot shared by the workers, or with '
+        '--delta only the changes since the last full build. Files are '
+        'replaced atomically; workers pick them up within seconds.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.REDIRECT_SNAPSHOT_PATH,
+                            help='Snapshot file (defaults to REDIRECT_SNAPSHOT_PATH)')
+        parser.add_argument('--delta', action='store_true',
+                            help='Write the delta file for the current snapshot instead')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path:
+            raise CommandError('Set REDIRECT_SNAPSHOT_PATH or pass --path')
+        started = time.monotonic()
+        try:
+            count = build_snapshot(path, delta=options['delta'])
+        except FileNotFoundError as e:
+            raise CommandError(str(e))
+        target = delta_path(path) if options['delta'] else path
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {count} records to {target} in {time.monotonic() - started:.2f}s.'
+        ))
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.urlshortener.partitions import create_partitions, is_partitioned
+from apps.urlshortener.sharding import shards
+
+
+class Command(BaseCommand):
+    help = (
+        'Create monthly URLVisit partitions from the current month up to '
+        '--months-ahead months ahead, on every shard (or --database). Run it '
+        'regularly (e.g. daily from cron) so visits never fall into the '
+        'DEFAULT partition.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int,
+                            default=settings.VISIT_PARTITION_MONTHS_AHEAD,
+                            help='Number of future months to prepare')
+        parser.add_argument('--database', choices=shards(),
+                            help='Only this shard (default: all of them)')
+
+    def handle(self, *args, **options):
+        aliases = [options['database']] if options['database'] else shards()
+        partitioned = [alias for alias in aliases if is_partitioned(alias)]
+        if not partitioned:
+            self.stdout.write('The visit table is not partitioned on this database; nothing to do.')
+            return
+        created = 0
+        for alias in partitioned:
+            names = create_partitions(options['months_ahead'], using=alias)
+            for name in names:
+                self.stdout.write(f'Created {name} on {alias}')
+            created += len(names)
+        self.stdout.write(self.style.SUCCESS(f'{created} partitions created.'))
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.urlshortener.edge import write_nginx_map
+from apps.urlshortener.warmup import RANKINGS
+
+
+class Command(BaseCommand):
+    help = (
+        'Write an nginx map of the busiest public short codes to their '
+        'targets (replaced atomically), so nginx redirects them without '
+        'reaching Django. Reload nginx afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.NGINX_MAP_PATH,
+                            help='Map file to write')
+        parser.add_argument('--limit', type=int, default=settings.NGINX_MAP_LIMIT,
+                            help='Most codes to include')
+        parser.add_argument('--ranking', choices=RANKINGS, default='recent',
+                            help='Rank by visits in the last --days days, or by all-time views')
+        parser.add_argument('--days', type=int, default=7,
+                            help='Days of daily rollups used by --ranking recent')
+
+    def handle(self, *args, **options):
+        count = write_nginx_map(
+            options['path'], options['limit'], options['ranking'], options['days']
+        )
+        self.stdout.write(self.style.SUCCESS(f"Wrote {count} codes to {options['path']}."))
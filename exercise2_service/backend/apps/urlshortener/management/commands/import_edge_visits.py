@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.urlshortener.edge import import_edge_visits
+
+
+class Command(BaseCommand):
+    help = (
+        'Record the redirects nginx served from the exported map, read from '
+        'its shortener_edge access log, as visits (with rollups and view '
+        'counts). Resumes where the previous run stopped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('log', nargs='+', help='nginx shortener_edge access log(s)')
+        parser.add_argument('--state',
+                            help='Progress file (defaults to <log>.offset; one log only)')
+
+    def handle(self, *args, **options):
+        if options['state'] and len(options['log']) > 1:
+            raise CommandError('--state can only be used with a single log')
+        for log in options['log']:
+            try:
+                imported, skipped = import_edge_visits(log, options['state'])
+            except OSError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f'{log}: {imported} visits imported, {skipped} lines skipped')
+        self.stdout.write(self.style.SUCCESS('Done.'))
@@ -0,0 +1,132 @@
+import asyncio
+import json
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Fire requests at a running server from many concurrent keep-alive '
+        'connections and report throughput and latency. Compare deployments by '
+        'pointing it at each, e.g. the WSGI server '
+        '(gunicorn project.wsgi -w 4) and the ASGI server '
+        '(uvicorn project.asgi:application --workers 4). Redirects are not followed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='e.g. http://localhost:8000/abc123/')
+        parser.add_argument('--requests', type=int, default=10000)
+        parser.add_argument('--concurrency', type=int, default=200)
+        parser.add_argument('--method', default='GET')
+        parser.add_argument('--json', dest='body',
+                            help='JSON request body, e.g. \'{"target_url": "https://example.com"}\'')
+        parser.add_argument('--header', action='append', default=[],
+                            help='Extra "Name: value" header (repeatable)')
+        parser.add_argument('--vary-client', action='store_true',
+                            help='Send a different X-Forwarded-For per request, so per-client '
+                                 'throttles measure their cost instead of rejecting')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('Only plain http:// URLs are supported')
+        body = b''
+        if options['body'] is not None:
+            try:
+                body = json.dumps(json.loads(options['body'])).encode()
+            except ValueError:
+                raise CommandError('--json must be valid JSON')
+
+        headers = [f'Host: {url.netloc}', 'Connection: keep-alive', 'User-Agent: loadtest']
+        if body:
+            headers += ['Content-Type: application/json', f'Content-Length: {len(body)}']
+        headers += options['header']
+        path = url.path or '/'
+        if url.query:
+            path += f'?{url.query}'
+        head = f'{options["method"].upper()} {path} HTTP/1.1\r\n' + '\r\n'.join(headers)
+
+        def build_request(n):
+            client = ''
+            if options['vary_client']:
+                client = f'\r\nX-Forwarded-For: 10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}'
+            return f'{head}{client}\r\n\r\n'.encode() + body
+
+        latencies, statuses, elapsed = asyncio.run(self.run(
+            url.hostname, url.port or 80, build_request, options['requests'], options['concurrency']
+        ))
+        latencies.sort()
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write(f'{len(latencies)} requests in {elapsed:.2f}s '
+                          f'({len(latencies) / elapsed:,.0f} req/s) '
+                          f'at concurrency {options["concurrency"]}')
+        if latencies:
+            self.stdout.write(f'latency p50 {percentile(0.5):.1f} ms, p95 {percentile(0.95):.1f} ms, '
+                              f'p99 {percentile(0.99):.1f} ms, max {latencies[-1] * 1000:.1f} ms')
+        self.stdout.write('status ' + ', '.join(f'{code}: {n}' for code, n in sorted(statuses.items())))
+
+    async def run(self, host, port, build_request, total, concurrency):
+        latencies = []
+        statuses = Counter()
+        remaining = iter(range(total))
+
+        async def worker():
+            reader = writer = None
+            for n in remaining:
+                if writer is None:
+                    try:
+                        reader, writer = await asyncio.open_connection(host, port)
+                    except OSError:
+                        statuses['connect error'] += 1
+                        continue
+                started = time.perf_counter()
+                try:
+                    writer.write(build_request(n))
+                    status, keep_alive = await self.read_response(reader)
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    statuses['error'] += 1
+                    writer.close()
+                    reader = writer = None
+                    continue
+                latencies.append(time.perf_counter() - started)
+                statuses[status] += 1
+                if not keep_alive:
+                    writer.close()
+                    reader = writer = None
+            if writer is not None:
+                writer.close()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return latencies, statuses, time.perf_counter() - start
+
+    @staticmethod
+    async def read_response(reader):
+        """Read one response; returns (status code, connection reusable)"""
+        head = await reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split()[1])
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif 'content-length' in headers:
+            await reader.readexactly(int(headers['content-length']))
+        else:
+            # Body runs until the server closes the connection
+            await reader.read()
+            return status, False
+        return status, headers.get('connection', '').lower() != 'close'
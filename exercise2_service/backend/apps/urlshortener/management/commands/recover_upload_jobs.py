@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.urlshortener.jobs import recover_stale_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Resume bulk upload jobs left pending or running by a restart (no '
+        'progress for --stale-after seconds), from the first line that was not '
+        'committed. Jobs whose stored file is gone are marked failed. Workers '
+        'do this at startup too; the jobs run in this process.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-after', type=int,
+                            default=settings.BULK_UPLOAD_STALE_AFTER,
+                            help='Seconds without progress before a job counts as lost')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list the jobs that would be resumed')
+
+    def handle(self, *args, **options):
+        if options['stale_after'] < 0:
+            raise CommandError('--stale-after cannot be negative')
+        jobs = recover_stale_jobs(
+            options['stale_after'], dry_run=options['dry_run'], inline=True
+        )
+        for job in jobs:
+            verb = 'Would resume' if options['dry_run'] else 'Resumed'
+            self.stdout.write(f'{verb} job {job.pk} after {job.processed} lines')
+        verb = 'would be resumed' if options['dry_run'] else 'resumed'
+        self.stdout.write(self.style.SUCCESS(f'{len(jobs)} jobs {verb}.'))
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.urlshortener.sharding import clean_up_shards, reshard, shards
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy short URLs and their visit data to the shards that own them under '
+        'a new shard list (--shards), then, once DATABASE_SHARDS is switched to '
+        'it, delete the copies left behind (--cleanup). Also gives rows created '
+        'before sharding ids that carry their bucket.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards',
+                            help='Comma-separated database aliases of the new shard '
+                                 'list, in order (default: DATABASE_SHARDS)')
+        parser.add_argument('--cleanup', action='store_true',
+                            help='Delete rows from shards that no longer own them')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows read per query')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the rows that would change')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive')
+        verb = 'would be' if options['dry_run'] else 'were'
+
+        if options['cleanup']:
+            if options['shards']:
+                raise CommandError('--cleanup uses DATABASE_SHARDS; drop --shards')
+            deleted, kept = clean_up_shards(options['batch_size'], options['dry_run'])
+            if kept:
+                self.stdout.write(self.style.WARNING(
+                    f'{kept} rows have no copy on their shard yet and were kept; '
+                    'run the copy again first.'
+                ))
+            self.stdout.write(self.style.SUCCESS(f'{deleted} stray rows {verb} deleted.'))
+            return
+
+        aliases = options['shards'].split(',') if options['shards'] else shards()
+        aliases = [alias.strip() for alias in aliases if alias.strip()]
+        unknown = [alias for alias in aliases if alias not in settings.DATABASES]
+        if not aliases or unknown:
+            raise CommandError(f'Unknown databases: {", ".join(unknown) or "(none given)"}')
+        if len(set(aliases)) != len(aliases):
+            raise CommandError('--shards lists a database twice')
+
+        copied, renumbered = reshard(aliases, options['batch_size'], options['dry_run'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{copied} rows {verb} copied to a new shard, {renumbered} {verb} renumbered.'
+        ))
+        if copied and not options['dry_run'] and aliases != shards():
+            self.stdout.write(
+                f'Set DATABASE_SHARDS to {aliases}, then run with --cleanup.'
+            )
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.urlshortener.warmup import RANKINGS, warm_resolution_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Preload the most visited short URLs into the redirect resolution '
+        'cache, ranked by recent daily visits (or all-time views), within a '
+        'row budget and a time limit.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=settings.REDIRECT_CACHE_WARMUP_LIMIT,
+                            help='Most URLs to load')
+        parser.add_argument('--time-limit', type=float,
+                            default=settings.REDIRECT_CACHE_WARMUP_TIME_LIMIT,
+                            help='Seconds after which loading stops')
+        parser.add_argument('--ranking', choices=RANKINGS,
+                            default=settings.REDIRECT_CACHE_WARMUP_RANKING,
+                            help='Rank by visits in the last --days days, or by all-time views')
+        parser.add_argument('--days', type=int, default=settings.REDIRECT_CACHE_WARMUP_DAYS,
+                            help='Days of daily rollups used by --ranking recent')
+
+    def handle(self, *args, **options):
+        if not settings.REDIRECT_CACHE_ENABLED:
+            raise CommandError('The redirect cache is disabled (REDIRECT_CACHE_ENABLED)')
+        loaded, complete = warm_resolution_cache(
+            limit=options['limit'],
+            time_limit=options['time_limit'],
+            ranking=options['ranking'],
+            days=options['days'],
+        )
+        if not complete:
+            self.stdout.write(self.style.WARNING('Time limit reached before the budget.'))
+        self.stdout.write(self.style.SUCCESS(f'Loaded {loaded} URLs into the redirect cache.'))
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:33
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("urlshortener", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="urlvisit",
+            name="accessed_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                help_text="Timestamp of when the URL was accessed",
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("urlshortener", "0002_visit_accessed_at_default"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ShortCodeSequence",
+            fields=[
+                (
+                    "name",
+                    models.CharField(
+                        help_text="Sequence name (one per short code length)",
+                        max_length=50,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                (
+                    "next_value",
+                    models.BigIntegerField(
+                        default=0, help_text="First ID not yet handed out to any worker"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Short Code Sequence",
+                "verbose_name_plural": "Short Code Sequences",
+            },
+        ),
+    ]
@@ -0,0 +1,130 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("urlshortener", "0003_shortcodesequence"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BulkUploadJob",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                (
+                    "file",
+                    models.FileField(
+                        blank=True,
+                        help_text="Stored upload; removed once the job has finished",
+                        upload_to="bulk_uploads/",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "total",
+                    models.PositiveIntegerField(
+                        default=0, help_text="URLs in the file"
+                    ),
+                ),
+                (
+                    "processed",
+                    models.PositiveIntegerField(
+                        default=0, help_text="URLs handled so far"
+                    ),
+                ),
+                ("success", models.PositiveIntegerField(default=0)),
+                ("failed", models.PositiveIntegerField(default=0)),
+                (
+                    "error",
+                    models.TextField(blank=True, help_text="Why the whole job failed"),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        help_text="User who submitted the upload",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="bulk_upload_jobs",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Bulk Upload Job",
+                "verbose_name_plural": "Bulk Upload Jobs",
+                "ordering": ["-created_at"],
+            },
+        ),
+        migrations.CreateModel(
+            name="BulkUploadResult",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "line_number",
+                    models.PositiveIntegerField(
+                        help_text="1-based position among the URLs"
+                    ),
+                ),
+                ("original_url", models.TextField()),
+                ("short_code", models.CharField(blank=True, max_length=10)),
+                ("status", models.CharField(max_length=10)),
+                ("error", models.TextField(blank=True)),
+                (
+                    "job",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="results",
+                        to="urlshortener.bulkuploadjob",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Bulk Upload Result",
+                "verbose_name_plural": "Bulk Upload Results",
+                "ordering": ["line_number"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="bulkuploadresult",
+            constraint=models.UniqueConstraint(
+                fields=("job", "line_number"), name="unique_job_line"
+            ),
+        ),
+    ]
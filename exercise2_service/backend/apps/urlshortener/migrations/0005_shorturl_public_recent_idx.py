@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("urlshortener", "0004_bulk_upload_jobs"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="shorturl",
+            index=models.Index(
+                condition=models.Q(("is_private", False)),
+                fields=["-created_at", "-id"],
+                name="shorturl_public_recent_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("urlshortener", "0005_shorturl_public_recent_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="shorturl",
+            name="last_visited_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Timestamp of the most recent visit (maintained by the visit pipeline)",
+                null=True,
+            ),
+        ),
+        migrations.CreateModel(
+            name="URLVisitDaily",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(help_text="Day of the visits (UTC)")),
+                (
+                    "count",
+                    models.PositiveIntegerField(
+                        default=0, help_text="Number of visits that day"
+                    ),
+                ),
+                (
+                    "unique_ips",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Number of distinct visitor IP addresses that day",
+                    ),
+                ),
+                (
+                    "short_url",
+                    models.ForeignKey(
+                        help_text="The short URL these visits belong to",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_visits",
+                        to="urlshortener.shorturl",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Daily URL Visits",
+                "verbose_name_plural": "Daily URL Visits",
+                "ordering": ["-date"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="urlvisitdaily",
+            constraint=models.UniqueConstraint(
+                fields=("short_url", "date"), name="unique_daily_visits"
+            ),
+        ),
+    ]
@@ -0,0 +1,120 @@
+"""
+Turn urlshortener_urlvisit into a table range-partitioned by month on
+accessed_at (PostgreSQL only; other databases keep the plain table).
+
+Postgres requires the partition key in the primary key, so the key becomes
+(id, accessed_at); ids still come from a sequence and stay unique. Existing
+rows are copied into monthly partitions and a DEFAULT partition catches
+anything outside the created months. New months are added ahead of time by
+the ``create_visit_partitions`` command.
+"""
+from datetime import datetime, timezone
+
+from django.db import migrations
+
+TABLE = "urlshortener_urlvisit"
+LEGACY = "urlshortener_urlvisit_legacy"
+# The old identity column's sequence keeps the default name until it is dropped
+SEQUENCE = "urlshortener_urlvisit_visit_id_seq"
+MONTHS_AHEAD = 3
+
+
+def _months(first, last):
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _bound(year, month):
+    return datetime(year, month, 1, tzinfo=timezone.utc).isoformat()
+
+
+def _indexes_and_fks(apps, schema_editor):
+    URLVisit = apps.get_model("urlshortener", "URLVisit")
+    quote = schema_editor.quote_name
+    statements = []
+    for field in URLVisit._meta.fields:
+        if field.is_relation:
+            target = field.related_model._meta
+            statements.append(
+                f"ALTER TABLE {TABLE} ADD CONSTRAINT "
+                f"{quote(f'{TABLE}_{field.column}_fk')} FOREIGN KEY ({field.column}) "
+                f"REFERENCES {quote(target.db_table)} ({target.pk.column}) "
+                "DEFERRABLE INITIALLY DEFERRED"
+            )
+            statements.append(
+                f"CREATE INDEX {quote(f'{TABLE}_{field.column}_idx')} "
+                f"ON {TABLE} ({field.column})"
+            )
+    for index in URLVisit._meta.indexes:
+        statements.append(str(index.create_sql(URLVisit, schema_editor)))
+    return statements
+
+
+def partition(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    now = datetime.now(timezone.utc)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"SELECT min(accessed_at) FROM {TABLE}")
+        oldest = cursor.fetchone()[0] or now
+
+    schema_editor.execute(f"ALTER TABLE {TABLE} RENAME TO {LEGACY}")
+    schema_editor.execute(
+        f"CREATE TABLE {TABLE} (LIKE {LEGACY} INCLUDING DEFAULTS) "
+        "PARTITION BY RANGE (accessed_at)"
+    )
+    schema_editor.execute(f"CREATE SEQUENCE {SEQUENCE} AS bigint OWNED BY {TABLE}.id")
+    schema_editor.execute(
+        f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')"
+    )
+
+    last = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+    for _ in range(MONTHS_AHEAD):
+        last = datetime(
+            last.year + last.month // 12, last.month % 12 + 1, 1, tzinfo=timezone.utc
+        )
+    for year, month in _months(oldest, last):
+        end_year, end_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        schema_editor.execute(
+            f"CREATE TABLE {TABLE}_p{year:04d}{month:02d} PARTITION OF {TABLE} "
+            f"FOR VALUES FROM ('{_bound(year, month)}') "
+            f"TO ('{_bound(end_year, end_month)}')"
+        )
+    schema_editor.execute(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT")
+
+    schema_editor.execute(f"INSERT INTO {TABLE} SELECT * FROM {LEGACY}")
+    schema_editor.execute(
+        f"SELECT setval('{SEQUENCE}', coalesce((SELECT max(id) FROM {TABLE}), 0) + 1, false)"
+    )
+    schema_editor.execute(f"DROP TABLE {LEGACY}")
+    # Names are only free once the old table is gone
+    schema_editor.execute(f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id, accessed_at)")
+    for statement in _indexes_and_fks(apps, schema_editor):
+        schema_editor.execute(statement)
+
+
+def unpartition(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"ALTER TABLE {TABLE} RENAME TO {LEGACY}")
+    schema_editor.execute(f"ALTER SEQUENCE {SEQUENCE} OWNED BY NONE")
+    schema_editor.execute(f"CREATE TABLE {TABLE} (LIKE {LEGACY} INCLUDING DEFAULTS)")
+    schema_editor.execute(f"ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id")
+    schema_editor.execute(f"INSERT INTO {TABLE} SELECT * FROM {LEGACY}")
+    schema_editor.execute(f"DROP TABLE {LEGACY}")
+    schema_editor.execute(f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id)")
+    for statement in _indexes_and_fks(apps, schema_editor):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("urlshortener", "0006_visit_rollups"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -0,0 +1,111 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("urlshortener", "0007_partition_urlvisit"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="urlvisit",
+            name="referrer",
+            field=models.TextField(
+                blank=True, help_text="HTTP Referer header of the visit"
+            ),
+        ),
+        migrations.CreateModel(
+            name="URLVisitHourly",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hour", models.DateTimeField(help_text="Start of the hour (UTC)")),
+                (
+                    "count",
+                    models.PositiveIntegerField(
+                        default=0, help_text="Number of visits in that hour"
+                    ),
+                ),
+                (
+                    "short_url",
+                    models.ForeignKey(
+                        help_text="The short URL these visits belong to",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="hourly_visits",
+                        to="urlshortener.shorturl",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Hourly URL Visits",
+                "verbose_name_plural": "Hourly URL Visits",
+                "ordering": ["-hour"],
+            },
+        ),
+        migrations.CreateModel(
+            name="URLVisitBreakdown",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(help_text="Day of the visits (UTC)")),
+                (
+                    "dimension",
+                    models.CharField(
+                        choices=[("referrer", "Referrer"), ("browser", "Browser")],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "value",
+                    models.CharField(
+                        help_text="Referrer host or browser family", max_length=255
+                    ),
+                ),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "short_url",
+                    models.ForeignKey(
+                        help_text="The short URL these visits belong to",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="visit_breakdowns",
+                        to="urlshortener.shorturl",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "URL Visit Breakdown",
+                "verbose_name_plural": "URL Visit Breakdowns",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="urlvisithourly",
+            constraint=models.UniqueConstraint(
+                fields=("short_url", "hour"), name="unique_hourly_visits"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="urlvisitbreakdown",
+            constraint=models.UniqueConstraint(
+                fields=("short_url", "date", "dimension", "value"),
+                name="unique_visit_breakdown",
+            ),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("urlshortener", "0008_visit_stats_rollups"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="URLVisitorSketch",
+            fields=[
+                (
+                    "short_url",
+                    models.OneToOneField(
+                        help_text="The short URL these visitors belong to",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="visitor_sketch",
+                        serialize=False,
+                        to="urlshortener.shorturl",
+                    ),
+                ),
+                ("sketch", models.BinaryField(blank=True, default=b"")),
+                (
+                    "unique_visitors",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Estimated number of distinct visitor IP addresses",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "URL Visitor Sketch",
+                "verbose_name_plural": "URL Visitor Sketches",
+            },
+        ),
+        migrations.AddField(
+            model_name="urlvisitdaily",
+            name="visitor_sketch",
+            field=models.BinaryField(
+                blank=True,
+                default=b"",
+                help_text="HyperLogLog sketch of the visitor IP addresses that day",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="urlvisitdaily",
+            name="unique_ips",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Number of distinct visitor IP addresses that day (estimated)",
+            ),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:59
+
+from django.db import migrations, models
+
+from apps.urlshortener.urlnorm import hash_url
+
+CHUNK_SIZE = 2000
+
+
+def fill_hashes(apps, schema_editor):
+    ShortURL = apps.get_model("urlshortener", "ShortURL")
+    last_pk = 0
+    while True:
+        chunk = list(
+            ShortURL.objects.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .only("pk", "target_url")[:CHUNK_SIZE]
+        )
+        if not chunk:
+            break
+        for short_url in chunk:
+            short_url.target_url_hash = hash_url(short_url.target_url)
+        ShortURL.objects.bulk_update(chunk, ["target_url_hash"])
+        last_pk = chunk[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("urlshortener", "0009_visitor_sketches"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="shorturl",
+            name="target_url_hash",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                help_text="Digest of the normalized target URL, for finding duplicates",
+                max_length=32,
+            ),
+        ),
+        migrations.RunPython(fill_hashes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="shorturl",
+            index=models.Index(
+                fields=["owner", "target_url_hash"], name="shorturl_owner_url_hash_idx"
+            ),
+        ),
+    ]
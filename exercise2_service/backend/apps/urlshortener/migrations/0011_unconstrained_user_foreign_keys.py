@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("urlshortener", "0010_target_url_hash"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="shorturl",
+            name="owner",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                help_text="Owner of the short URL",
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="urls",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="urlvisit",
+            name="user",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                help_text="User who accessed the URL (if authenticated)",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="url_visits",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("urlshortener", "0011_unconstrained_user_foreign_keys"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="shorturl",
+            index=models.Index(fields=["-views", "-id"], name="shorturl_views_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="urlvisitdaily",
+            index=models.Index(fields=["date"], name="visitdaily_date_idx"),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:49
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("urlshortener", "0012_warmup_ranking_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bulkuploadjob",
+            name="heartbeat_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                help_text="Last time the job was queued or made progress",
+            ),
+        ),
+    ]
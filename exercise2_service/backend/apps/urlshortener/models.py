@@ -1,8 +1,11 @@
 from django.db import models
 from django.conf import settings
 from django.core.validators import URLValidator
-import string
-import random
+from django.utils import timezone
+import uuid
+
+from .sharding import allocate_ids, is_sharded, shard_for_code
+from .urlnorm import hash_url
 
 class ShortURL(models.Model):
     id = models.BigAutoField(primary_key=True)
@@ -19,6 +22,13 @@ class ShortURL(models.Model):
         help_text="The original URL to be shortened",
     )
     
+    target_url_hash = models.CharField(
+        max_length=32,
+        blank=True,
+        editable=False,
+        help_text="Digest of the normalized target URL, for finding duplicates",
+    )
+    
     is_private = models.BooleanField(
         default=False,
         help_text="When true, requires authentication token to access",
@@ -30,6 +40,8 @@ class ShortURL(models.Model):
         null=True,
         blank=True,
         related_name='urls',
+        # Owners stay on the default database when short URLs are sharded
+        db_constraint=False,
         help_text="Owner of the short URL"
     )
     
@@ -38,6 +50,12 @@ class ShortURL(models.Model):
         help_text="Number of times the short URL has been accessed"
     )
     
+    last_visited_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Timestamp of the most recent visit (maintained by the visit pipeline)"
+    )
+    
     created_at = models.DateTimeField(
         auto_now_add=True,
         help_text="Timestamp when the short URL was created"
@@ -55,30 +73,74 @@ class ShortURL(models.Model):
         indexes = [
             models.Index(fields=['short_code']),
             models.Index(fields=['owner', '-created_at']),
+            # Deduplication lookups (see urlnorm.py)
+            models.Index(
+                fields=['owner', 'target_url_hash'],
+                name='shorturl_owner_url_hash_idx',
+            ),
+            # Keyset pagination of the anonymous (public) listing
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(is_private=False),
+                name='shorturl_public_recent_idx',
+            ),
+            # Cache warm-up ranking by all-time views (see warmup.py)
+            models.Index(fields=['-views', '-id'], name='shorturl_views_idx'),
         ]
     
     def __str__(self):
         return f"{self.short_code} -> {self.target_url[:50]}"
     
+    def save(self, *args, **kwargs):
+        self.target_url_hash = hash_url(self.target_url)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'target_url' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'target_url_hash'}
+        if is_sharded():
+            # A short URL lives on its code's shard, whichever database the caller had in mind
+            kwargs['using'] = shard_for_code(self.short_code)
+            if self.pk is None:
+                self.pk = allocate_ids([self.short_code])[0]
+                kwargs.setdefault('force_insert', True)
+        super().save(*args, **kwargs)
+    
     def get_short_url(self):
         from django.conf import settings
         base_url = settings.BASE_URL.rstrip('/')
         return f"{base_url}/{self.short_code}"
     
     def increment_views(self):
-        from django.db.models import F
-        ShortURL.objects.filter(pk=self.pk).update(views=F('views') + 1)
-        self.refresh_from_db()
+        """Count a view; folded into ``views`` by the next counter flush"""
+        from .counters import view_counter
+        view_counter.add(self.pk)
     
     @staticmethod
     def generate_short_code(length=6):
-        characters = string.ascii_letters + string.digits
-        while True:
-            code = ''.join(random.choices(characters, k=length))
-            if not ShortURL.objects.filter(short_code=code).exists():
-                return code
+        from .codegen import get_code_generator
+        return get_code_generator().generate(length)
      
 
+
+class ShortCodeSequence(models.Model):
+    """Counter that short code ID blocks are reserved from"""
+    name = models.CharField(
+        max_length=50,
+        primary_key=True,
+        help_text='Sequence name (one per short code length)'
+    )
+    
+    next_value = models.BigIntegerField(
+        default=0,
+        help_text='First ID not yet handed out to any worker'
+    )
+    
+    class Meta:
+        verbose_name = 'Short Code Sequence'
+        verbose_name_plural = 'Short Code Sequences'
+    
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
             
 class URLVisit(models.Model):
   
@@ -97,6 +159,7 @@ class URLVisit(models.Model):
         null=True,
         blank=True,
         related_name='url_visits',
+        db_constraint=False,
         help_text='User who accessed the URL (if authenticated)'
     )
     
@@ -111,9 +174,16 @@ class URLVisit(models.Model):
         help_text='User agent string (browser/device info)'
     )
     
+    # Where the visitor came from
+    referrer = models.TextField(
+        blank=True,
+        help_text='HTTP Referer header of the visit'
+    )
+    
     # When the visit occurred
+    # Set by the visit pipeline, which writes visits after the fact
     accessed_at = models.DateTimeField(
-        auto_now_add=True,
+        default=timezone.now,
         help_text='Timestamp of when the URL was accessed'
     )
     
@@ -129,4 +199,225 @@ class URLVisit(models.Model):
     def __str__(self):
         """Display: "Visit to Ux26Yp by user@example.com" """
         user_info = self.user.email if self.user else self.ip_address
-        return f"Visit to {self.short_url.short_code} by {user_info}"
\ No newline at end of file
+        return f"Visit to {self.short_url.short_code} by {user_info}"
+
+
+class URLVisitDaily(models.Model):
+    """Per-day visit rollup, so analytics never has to scan URLVisit"""
+    short_url = models.ForeignKey(
+        ShortURL,
+        on_delete=models.CASCADE,
+        related_name='daily_visits',
+        help_text='The short URL these visits belong to'
+    )
+    
+    date = models.DateField(help_text='Day of the visits (UTC)')
+    
+    count = models.PositiveIntegerField(
+        default=0,
+        help_text='Number of visits that day'
+    )
+    
+    unique_ips = models.PositiveIntegerField(
+        default=0,
+        help_text='Number of distinct visitor IP addresses that day (estimated)'
+    )
+    
+    visitor_sketch = models.BinaryField(
+        blank=True,
+        default=b'',
+        help_text='HyperLogLog sketch of the visitor IP addresses that day'
+    )
+    
+    class Meta:
+        verbose_name = 'Daily URL Visits'
+        verbose_name_plural = 'Daily URL Visits'
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['short_url', 'date'], name='unique_daily_visits'),
+        ]
+        indexes = [
+            # Cache warm-up ranking by recent visits (see warmup.py)
+            models.Index(fields=['date'], name='visitdaily_date_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.short_url_id} on {self.date}: {self.count}"
+
+
+class URLVisitorSketch(models.Model):
+    """All-time HyperLogLog sketch of a short URL's visitor IP addresses"""
+    short_url = models.OneToOneField(
+        ShortURL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='visitor_sketch',
+        help_text='The short URL these visitors belong to'
+    )
+    
+    sketch = models.BinaryField(blank=True, default=b'')
+    
+    unique_visitors = models.PositiveIntegerField(
+        default=0,
+        help_text='Estimated number of distinct visitor IP addresses'
+    )
+    
+    class Meta:
+        verbose_name = 'URL Visitor Sketch'
+        verbose_name_plural = 'URL Visitor Sketches'
+    
+    def __str__(self):
+        return f"{self.short_url_id}: ~{self.unique_visitors} visitors"
+
+
+class URLVisitHourly(models.Model):
+    """Per-hour visit counts for the stats endpoint"""
+    short_url = models.ForeignKey(
+        ShortURL,
+        on_delete=models.CASCADE,
+        related_name='hourly_visits',
+        help_text='The short URL these visits belong to'
+    )
+    
+    hour = models.DateTimeField(help_text='Start of the hour (UTC)')
+    
+    count = models.PositiveIntegerField(
+        default=0,
+        help_text='Number of visits in that hour'
+    )
+    
+    class Meta:
+        verbose_name = 'Hourly URL Visits'
+        verbose_name_plural = 'Hourly URL Visits'
+        ordering = ['-hour']
+        constraints = [
+            models.UniqueConstraint(fields=['short_url', 'hour'], name='unique_hourly_visits'),
+        ]
+    
+    def __str__(self):
+        return f"{self.short_url_id} at {self.hour}: {self.count}"
+
+
+class URLVisitBreakdown(models.Model):
+    """Per-day visit counts by referrer host or browser family"""
+    DIMENSION_REFERRER = 'referrer'
+    DIMENSION_BROWSER = 'browser'
+    DIMENSION_CHOICES = [
+        (DIMENSION_REFERRER, 'Referrer'),
+        (DIMENSION_BROWSER, 'Browser'),
+    ]
+    
+    short_url = models.ForeignKey(
+        ShortURL,
+        on_delete=models.CASCADE,
+        related_name='visit_breakdowns',
+        help_text='The short URL these visits belong to'
+    )
+    
+    date = models.DateField(help_text='Day of the visits (UTC)')
+    
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    
+    value = models.CharField(
+        max_length=255,
+        help_text='Referrer host or browser family'
+    )
+    
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = 'URL Visit Breakdown'
+        verbose_name_plural = 'URL Visit Breakdowns'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['short_url', 'date', 'dimension', 'value'],
+                name='unique_visit_breakdown',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.short_url_id} on {self.date}: {self.dimension}={self.value} ({self.count})"
+
+
+class BulkUploadJob(models.Model):
+    """Bulk upload processed in the background (see jobs.py)"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='bulk_upload_jobs',
+        help_text='User who submitted the upload'
+    )
+    
+    file = models.FileField(
+        upload_to='bulk_uploads/',
+        blank=True,
+        help_text='Stored upload; removed once the job has finished'
+    )
+    
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+    )
+    
+    total = models.PositiveIntegerField(default=0, help_text='URLs in the file')
+    processed = models.PositiveIntegerField(default=0, help_text='URLs handled so far')
+    success = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    
+    error = models.TextField(blank=True, help_text='Why the whole job failed')
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(
+        default=timezone.now,
+        help_text='Last time the job was queued or made progress'
+    )
+    
+    class Meta:
+        verbose_name = 'Bulk Upload Job'
+        verbose_name_plural = 'Bulk Upload Jobs'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Bulk upload {self.id} ({self.status})"
+
+
+class BulkUploadResult(models.Model):
+    """Outcome of one line of a background bulk upload"""
+    job = models.ForeignKey(
+        BulkUploadJob,
+        on_delete=models.CASCADE,
+        related_name='results',
+    )
+    
+    line_number = models.PositiveIntegerField(help_text='1-based position among the URLs')
+    original_url = models.TextField()
+    short_code = models.CharField(max_length=10, blank=True)
+    status = models.CharField(max_length=10)
+    error = models.TextField(blank=True)
+    
+    class Meta:
+        verbose_name = 'Bulk Upload Result'
+        verbose_name_plural = 'Bulk Upload Results'
+        ordering = ['line_number']
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'line_number'], name='unique_job_line'),
+        ]
+    
+    def __str__(self):
+        return f"{self.job_id} #{self.line_number}: {self.status}"
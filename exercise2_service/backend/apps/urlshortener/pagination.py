@@ -0,0 +1,124 @@
+"""
+Keyset (cursor) pagination for URL listings.
+
+Pages are addressed by the (created_at, id) of the row at their edge, so
+each page is an index range scan with no OFFSET and no COUNT(*), and rows
+inserted while a client is paging don't shift later pages.
+"""
+import base64
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def encode_cursor(created_at, pk, reverse=False):
+    raw = f"{'r' if reverse else 'f'}|{created_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    """Return (created_at, pk, reverse); raises ValueError if malformed"""
+    padded = value + '=' * (-len(value) % 4)
+    direction, created_at, pk = (
+        base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+    )
+    created_at = parse_datetime(created_at)
+    if direction not in ('f', 'r') or created_at is None:
+        raise ValueError(value)
+    return created_at, int(pk), direction == 'r'
+
+
+def keyset_page(queryset, page_size, cursor=None):
+    """
+    Fetch one page of ``queryset`` newest first.
+
+    Returns (rows, has_next, has_previous) where the flags say whether
+    another page exists in that direction.
+    """
+    if cursor is None:
+        rows = list(queryset.order_by('-created_at', '-id')[:page_size + 1])
+        return rows[:page_size], len(rows) > page_size, False
+
+    created_at, pk, reverse = cursor
+    if reverse:
+        rows = list(
+            queryset
+            .filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+            .order_by('created_at', 'id')[:page_size + 1]
+        )
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        rows.reverse()
+        return rows, True, has_more
+
+    rows = list(
+        queryset
+        .filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        .order_by('-created_at', '-id')[:page_size + 1]
+    )
+    return rows[:page_size], len(rows) > page_size, True
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination over (created_at, id), newest first"""
+
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            try:
+                cursor = decode_cursor(cursor)
+            except (TypeError, ValueError, UnicodeDecodeError):
+                raise NotFound(self.invalid_cursor_message)
+        else:
+            cursor = None
+
+        rows, has_next, has_previous = keyset_page(queryset, self.page_size, cursor)
+        self.next_cursor = (
+            encode_cursor(rows[-1].created_at, rows[-1].pk) if rows and has_next else None
+        )
+        self.previous_cursor = (
+            encode_cursor(rows[0].created_at, rows[0].pk, reverse=True)
+            if rows and has_previous else None
+        )
+        return rows
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'page')
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self._link(self.next_cursor)
+
+    def get_previous_link(self):
+        return self._link(self.previous_cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
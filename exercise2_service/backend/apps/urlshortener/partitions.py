@@ -0,0 +1,222 @@
+"""
+Monthly partitions of the URLVisit log, and retention by archiving them.
+
+On PostgreSQL ``urlshortener_urlvisit`` is range-partitioned by month on
+``accessed_at`` (migration 0007), with one ``urlshortener_urlvisit_pYYYYMM``
+table per month plus a DEFAULT partition. ``create_partitions()`` adds
+upcoming months; ``archive_visits()`` writes old months to gzipped CSV files
+and detaches and drops their partitions, so retention never runs a big
+DELETE.
+
+Other databases (SQLite in tests) keep a plain table: the same calls export
+the old months and then delete their rows in chunks.
+
+Each call acts on one database (``using``); with ``DATABASE_SHARDS`` the
+commands run them on every shard, and archives of shards other than
+``default`` go to a subdirectory named after the shard.
+"""
+import csv
+import gzip
+import os
+from datetime import date, datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from .models import URLVisit
+
+DELETE_CHUNK_SIZE = 5000
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def current_month(now=None):
+    return month_start((now or timezone.now()).astimezone(dt_timezone.utc))
+
+
+def _bound(month):
+    return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    return f'{URLVisit._meta.db_table}_p{month:%Y%m}'
+
+
+def is_partitioned(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass',
+            [URLVisit._meta.db_table],
+        )
+        return cursor.fetchone() is not None
+
+
+def list_partitions(using=DEFAULT_DB_ALIAS):
+    """Return the attached monthly partitions as sorted (month, table) pairs"""
+    table = URLVisit._meta.db_table
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = %s::regclass',
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    prefix = f'{table}_p'
+    partitions = []
+    for name in names:
+        suffix = name[len(prefix):]
+        if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+            partitions.append((date(int(suffix[:4]), int(suffix[4:]), 1), name))
+    return sorted(partitions)
+
+
+def create_partitions(months_ahead, now=None, using=DEFAULT_DB_ALIAS):
+    """
+    Make sure partitions exist from the current month to ``months_ahead``
+    months after it. Returns the names of the partitions created.
+
+    Rows that already landed in the DEFAULT partition for a new month are
+    moved into it. No-op when the table isn't partitioned.
+    """
+    if not is_partitioned(using):
+        return []
+    table = URLVisit._meta.db_table
+    default = f'{table}_default'
+    existing = {name for _, name in list_partitions(using)}
+    current = current_month(now)
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        name = partition_name(month)
+        if name in existing:
+            continue
+        start, end = _bound(month), _bound(add_months(month, 1))
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            cursor.execute(
+                f'SELECT 1 FROM {default} WHERE accessed_at >= %s AND accessed_at < %s LIMIT 1',
+                [start, end],
+            )
+            stray = cursor.fetchone() is not None
+            if stray:
+                # Postgres refuses to add a partition whose rows sit in DEFAULT
+                cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {default}')
+            cursor.execute(
+                f'CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)',
+                [start, end],
+            )
+            if stray:
+                cursor.execute(
+                    f'WITH moved AS (DELETE FROM {default} '
+                    f'WHERE accessed_at >= %s AND accessed_at < %s RETURNING *) '
+                    f'INSERT INTO {table} SELECT * FROM moved',
+                    [start, end],
+                )
+                cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT')
+        created.append(name)
+    return created
+
+
+def _archive_path(directory, month, using=DEFAULT_DB_ALIAS):
+    directory = Path(directory)
+    if using != DEFAULT_DB_ALIAS:
+        directory /= using
+    return directory / f'{partition_name(month)}.csv.gz'
+
+
+def _write_archive(path, rows):
+    """Write rows to a gzipped CSV, atomically; returns the row count"""
+    columns = [field.column for field in URLVisit._meta.concrete_fields]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + '.partial')
+    count = 0
+    with gzip.open(partial, 'wt', newline='') as archive:
+        writer = csv.writer(archive)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    os.replace(partial, path)
+    return count
+
+
+def _archive_partition(name, path, using):
+    connection = connections[using]
+    columns = ', '.join(field.column for field in URLVisit._meta.concrete_fields)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + '.partial')
+    with gzip.open(partial, 'wb') as archive, connection.cursor() as cursor:
+        cursor.copy_expert(
+            f'COPY {name} ({columns}) TO STDOUT WITH (FORMAT csv, HEADER)', archive
+        )
+        cursor.execute(f'SELECT count(*) FROM {name}')
+        count = cursor.fetchone()[0]
+    os.replace(partial, path)
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {URLVisit._meta.db_table} DETACH PARTITION {name}')
+        cursor.execute(f'DROP TABLE {name}')
+    return count
+
+
+def _archive_month(month, path, using):
+    start, end = _bound(month), _bound(add_months(month, 1))
+    visits = URLVisit.objects.using(using).filter(accessed_at__gte=start, accessed_at__lt=end)
+    columns = [field.attname for field in URLVisit._meta.concrete_fields]
+    count = _write_archive(
+        path, visits.order_by('pk').values_list(*columns).iterator(chunk_size=DELETE_CHUNK_SIZE)
+    )
+    while True:
+        ids = list(visits.values_list('pk', flat=True)[:DELETE_CHUNK_SIZE])
+        if not ids:
+            break
+        URLVisit.objects.using(using).filter(pk__in=ids).delete()
+    return count
+
+
+def archive_visits(retention_months, directory, now=None, dry_run=False,
+                   using=DEFAULT_DB_ALIAS):
+    """
+    Archive every month older than the current month plus the previous
+    ``retention_months`` months, one ``<partition>.csv.gz`` file per month.
+
+    Returns (month, path, rows) for each archived month; with ``dry_run``
+    nothing is written and rows is None.
+    """
+    cutoff = add_months(current_month(now), -retention_months)
+    visits = URLVisit.objects.using(using)
+    if is_partitioned(using):
+        months = [(month, name) for month, name in list_partitions(using) if month < cutoff]
+    else:
+        oldest = visits.order_by('accessed_at').values_list('accessed_at', flat=True).first()
+        months = []
+        if oldest is not None:
+            month = month_start(oldest.astimezone(dt_timezone.utc))
+            while month < cutoff:
+                start, end = _bound(month), _bound(add_months(month, 1))
+                if visits.filter(accessed_at__gte=start, accessed_at__lt=end).exists():
+                    months.append((month, None))
+                month = add_months(month, 1)
+
+    archived = []
+    for month, name in months:
+        path = _archive_path(directory, month, using)
+        if path.exists():
+            raise FileExistsError(f'{path} already exists; move it away before archiving again')
+        if dry_run:
+            archived.append((month, path, None))
+        elif name is not None:
+            archived.append((month, path, _archive_partition(name, path, using)))
+        else:
+            archived.append((month, path, _archive_month(month, path, using)))
+    return archived
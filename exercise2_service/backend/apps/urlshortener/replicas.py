@@ -0,0 +1,119 @@
+"""
+Read replica routing.
+
+``ReplicaRouter`` sends reads to one of ``settings.DATABASE_REPLICAS``, but
+only inside ``replica_reads()``; everything else (writes, admin, jobs,
+management commands) uses the primary. ``ReplicaRoutingMixin`` opens that
+block for ``GET``/``HEAD`` requests to the redirect, list and detail views,
+and the redirect fast path opens it around its lookup.
+
+Replicas lag behind the primary, so:
+
+- once a thread writes inside the block, its remaining reads go to the
+  primary;
+- a successful write request (shorten, update, delete, batch or bulk
+  upload) pins the client (user, or IP address when anonymous) to the
+  primary for ``DB_REPLICA_PIN_SECONDS``, so their next listing shows the
+  change. The pin lives in the default cache, shared by all workers when
+  that is Redis;
+- a short code the replica doesn't know is looked up again on the primary
+  (see ``ResolutionCache._load``) before it is cached as missing, and edits
+  write the new row into the resolution cache instead of just dropping the
+  old one (see signals.py), so a lagging replica can't put it back.
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework import permissions
+
+from .tracking import client_ip
+
+_state = threading.local()
+
+
+def reading_from_replica():
+    """Whether reads in this thread currently go to a replica"""
+    return bool(settings.DATABASE_REPLICAS) and getattr(_state, 'replica', False)
+
+
+@contextmanager
+def replica_reads():
+    """Route this thread's reads to a replica until the block ends"""
+    previous = getattr(_state, 'replica', False)
+    _state.replica = True
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+def _pin_key(request):
+    user = request.user
+    if user.is_authenticated:
+        return f'db:pin:user:{user.pk}'
+    return f'db:pin:ip:{client_ip(request.META)}'
+
+
+def pin_to_primary(request):
+    """Read from the primary for this client's requests for a while"""
+    cache.set(_pin_key(request), True, settings.DB_REPLICA_PIN_SECONDS)
+
+
+def is_pinned(request):
+    return cache.get(_pin_key(request), False)
+
+
+class ReplicaRouter:
+    """Reads inside replica_reads() go to a random replica, the rest to the primary"""
+
+    def db_for_read(self, model, **hints):
+        if reading_from_replica():
+            return random.choice(settings.DATABASE_REPLICAS)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Read your own writes for the rest of the block
+        _state.replica = False
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        # Other databases (shards) are for other routers to decide
+        return None
+
+
+class ReplicaRoutingMixin:
+    """
+    Safe requests read from a replica unless the client was pinned to the
+    primary; successful unsafe requests pin the client.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            _state.replica = False
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (
+            settings.DATABASE_REPLICAS
+            and request.method in permissions.SAFE_METHODS
+            and not is_pinned(request)
+        ):
+            _state.replica = True
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if (
+            settings.DATABASE_REPLICAS
+            and request.method not in permissions.SAFE_METHODS
+            and response.status_code < 400
+        ):
+            pin_to_primary(request)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -1,8 +1,11 @@
 from rest_framework import serializers
 from django.conf import settings
-from django.core.validators import URLValidator
-from django.core.exceptions import ValidationError as DjangoValidationError
-from .models import ShortURL, URLVisit
+from django.db import IntegrityError, transaction
+from .bulk import INSERT_CHUNK_SIZE, create_short_urls, duplicate_of, iter_upload_lines
+from .codegen import get_code_generator
+from .models import BulkUploadJob, BulkUploadResult, ShortURL, URLVisit
+from .sharding import atomic_on_shards, shard_for_code
+from .validation import check_target_url, is_valid_url, validate_many
 import re
 
 
@@ -30,26 +33,9 @@ class ShortURLCreateSerializer(serializers.ModelSerializer):
         ]
     
     def validate_target_url(self, value):
-        validator = URLValidator()
-        
-        try:
-            validator(value)
-        except DjangoValidationError:
-            raise serializers.ValidationError(
-                'Please provide a valid URL (e.g., https://example.com)'
-            )
-        
-        if not value.startswith(('http://', 'https://')):
-            raise serializers.ValidationError(
-                'URL must start with http:// or https://'
-            )
-        
-
-        if len(value) > 2048:
-            raise serializers.ValidationError(
-                'URL is too long (max 2048 characters)'
-            )
-        
+        error = check_target_url(value)
+        if error is not None:
+            raise serializers.ValidationError(error)
         return value
     
     def get_short_url(self, obj):
@@ -57,21 +43,40 @@ class ShortURLCreateSerializer(serializers.ModelSerializer):
         return obj.get_short_url()
     
     def create(self, validated_data):
-        validated_data['short_code'] = ShortURL.generate_short_code(
-            length=settings.SHORT_CODE_LENGTH
-        )
-
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             validated_data['owner'] = request.user
         
-        return super().create(validated_data)
+        if settings.SHORT_URL_DEDUP:
+            existing = duplicate_of(
+                validated_data.get('owner'),
+                validated_data['target_url'],
+                validated_data.get('is_private', False),
+            ).first()
+            if existing is not None:
+                return existing
+        
+        # Generated codes are unique among themselves but may still hit a
+        # legacy code; the unique constraint catches that, so just retry.
+        for _ in range(settings.SHORT_CODE_MAX_ATTEMPTS):
+            validated_data['short_code'] = ShortURL.generate_short_code(
+                length=settings.SHORT_CODE_LENGTH
+            )
+            try:
+                with transaction.atomic(using=shard_for_code(validated_data['short_code'])):
+                    return super().create(validated_data)
+            except IntegrityError:
+                get_code_generator().discard_reserved()
+        
+        raise serializers.ValidationError(
+            'Could not allocate a unique short code. Please try again.'
+        )
 
 
 class ShortURLSerializer(serializers.ModelSerializer):
     short_url = serializers.SerializerMethodField()
     owner_email = serializers.CharField(source='owner.email', read_only=True)
-    last_visit = serializers.SerializerMethodField()
+    last_visit = serializers.DateTimeField(source='last_visited_at', read_only=True)
     
     class Meta:
         model = ShortURL
@@ -91,9 +96,6 @@ class ShortURLSerializer(serializers.ModelSerializer):
     def get_short_url(self, obj):
         return obj.get_short_url()
     
-    def get_last_visit(self, obj):
-        last_visit = obj.visits.order_by('-accessed_at').first()
-        return last_visit.accessed_at if last_visit else None
 
 
 class ShortURLUpdateSerializer(serializers.ModelSerializer):
@@ -103,10 +105,7 @@ class ShortURLUpdateSerializer(serializers.ModelSerializer):
     
     def validate_target_url(self, value):
         """Same validation as create"""
-        validator = URLValidator()
-        try:
-            validator(value)
-        except DjangoValidationError:
+        if not is_valid_url(value):
             raise serializers.ValidationError(
                 'Please provide a valid URL'
             )
@@ -151,68 +150,191 @@ class BulkURLSerializer(serializers.Serializer):
         Returns:
             dict: Results summary with success/failure counts
         """
+        request = self.context.get('request')
+        if user is None and request and request.user.is_authenticated:
+            user = request.user
+        
         results = []
-        success_count = 0
-        failed_count = 0
+        pending = []  # URLs waiting to be validated and inserted
+        total = 0
         
-
+        # Lines are validated and inserted as the file is read; the
+        # transaction undoes everything if the file turns out to be too long.
         try:
-            content = file.read().decode('utf-8')
+            with atomic_on_shards():
+                for line in iter_upload_lines(file):
+                    url = line.strip()
+                    if not url:  # Skip empty lines
+                        continue
+                    
+                    total += 1
+                    if total > settings.MAX_URLS_PER_UPLOAD:
+                        raise serializers.ValidationError(
+                            f'Maximum {settings.MAX_URLS_PER_UPLOAD} URLs allowed per upload. '
+                            f'Your file contains more than {settings.MAX_URLS_PER_UPLOAD} URLs.'
+                        )
+                    
+                    pending.append(url)
+                    if len(pending) >= INSERT_CHUNK_SIZE:
+                        self._store_batch(results, pending, user)
+                        pending = []
+                
+                self._store_batch(results, pending, user)
         except UnicodeDecodeError:
             raise serializers.ValidationError(
                 'File must be UTF-8 encoded text.'
             )
         
-
-        urls = [
-            line.strip() 
-            for line in content.splitlines() 
-            if line.strip()  # Skip empty lines
-        ]
-        
-
-        if len(urls) > settings.MAX_URLS_PER_UPLOAD:
-            raise serializers.ValidationError(
-                f'Maximum {settings.MAX_URLS_PER_UPLOAD} URLs allowed per upload. '
-                f'Your file contains {len(urls)} URLs.'
-            )
+        success_count = sum(1 for result in results if result['status'] == 'success')
         
-        for url in urls:
-            try:
-                # Validate URL
-                serializer = ShortURLCreateSerializer(
-                    data={'target_url': url, 'is_private': False},
-                    context={'request': self.context.get('request')}
-                )
-                
-                if serializer.is_valid(raise_exception=True):
-                    # Create shortened URL
-                    short_url_obj = serializer.save()
-                    
-                    results.append({
-                        'original_url': url,
-                        'short_url': short_url_obj.get_short_url(),
-                        'short_code': short_url_obj.short_code,
-                        'status': 'success'
-                    })
-                    success_count += 1
-                    
-            except Exception as e:
+        return {
+            'total': total,
+            'success': success_count,
+            'failed': total - success_count,
+            'results': results
+        }
+    
+    def _store_batch(self, results, pending, user):
+        """Validate a batch of URLs, insert the valid ones and add their results"""
+        errors = validate_many(pending)
+        created = iter(create_short_urls(
+            [(url, False) for url, error in zip(pending, errors) if error is None],
+            owner=user,
+        ))
+        for url, error in zip(pending, errors):
+            if error is not None:
                 results.append({
                     'original_url': url,
-                    'error': str(e),
+                    'error': error,
                     'status': 'failed'
                 })
-                failed_count += 1
+                continue
+            short_url_obj = next(created)
+            results.append({
+                'original_url': url,
+                'short_url': short_url_obj.get_short_url(),
+                'short_code': short_url_obj.short_code,
+                'status': 'success'
+            })
+
+
+class BatchURLSerializer(serializers.Serializer):
+    """JSON array of {target_url, is_private} objects (batch endpoint)"""
+    urls = serializers.ListField(child=serializers.JSONField(), allow_empty=False)
+    
+    def validate_urls(self, value):
+        if len(value) > settings.MAX_URLS_PER_BATCH:
+            raise serializers.ValidationError(
+                f'Maximum {settings.MAX_URLS_PER_BATCH} URLs allowed per batch.'
+            )
+        return value
+    
+    def _parse_item(self, item):
+        """(target_url, is_private) of one item, or None and an error message"""
+        if not isinstance(item, dict):
+            return None, 'Each item must be an object with a target_url.'
+        target_url = item.get('target_url')
+        if not isinstance(target_url, str) or not target_url.strip():
+            return None, 'target_url is required.'
+        try:
+            is_private = serializers.BooleanField().to_internal_value(
+                item.get('is_private', False)
+            )
+        except serializers.ValidationError:
+            return None, 'is_private must be a boolean.'
+        return (target_url.strip(), is_private), None
+    
+    def create_urls(self, user=None):
+        """
+        Create the valid items in one transaction (per shard); invalid ones are reported
+        per item (by position in the array) without failing the rest.
+        """
+        items = self.validated_data['urls']
+        parsed = [self._parse_item(item) for item in items]
+        url_errors = iter(validate_many(
+            [entry[0] for entry, error in parsed if error is None]
+        ))
+        entries = []
+        errors = []
+        for entry, error in parsed:
+            if error is None:
+                error = next(url_errors)
+            errors.append(error)
+            if error is None:
+                entries.append(entry)
+        
+        created = iter(create_short_urls(entries, owner=user))
+        results = []
+        for index, ((entry, _), error) in enumerate(zip(parsed, errors)):
+            if error is not None:
+                results.append({'index': index, 'error': error, 'status': 'failed'})
+                continue
+            short_url_obj = next(created)
+            results.append({
+                'index': index,
+                'target_url': short_url_obj.target_url,
+                'is_private': short_url_obj.is_private,
+                'short_url': short_url_obj.get_short_url(),
+                'short_code': short_url_obj.short_code,
+                'status': 'success'
+            })
         
         return {
-            'total': len(urls),
-            'success': success_count,
-            'failed': failed_count,
+            'total': len(items),
+            'success': len(entries),
+            'failed': len(items) - len(entries),
             'results': results
         }
 
 
+class BulkUploadJobSerializer(serializers.ModelSerializer):
+    results_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = BulkUploadJob
+        fields = [
+            'id',
+            'status',
+            'total',
+            'processed',
+            'success',
+            'failed',
+            'error',
+            'created_at',
+            'started_at',
+            'finished_at',
+            'results_url'
+        ]
+        read_only_fields = fields
+    
+    def get_results_url(self, obj):
+        from django.urls import reverse
+        path = reverse('urlshortener:bulk-job-results', kwargs={'pk': obj.pk})
+        request = self.context.get('request')
+        return request.build_absolute_uri(path) if request else path
+
+
+class BulkUploadResultSerializer(serializers.ModelSerializer):
+    short_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = BulkUploadResult
+        fields = [
+            'line_number',
+            'original_url',
+            'short_code',
+            'short_url',
+            'status',
+            'error'
+        ]
+        read_only_fields = fields
+    
+    def get_short_url(self, obj):
+        if not obj.short_code:
+            return None
+        return f"{settings.BASE_URL.rstrip('/')}/{obj.short_code}"
+
+
 class URLVisitSerializer(serializers.ModelSerializer):
     short_code = serializers.CharField(source='short_url.short_code', read_only=True)
     user_email = serializers.CharField(source='user.email', read_only=True)
@@ -225,6 +347,22 @@ class URLVisitSerializer(serializers.ModelSerializer):
             'user_email',
             'ip_address',
             'user_agent',
+            'referrer',
             'accessed_at'
         ]
-        read_only_fields = fields
\ No newline at end of file
+        read_only_fields = fields
+
+
+class URLStatsQuerySerializer(serializers.Serializer):
+    """Query parameters of the stats endpoint"""
+    bucket = serializers.ChoiceField(choices=['hour', 'day', 'week'], default='day')
+    count = serializers.IntegerField(
+        min_value=1, max_value=settings.STATS_MAX_BUCKETS, required=False
+    )
+    top = serializers.IntegerField(min_value=1, max_value=50, default=10)
+    
+    default_counts = {'hour': 48, 'day': 30, 'week': 12}
+    
+    def validate(self, attrs):
+        attrs.setdefault('count', self.default_counts[attrs['bucket']])
+        return attrs
\ No newline at end of file
@@ -0,0 +1,432 @@
+"""
+Horizontal sharding of short URLs by short code.
+
+``settings.DATABASE_SHARDS`` lists the databases holding ShortURL and its
+visit tables (``SHARDED_MODELS``); users, upload jobs and the ID sequences
+stay on ``default``. With the default single shard nothing here changes a
+query.
+
+Codes hash onto ``SHARD_BUCKETS`` fixed buckets and a consistent hash ring
+assigns buckets to shards, so a code's shard is computed, not looked up, and
+adding a shard moves only about 1/N of the buckets. IDs carry the bucket
+too: a sharded ShortURL's id is ``n * SHARD_BUCKETS + bucket`` with ``n``
+taken from a sequence on ``default``, so everything keyed by id (the API
+views, visits, view counters) finds the shard the same way, and ids stay
+unique when rows move between shards.
+
+``ShardRouter`` sends queries for sharded models to the shard selected with
+``on_shard()``, or else to the database an instance was loaded from;
+``ShortURL.save()`` always writes to its code's shard. ``ShardedQuerySet``
+merges one ordered queryset over every shard, for owner listings and
+duplicate lookups.
+
+Resharding (``reshard_urls``) is copy, switch, clean up: copy every row
+whose shard changes under the new shard list to its new shard (renumbering
+rows whose id doesn't carry its bucket, e.g. rows created before sharding),
+deploy the new ``DATABASE_SHARDS``, then delete the rows that stayed behind
+with ``--cleanup``. Re-run the copy right before switching to pick up rows
+changed in the meantime.
+
+Users stay on ``default``, so foreign keys to them are unconstrained and
+deleting a user repeats the ORM's cascade on the other shards once the
+deletion commits (see signals.py). Not sharding-aware: the admin (it lists
+``default`` only).
+"""
+import bisect
+import hashlib
+import heapq
+import threading
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Max
+
+from .codegen import IDBlockAllocator
+
+SHARD_BUCKETS = 1024
+# Points per shard on the hash ring; more points, more even buckets
+RING_POINTS = 64
+
+SHARDED_MODELS = frozenset({
+    'urlshortener.shorturl',
+    'urlshortener.urlvisit',
+    'urlshortener.urlvisitdaily',
+    'urlshortener.urlvisitorsketch',
+    'urlshortener.urlvisithourly',
+    'urlshortener.urlvisitbreakdown',
+})
+
+_state = threading.local()
+
+
+def shards():
+    return list(settings.DATABASE_SHARDS)
+
+
+def is_sharded():
+    return len(settings.DATABASE_SHARDS) > 1
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+@lru_cache(maxsize=8)
+def _bucket_owners(aliases):
+    ring = sorted(
+        (_hash(f'{alias}#{point}'), alias)
+        for alias in aliases for point in range(RING_POINTS)
+    )
+    positions = [position for position, _ in ring]
+    return tuple(
+        ring[bisect.bisect(positions, _hash(f'bucket#{bucket}')) % len(ring)][1]
+        for bucket in range(SHARD_BUCKETS)
+    )
+
+
+def bucket_for_code(short_code):
+    return _hash(short_code) % SHARD_BUCKETS
+
+
+def shard_for_code(short_code, aliases=None):
+    """Alias of the shard holding ``short_code`` (under ``aliases`` if given)"""
+    aliases = tuple(aliases or settings.DATABASE_SHARDS)
+    return _bucket_owners(aliases)[bucket_for_code(short_code)]
+
+
+def shard_for_pk(pk, aliases=None):
+    """Alias of the shard holding the ShortURL with this id"""
+    aliases = tuple(aliases or settings.DATABASE_SHARDS)
+    return _bucket_owners(aliases)[pk % SHARD_BUCKETS]
+
+
+def on_shard_of_pk(queryset, pk):
+    """``queryset`` on the shard holding ShortURL ``pk`` (unchanged when unsharded)"""
+    return queryset.using(shard_for_pk(pk)) if is_sharded() else queryset
+
+
+def group_by_shard(items, shard_of):
+    """{alias: items on that shard}, keeping the order of ``items``"""
+    groups = {}
+    for item in items:
+        groups.setdefault(shard_of(item), []).append(item)
+    return groups
+
+
+def _first_free_id_block():
+    from .models import ShortURL
+
+    highest = max(
+        ShortURL.objects.using(alias).aggregate(highest=Max('pk'))['highest'] or 0
+        for alias in shards()
+    )
+    return highest // SHARD_BUCKETS + 1
+
+
+# Ids come from per-process blocks, so rows arrive out of id order by up to
+# the blocks other processes hold (see the short code filter's refresh);
+# giving a block up after this many seconds keeps that window short
+ID_BLOCK_MAX_AGE = 60
+
+_ids = IDBlockAllocator(
+    'shorturl:id', settings.SHORT_CODE_BLOCK_SIZE,
+    initial=_first_free_id_block, max_age=ID_BLOCK_MAX_AGE,
+)
+
+
+def allocate_ids(short_codes):
+    """Ids for new ShortURLs with these codes, each carrying its code's bucket"""
+    short_codes = list(short_codes)
+    return [
+        number * SHARD_BUCKETS + bucket_for_code(short_code)
+        for number, short_code in zip(_ids.take(len(short_codes)), short_codes)
+    ]
+
+
+def current_shard():
+    return getattr(_state, 'shard', None)
+
+
+@contextmanager
+def on_shard(alias):
+    """Send this thread's queries for sharded models to ``alias``"""
+    previous = current_shard()
+    _state.shard = alias
+    try:
+        yield
+    finally:
+        _state.shard = previous
+
+
+@contextmanager
+def atomic_on_shards():
+    """
+    transaction.atomic() on ``default`` and every shard. Rolls back
+    everywhere, but commits one database after the other.
+    """
+    with ExitStack() as stack:
+        for alias in dict.fromkeys([DEFAULT_DB_ALIAS, *settings.DATABASE_SHARDS]):
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+def codes_in_use(short_codes):
+    """The subset of ``short_codes`` that already exist, one query per shard"""
+    from .models import ShortURL
+
+    taken = set()
+    for alias, codes in group_by_shard(short_codes, shard_for_code).items():
+        taken.update(
+            ShortURL.objects.using(alias)
+            .filter(short_code__in=codes)
+            .values_list('short_code', flat=True)
+        )
+    return taken
+
+
+class ShardRouter:
+    """Routes sharded models to on_shard()'s alias or their instance's database"""
+
+    def _db(self, model, **hints):
+        if not is_sharded() or model._meta.label_lower not in SHARDED_MODELS:
+            return None
+        alias = current_shard()
+        if alias is not None:
+            return alias
+        instance = hints.get('instance')
+        if instance is not None and instance._meta.label_lower in SHARDED_MODELS:
+            return instance._state.db
+        return None
+
+    db_for_read = _db
+    db_for_write = _db
+
+    def allow_relation(self, obj1, obj2, **hints):
+        labels = {obj1._meta.label_lower, obj2._meta.label_lower}
+        if is_sharded() and labels & SHARDED_MODELS:
+            # Owners live on default, their URLs on any shard
+            return True
+        return None
+
+
+class _Descending:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+class ShardedQuerySet:
+    """
+    An ordered queryset run on every shard, results merged. Supports what
+    the paginators and views use: count(), slicing, iteration, filter(),
+    order_by() and first(). A slice ``[a:b]`` reads up to ``b`` rows from
+    each shard, so page deep listings with the cursor paginator.
+    """
+
+    ordered = True
+
+    def __init__(self, queryset, ordering):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.model = queryset.model
+
+    def filter(self, *args, **kwargs):
+        return ShardedQuerySet(self.queryset.filter(*args, **kwargs), self.ordering)
+
+    def order_by(self, *ordering):
+        return ShardedQuerySet(self.queryset, ordering)
+
+    def count(self):
+        return sum(self.queryset.using(alias).count() for alias in shards())
+
+    def __len__(self):
+        return self.count()
+
+    def _sort_key(self, obj):
+        return tuple(
+            _Descending(getattr(obj, field[1:])) if field.startswith('-')
+            else getattr(obj, field)
+            for field in self.ordering
+        )
+
+    def _merged(self, limit=None):
+        results = []
+        for alias in shards():
+            queryset = self.queryset.using(alias).order_by(*self.ordering)
+            if limit is None:
+                results.append(queryset.iterator(chunk_size=2000))
+            else:
+                results.append(list(queryset[:limit]))
+        return heapq.merge(*results, key=self._sort_key)
+
+    def __iter__(self):
+        return iter(self._merged())
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step is not None:
+                raise ValueError('ShardedQuerySet does not support slice steps')
+            return list(islice(self._merged(key.stop), key.start or 0, key.stop))
+        return self[key:key + 1][0]
+
+    def first(self):
+        rows = self[:1]
+        return rows[0] if rows else None
+
+    async def afirst(self):
+        return await sync_to_async(self.first)()
+
+
+def across_shards(queryset, *ordering):
+    """``queryset.order_by(*ordering)``, merged over every shard when sharded"""
+    if not is_sharded():
+        return queryset.order_by(*ordering)
+    return ShardedQuerySet(queryset, ordering)
+
+
+# Resharding
+
+COPY_CHUNK_SIZE = 2000
+
+
+def _dependents():
+    """(model, foreign key attname) of every sharded model pointing at ShortURL"""
+    from .models import ShortURL
+
+    return [
+        (relation.related_model, relation.field.attname)
+        for relation in ShortURL._meta.related_objects
+        if relation.related_model._meta.label_lower in SHARDED_MODELS
+    ]
+
+
+def _copy_dependents(old_pk, new_pk, source, target):
+    for model, field in _dependents():
+        model.objects.using(target).filter(**{field: new_pk}).delete()
+        batch = []
+        rows = model.objects.using(source).filter(**{field: old_pk})
+        for obj in rows.iterator(chunk_size=COPY_CHUNK_SIZE):
+            obj.pk = None
+            setattr(obj, field, new_pk)
+            batch.append(obj)
+            if len(batch) >= COPY_CHUNK_SIZE:
+                model.objects.using(target).bulk_create(batch)
+                batch = []
+        model.objects.using(target).bulk_create(batch)
+
+
+def _copy(obj, source, target, pk):
+    """Create or refresh the copy of ``obj`` on ``target``, visit data included"""
+    from .models import ShortURL
+
+    fields = {
+        field.attname: getattr(obj, field.attname)
+        for field in ShortURL._meta.concrete_fields if not field.primary_key
+    }
+    copies = ShortURL.objects.using(target)
+    with transaction.atomic(using=target):
+        existing = copies.filter(short_code=obj.short_code).values_list('pk', flat=True).first()
+        if existing is None:
+            copies.bulk_create([ShortURL(pk=pk, **fields)])
+        else:
+            pk = existing
+        # Also restores the timestamps bulk_create() set to now
+        copies.filter(pk=pk).update(**fields)
+        _copy_dependents(obj.pk, pk, source, target)
+
+
+def _renumber(obj, alias, pk):
+    from .models import ShortURL
+
+    # Foreign keys are checked at commit, once both sides carry the new id
+    with transaction.atomic(using=alias):
+        ShortURL.objects.using(alias).filter(pk=obj.pk).update(id=pk)
+        for model, field in _dependents():
+            model.objects.using(alias).filter(**{field: obj.pk}).update(**{field: pk})
+
+
+def reshard(aliases, batch_size=500, dry_run=False):
+    """
+    Copy every short URL whose shard differs under ``aliases`` to that shard,
+    with its visit data, and renumber rows whose id doesn't carry its bucket.
+    Originals stay where they are until clean_up_shards(). Safe to re-run:
+    existing copies are refreshed. Returns (copied, renumbered in place).
+    """
+    from .models import ShortURL
+
+    aliases = tuple(aliases)
+    copied = renumbered = 0
+    for source in dict.fromkeys([*shards(), *aliases]):
+        last_pk = 0
+        while True:
+            batch = list(
+                ShortURL.objects.using(source).filter(pk__gt=last_pk).order_by('pk')[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            moves = []
+            for obj in batch:
+                target = shard_for_code(obj.short_code, aliases)
+                encoded = obj.pk % SHARD_BUCKETS == bucket_for_code(obj.short_code)
+                if target != source or not encoded:
+                    moves.append((obj, target, encoded))
+            if dry_run:
+                copied += sum(1 for _, target, _ in moves if target != source)
+                renumbered += sum(1 for _, target, _ in moves if target == source)
+                continue
+
+            new_ids = iter(allocate_ids(
+                [obj.short_code for obj, _, encoded in moves if not encoded]
+            ))
+            for obj, target, encoded in moves:
+                pk = obj.pk if encoded else next(new_ids)
+                if target == source:
+                    _renumber(obj, source, pk)
+                    renumbered += 1
+                else:
+                    _copy(obj, source, target, pk)
+                    copied += 1
+    return copied, renumbered
+
+
+def clean_up_shards(batch_size=500, dry_run=False):
+    """
+    Delete short URLs from the shards that no longer own them, once a copy
+    exists on the owner. Returns (deleted, kept because they have no copy).
+    """
+    from .models import ShortURL
+
+    deleted = kept = 0
+    for alias in shards():
+        last_pk = 0
+        while True:
+            batch = list(
+                ShortURL.objects.using(alias)
+                .filter(pk__gt=last_pk)
+                .order_by('pk')
+                .values_list('pk', 'short_code')[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            strays = {code: pk for pk, code in batch if shard_for_code(code) != alias}
+            copied = codes_in_use(strays)
+            kept += len(strays) - len(copied)
+            deleted += len(copied)
+            if copied and not dry_run:
+                ShortURL.objects.using(alias).filter(
+                    pk__in=[strays[code] for code in copied]
+                ).delete()
+    return deleted, kept
@@ -0,0 +1,54 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .bloom import code_filter
+from .cache import resolution_cache
+from .models import ShortURL, URLVisit
+from .sharding import shard_for_code, shards
+
+
+def _created(row):
+    code_filter.add(row[0])
+    resolution_cache.prime_many([row])
+
+
+@receiver(post_save, sender=ShortURL)
+@receiver(post_delete, sender=ShortURL)
+def invalidate_resolution_cache(sender, instance, created=False, using=None, **kwargs):
+    """Drop cached (or negatively cached) resolution once the change commits (on its shard)"""
+    if using != shard_for_code(instance.short_code):
+        # A copy left behind by resharding (see sharding.py), not the live row
+        return
+    row = (instance.short_code, instance.pk, instance.target_url, instance.is_private)
+    if created:
+        # New codes are cached right away (replacing any negative entry)
+        transaction.on_commit(partial(_created, row), using=using)
+    elif settings.DATABASE_REPLICAS or settings.REDIRECT_SNAPSHOT_PATH:
+        # A lookup now could read the old row back from a lagging replica or
+        # the snapshot, so cache the new state rather than dropping the entry
+        deleted = kwargs['signal'] is post_delete
+        transaction.on_commit(partial(
+            resolution_cache.replace, instance.short_code, None if deleted else row[1:]
+        ), using=using)
+    else:
+        transaction.on_commit(
+            partial(resolution_cache.invalidate, instance.short_code), using=using
+        )
+
+
+def _delete_user_data(user_pk, using):
+    for alias in shards():
+        if alias != using:
+            ShortURL.objects.using(alias).filter(owner_id=user_pk).delete()
+            URLVisit.objects.using(alias).filter(user_id=user_pk).update(user=None)
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def delete_user_data_on_other_shards(sender, instance, using, **kwargs):
+    """Repeat the owner/visitor cascade on the shards the ORM's doesn't reach"""
+    if len(shards()) > 1:
+        transaction.on_commit(partial(_delete_user_data, instance.pk, using), using=using)
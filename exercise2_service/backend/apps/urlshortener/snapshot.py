@@ -0,0 +1,342 @@
+"""
+Memory-mapped snapshot of public redirects, shared by all workers on a host.
+
+``build_snapshot()`` (the ``build_redirect_snapshot`` command) writes every
+public short_code -> target_url mapping to ``settings.REDIRECT_SNAPSHOT_PATH``
+as a sorted table of fixed-size records followed by the UTF-8 target URLs.
+Workers map the file read-only and binary-search it, so the data lives once
+in the page cache instead of once per worker, and a lookup costs no query.
+
+``build_snapshot(delta=True)`` writes ``<path>.delta`` instead: every row
+changed since the base snapshot was built, with private and deleted codes as
+tombstones. The delta is consulted first and is rebuilt from scratch on each
+run, so it stays small if the base is rebuilt now and then (e.g. deltas
+every minute, a full build nightly). Each delta names the base it belongs to
+and is ignored under any other base, so a full rebuild never combines with a
+stale delta.
+
+Both files are replaced atomically (written aside, then ``os.replace()``);
+readers notice within ``REDIRECT_SNAPSHOT_CHECK_INTERVAL`` seconds and map
+the new file. The snapshot only answers "this code is public and redirects
+here": misses and tombstones fall through to the database, so codes created
+since the last run still resolve. Edits and deletions reach it with the next
+delta. Until then saving one caches the new state in the resolution cache
+(see signals.py), but a worker that doesn't share that cache keeps reading
+the snapshot. So the snapshot is only trusted for
+``REDIRECT_SNAPSHOT_DELTA_INTERVAL`` plus ``DELTA_GRACE`` seconds after its
+newest file (base or delta) was built, and rows read from it are cached no
+longer than that; if the delta builds stop, lookups go back to the database.
+
+File layout (little endian)::
+
+    header   magic (8s) count (I) snapshot id (Q) built at (d)
+    records  count x [code (10s, NUL padded) pk (Q) url offset (Q)
+                      url length (I) flags (B)], sorted by code
+    urls     UTF-8 target URLs; offsets are relative to this section
+"""
+import heapq
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from django.db.models.functions import Collate
+
+from .models import ShortURL
+from .sharding import group_by_shard, shard_for_code, shards
+
+BASE_MAGIC = b'URLSNAP1'
+DELTA_MAGIC = b'URLDLTA1'
+HEADER = struct.Struct('<8sIQd')
+RECORD = struct.Struct('<10sQQIB')
+CODE_SIZE = 10
+
+FLAG_TOMBSTONE = 1
+
+# Rows saved this long before a base build started are still re-read by
+# deltas, for transactions that committed after the build's scan began
+DELTA_OVERLAP = timedelta(minutes=5)
+# How late a delta build may be before the snapshot is no longer trusted
+DELTA_GRACE = 30
+CHECK_CHUNK_SIZE = 5000
+
+
+def delta_path(path):
+    return f'{path}.delta'
+
+
+def _key(short_code):
+    return short_code.encode('ascii').ljust(CODE_SIZE, b'\0')
+
+
+class SnapshotFile:
+    """One mapped snapshot or delta file"""
+
+    def __init__(self, path, magic):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        found, self.count, self.snapshot_id, self.built_at = HEADER.unpack_from(self.data, 0)
+        if found != magic:
+            raise ValueError(f'{path} is not a redirect snapshot ({found!r})')
+        self.urls_start = HEADER.size + self.count * RECORD.size
+
+    def _record(self, index):
+        return RECORD.unpack_from(self.data, HEADER.size + index * RECORD.size)
+
+    def find(self, short_code):
+        """(pk, target_url, flags) for the code, or None"""
+        key = _key(short_code)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = HEADER.size + middle * RECORD.size
+            code = self.data[start:start + CODE_SIZE]
+            if code < key:
+                low = middle + 1
+            elif code > key:
+                high = middle
+            else:
+                _, pk, offset, length, flags = self._record(middle)
+                start = self.urls_start + offset
+                return pk, self.data[start:start + length].decode(), flags
+        return None
+
+    def __iter__(self):
+        for index in range(self.count):
+            code, pk, *_ = self._record(index)
+            yield code.rstrip(b'\0').decode('ascii'), pk
+
+
+class RedirectSnapshot:
+    """Process-wide reader of the base snapshot and its delta"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = (None, None)
+        self._stats = None
+        self._next_check = 0
+        self.hits = 0
+        self.stale_skips = 0
+
+    def _load(self, path, magic):
+        try:
+            return SnapshotFile(path, magic)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _signature(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self, path):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + settings.REDIRECT_SNAPSHOT_CHECK_INTERVAL
+            stats = (self._signature(path), self._signature(delta_path(path)))
+            if stats == self._stats:
+                return
+            base = self._load(path, BASE_MAGIC)
+            delta = self._load(delta_path(path), DELTA_MAGIC) if base else None
+            if delta is not None and delta.snapshot_id != base.snapshot_id:
+                delta = None
+            # Old maps are closed once no lookup references them any more
+            self._files = (base, delta)
+            self._stats = stats
+
+    @staticmethod
+    def _trusted_until(files):
+        base, delta = files
+        if base is None:
+            return 0
+        built_at = (delta or base).built_at
+        return built_at + settings.REDIRECT_SNAPSHOT_DELTA_INTERVAL + DELTA_GRACE
+
+    def trusted_for(self):
+        """Seconds until the mapped snapshot is too old to answer lookups"""
+        return max(0, self._trusted_until(self._files) - time.time())
+
+    def lookup(self, short_code):
+        """(pk, target_url, is_private) row of a public code, or None if unknown"""
+        path = settings.REDIRECT_SNAPSHOT_PATH
+        if not path or len(short_code) > CODE_SIZE or not short_code.isascii():
+            return None
+        self._refresh(path)
+        files = self._files
+        if time.time() > self._trusted_until(files):
+            # Deltas stopped: edits since the last one may be missing
+            if files[0] is not None:
+                self.stale_skips += 1
+            return None
+        base, delta = files
+        for snapshot in (delta, base):
+            if snapshot is None:
+                continue
+            found = snapshot.find(short_code)
+            if found is not None:
+                pk, target_url, flags = found
+                if flags & FLAG_TOMBSTONE:
+                    return None
+                self.hits += 1
+                return pk, target_url, False
+        return None
+
+    def stats(self):
+        base, delta = self._files
+        return {
+            'codes': base.count if base else 0,
+            'delta_codes': delta.count if delta else 0,
+            'built_at': base.built_at if base else None,
+            'trusted_for': self.trusted_for(),
+            'hits': self.hits,
+            'stale_skips': self.stale_skips,
+        }
+
+    def reset(self):
+        """Forget the mapped files (tests)"""
+        with self._lock:
+            self._files = (None, None)
+            self._stats = None
+            self._next_check = 0
+            self.hits = 0
+            self.stale_skips = 0
+
+
+def _write(path, magic, snapshot_id, built_at, rows):
+    """
+    Write (short_code, pk, target_url, flags) rows, already sorted by code,
+    to ``path`` atomically. Returns the number of rows written.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    count = 0
+    offset = 0
+    previous = b''
+    with tempfile.TemporaryFile(dir=directory) as records, \
+            tempfile.TemporaryFile(dir=directory) as urls:
+        for short_code, pk, target_url, flags in rows:
+            key = _key(short_code)
+            if key <= previous:
+                raise ValueError(f'Rows are not sorted by short code at {short_code!r}')
+            previous = key
+            url = target_url.encode()
+            records.write(RECORD.pack(key, pk, offset, len(url), flags))
+            urls.write(url)
+            offset += len(url)
+            count += 1
+        fd, partial = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(HEADER.pack(magic, count, snapshot_id, built_at))
+                for part in (records, urls):
+                    part.seek(0)
+                    shutil.copyfileobj(part, out)
+                out.flush()
+                os.fsync(out.fileno())
+            os.chmod(partial, 0o644)
+            os.replace(partial, path)
+        except BaseException:
+            os.unlink(partial)
+            raise
+    return count
+
+
+def _shard_public_rows(alias):
+    order = F('short_code')
+    if connections[alias].vendor == 'postgresql':
+        order = Collate('short_code', 'C')
+    rows = (
+        ShortURL.objects
+        .using(alias)
+        .filter(is_private=False)
+        .order_by(order)
+        .values_list('short_code', 'pk', 'target_url')
+    )
+    for short_code, pk, target_url in rows.iterator(chunk_size=10000):
+        yield short_code, pk, target_url, 0
+
+
+def _public_rows():
+    """Public rows in byte order of short_code, streamed from every shard"""
+    return heapq.merge(
+        *(_shard_public_rows(alias) for alias in shards()), key=lambda row: _key(row[0])
+    )
+
+
+def _delta_rows(base):
+    since = datetime.fromtimestamp(base.built_at, dt_timezone.utc) - DELTA_OVERLAP
+    rows = {}
+    for alias in shards():
+        changed = (
+            ShortURL.objects
+            .using(alias)
+            .filter(updated_at__gte=since)
+            .values_list('short_code', 'pk', 'target_url', 'is_private')
+        )
+        for short_code, pk, target_url, is_private in changed.iterator(chunk_size=10000):
+            if is_private:
+                rows[short_code] = (pk, '', FLAG_TOMBSTONE)
+            else:
+                rows[short_code] = (pk, target_url, 0)
+
+    # Codes deleted since the base was built become tombstones
+    chunk = []
+    for short_code, pk in base:
+        chunk.append((short_code, pk))
+        if len(chunk) >= CHECK_CHUNK_SIZE:
+            _add_deleted(rows, chunk)
+            chunk = []
+    _add_deleted(rows, chunk)
+    return [(code, *rows[code]) for code in sorted(rows, key=_key)]
+
+
+def _add_deleted(rows, chunk):
+    if not chunk:
+        return
+    existing = set()
+    for alias, codes in group_by_shard(chunk, lambda row: shard_for_code(row[0])).items():
+        existing.update(
+            ShortURL.objects
+            .using(alias)
+            .filter(pk__in=[pk for _, pk in codes])
+            .values_list('pk', 'short_code')
+        )
+    for short_code, pk in chunk:
+        if (pk, short_code) not in existing and short_code not in rows:
+            rows[short_code] = (pk, '', FLAG_TOMBSTONE)
+
+
+def build_snapshot(path=None, delta=False):
+    """Write the base snapshot (or its delta); returns the number of records"""
+    path = path or settings.REDIRECT_SNAPSHOT_PATH
+    if not path:
+        raise ValueError('REDIRECT_SNAPSHOT_PATH is not set')
+    built_at = time.time()
+    if not delta:
+        snapshot_id = time.time_ns()
+        count = _write(path, BASE_MAGIC, snapshot_id, built_at, _public_rows())
+        # An empty delta for the new base replaces the old base's delta
+        _write(delta_path(path), DELTA_MAGIC, snapshot_id, built_at, [])
+        return count
+    try:
+        base = SnapshotFile(path, BASE_MAGIC)
+    except (OSError, ValueError):
+        raise FileNotFoundError(f'No base snapshot at {path}; build one without --delta first')
+    return _write(delta_path(path), DELTA_MAGIC, base.snapshot_id, built_at, _delta_rows(base))
+
+
+redirect_snapshot = RedirectSnapshot()
@@ -1,3 +1,1502 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core import signals
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import (
+    OperationalError, close_old_connections, connection, connections, transaction,
+)
+from django.test import (
+    AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from psycopg2 import extensions
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from project.pooled_postgresql.base import ConnectionPool
+
+from .async_views import AsyncRedirectView, AsyncShortenURLView
+from .bloom import BloomFilter, code_filter
+from .bulk import create_short_urls, iter_upload_lines
+from .cache import resolution_cache
+from .codegen import (
+    IDBlockAllocator, KeyspacePermutation, RandomCodeGenerator, get_code_generator,
+    reset_code_generator,
+)
+from .counters import ViewCounter
+from .edge import import_edge_visits, render_nginx_map, write_nginx_map
+from .fastpath import RedirectFastPath
+from .hll import HyperLogLog
+from .jobs import recover_stale_jobs
+from .models import BulkUploadJob, ShortCodeSequence, ShortURL, URLVisit, URLVisitDaily
+from .partitions import archive_visits
+from .replicas import ReplicaRouter, replica_reads
+from .sharding import (
+    SHARD_BUCKETS, allocate_ids, bucket_for_code, codes_in_use, shard_for_code, shard_for_pk,
+)
+from .snapshot import DELTA_GRACE, build_snapshot, redirect_snapshot
+from .tracking import VisitEvent, VisitPipeline, visit_pipeline
+from .urlnorm import hash_url, normalize_url
+from .validation import INVALID_SCHEME, INVALID_URL, URL_TOO_LONG, check_target_url, validate_many
+from .warmup import ranked_ids, warm_resolution_cache
+
+User = get_user_model()
+
+
+# The filter's builder thread can't see rows created inside test transactions
+@override_settings(VISIT_TRACKING_ASYNC=False, SHORT_CODE_FILTER_ENABLED=False)
+class ShortenerTestCase(TestCase):
+    """Common fixtures: a user, an API client and clean caches"""
+
+    def setUp(self):
+        cache.clear()
+        reset_code_generator()
+        resolution_cache.clear()
+        resolution_cache.reset_stats()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass12345'
+        )
+
+    def make_url(self, code='abc123', target='https://example.com', **kwargs):
+        kwargs.setdefault('owner', self.user)
+        return ShortURL.objects.create(short_code=code, target_url=target, **kwargs)
+
+
+class ResolutionCacheTests(ShortenerTestCase):
+
+    def test_redirect_is_served_from_cache_after_first_hit(self):
+        self.make_url()
+        self.assertEqual(self.client.get('/abc123/').status_code, 302)
+        # visit write (check + insert + rollups, in a savepoint) + views update; no lookup
+        with self.assertNumQueries(16):
+            response = self.client.get('/abc123/')
+        self.assertEqual(response['Location'], 'https://example.com')
+        self.assertEqual(resolution_cache.stats()['local_hits'], 1)
+        self.assertEqual(URLVisit.objects.count(), 2)
+
+    def test_unknown_codes_are_cached_negatively_until_created(self):
+        self.assertEqual(self.client.get('/nope42/').status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/nope42/').status_code, 404)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_url(code='nope42')
+        self.assertEqual(self.client.get('/nope42/').status_code, 302)
+
+    def test_update_and_delete_invalidate(self):
+        url = self.make_url()
+        self.client.get('/abc123/')
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                f'/api/urls/{url.pk}/update/', {'target_url': 'https://example.org'}
+            )
+        self.assertEqual(self.client.get('/abc123/')['Location'], 'https://example.org')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/urls/{url.pk}/delete/')
+        self.assertEqual(self.client.get('/abc123/').status_code, 404)
+
+    def test_in_process_shared_tier_keeps_entries_no_longer_than_the_local_one(self):
+        self.make_url()
+        shared = resolution_cache.shared
+        with self.settings(REDIRECT_CACHE_LOCAL_TTL=10, REDIRECT_CACHE_SHARED_TTL=300), \
+                mock.patch.object(shared, 'set', wraps=shared.set) as cache_set:
+            self.client.get('/abc123/')
+        self.assertEqual(cache_set.call_args.args[2], 10)
+
+
+class VisitPipelineTests(ShortenerTestCase):
+
+    def event(self, url):
+        return VisitEvent(url.pk, None, '127.0.0.1', 'test', timezone.now())
+
+    @override_settings(
+        VISIT_TRACKING_ASYNC=True,
+        VISIT_QUEUE_MAX_SIZE=2,
+        VISIT_QUEUE_FULL_POLICY='drop',
+    )
+    def test_full_queue_drops_and_flush_writes_in_one_batch(self):
+        url = self.make_url()
+        pipeline = VisitPipeline(autostart=False)
+        for _ in range(3):
+            pipeline.record(self.event(url))
+        self.assertEqual(pipeline.stats()['dropped'], 1)
+        self.assertEqual(URLVisit.objects.count(), 0)
+
+        # one savepoint with the existence check, the rollup updates and one
+        # bulk insert, then one views update, however many events the batch holds
+        with self.assertNumQueries(16):
+            pipeline.flush()
+        url.refresh_from_db()
+        self.assertEqual(URLVisit.objects.count(), 2)
+        self.assertEqual(url.views, 2)
+
+    @override_settings(VISIT_TRACKING_ASYNC=True)
+    def test_visits_to_urls_deleted_while_queued_are_skipped(self):
+        kept, deleted = self.make_url('aaa111'), self.make_url('bbb222')
+        pipeline = VisitPipeline(autostart=False)
+        for url in (kept, deleted, kept):
+            pipeline.record(self.event(url))
+        deleted.delete()
+        pipeline.flush()
+        stats = pipeline.stats()
+        self.assertEqual((stats['written'], stats['orphaned'], stats['failed']), (2, 1, 0))
+        self.assertEqual(URLVisit.objects.filter(short_url=kept).count(), 2)
+        self.assertEqual(URLVisitDaily.objects.get().short_url, kept)
+
+    @override_settings(
+        VISIT_TRACKING_ASYNC=True,
+        VISIT_QUEUE_MAX_SIZE=1,
+        VISIT_QUEUE_FULL_POLICY='inline',
+    )
+    def test_inline_policy_writes_overflow_synchronously(self):
+        url = self.make_url()
+        pipeline = VisitPipeline(autostart=False)
+        pipeline.record(self.event(url))
+        pipeline.record(self.event(url))
+        self.assertEqual(pipeline.stats()['inline'], 1)
+        self.assertEqual(URLVisit.objects.count(), 1)
+
+
+class ViewCounterTests(ShortenerTestCase):
+
+    def test_deltas_for_many_urls_fold_into_one_update(self):
+        first, second = self.make_url('aaa111'), self.make_url('bbb222')
+        counter = ViewCounter()
+        for _ in range(5):
+            counter.add(first.pk)
+        counter.add(second.pk, 3)
+        with self.assertNumQueries(1):
+            self.assertEqual(counter.flush(), 2)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.views, second.views), (5, 3))
+        with self.assertNumQueries(0):
+            counter.flush()
+
+    @override_settings(VIEW_COUNTER_SHARED=True)
+    def test_shared_mode_folds_deltas_recorded_by_other_processes(self):
+        url = self.make_url()
+        this_worker, other_worker = ViewCounter(), ViewCounter()
+        this_worker.add(url.pk, 2)
+        other_worker.add(url.pk, 4)
+        this_worker.flush()
+        other_worker.flush()
+        url.refresh_from_db()
+        self.assertEqual(url.views, 6)
+
+
+class ShortCodeGeneratorTests(ShortenerTestCase):
+
+    def test_permutation_is_a_bijection(self):
+        permutation = KeyspacePermutation(2, 'key')
+        outputs = {permutation(number) for number in range(permutation.size)}
+        self.assertEqual(outputs, set(range(permutation.size)))
+
+    def test_codes_come_from_reserved_blocks(self):
+        with self.settings(SHORT_CODE_BLOCK_SIZE=50):
+            reset_code_generator()
+            generator = get_code_generator()
+            codes = [generator.generate(6) for _ in range(50)]
+            # the next 50 codes need exactly one more reservation
+            with self.assertNumQueries(4):  # savepoint, UPDATE, SELECT, release
+                codes += [generator.generate(6) for _ in range(50)]
+        self.assertEqual(len(set(codes)), 100)
+        self.assertTrue(all(len(code) == 6 for code in codes))
+
+    def test_rolled_back_reservation_is_not_handed_out_twice(self):
+        allocator = IDBlockAllocator('test', 10)
+        with self.assertRaises(DjangoValidationError):
+            with transaction.atomic():
+                allocator.take(3)
+                raise DjangoValidationError('upload rejected')
+        # Another process reserving after the rollback gets distinct ids
+        ids = allocator.take(5) + IDBlockAllocator('test', 10).take(10)
+        self.assertEqual(len(set(ids)), 15)
+
+    def test_create_retries_when_code_is_already_taken(self):
+        generator = get_code_generator()
+        taken = generator.encode(0)
+        self.make_url(code=taken)
+        reset_code_generator()
+        response = self.client.post(
+            '/api/urls/shorten/', {'target_url': 'https://example.com'}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertNotEqual(response.data['short_code'], taken)
+
+
+class IDBlockReservationTests(TransactionTestCase):
+    """Without TestCase's transaction, so a second connection can write"""
+
+    def test_reservation_inside_a_transaction_commits_on_its_own(self):
+        opened = []
+        original = connections.create_connection
+
+        def create_connection(alias):
+            other = original(alias)
+            other.close = mock.Mock(wraps=other.close)
+            opened.append(other)
+            return other
+
+        allocator = IDBlockAllocator('separate', 10)
+        with mock.patch.object(connection, 'vendor', 'postgresql'), \
+                mock.patch.object(connections, 'create_connection', create_connection):
+            with self.assertRaises(DjangoValidationError):
+                with transaction.atomic():
+                    ids = allocator.take(3)
+                    raise DjangoValidationError('upload rejected')
+        self.assertEqual(len(opened), 1)
+        opened[0].close.assert_called_once_with()
+        sequence = ShortCodeSequence.objects.get(name='separate')
+        self.assertEqual(sequence.next_value, ids[0] + 10)
+
+
+class BulkUploadTests(ShortenerTestCase):
+
+    def upload(self, lines):
+        self.client.force_authenticate(self.user)
+        upload = SimpleUploadedFile('urls.txt', '\n'.join(lines).encode())
+        return self.client.post('/api/urls/bulk/', {'file': upload}, format='multipart')
+
+    def test_large_upload_is_inserted_in_a_handful_of_queries(self):
+        lines = [f'https://example.com/page/{n}' for n in range(1000)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.upload(lines)
+        # Per 500-line batch: a code reservation, a collision check and the
+        # INSERT (which SQLite splits further); nowhere near one per line
+        self.assertLess(len(queries), 35)
+        self.assertEqual(response.data['success'], 1000)
+        self.assertEqual(ShortURL.objects.filter(owner=self.user).count(), 1000)
+        self.assertEqual(
+            len({result['short_code'] for result in response.data['results']}), 1000
+        )
+
+    def test_results_keep_line_order_and_report_invalid_lines(self):
+        response = self.upload(['https://a.example', 'not a url', '', 'https://b.example'])
+        self.assertEqual((response.data['total'], response.data['failed']), (3, 1))
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['success', 'failed', 'success'],
+        )
+        self.assertEqual(response.data['results'][2]['original_url'], 'https://b.example')
+
+    @override_settings(MAX_URLS_PER_UPLOAD=3)
+    def test_upload_over_the_limit_is_rejected_without_creating_anything(self):
+        response = self.upload([f'https://example.com/{n}' for n in range(5)])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ShortURL.objects.exists())
+
+    def test_lines_are_split_across_chunk_boundaries(self):
+        upload = File(io.BytesIO('https://ä.example\r\n\nhttps://b.example'.encode()))
+        upload.DEFAULT_CHUNK_SIZE = 5
+        lines = [line.strip() for line in iter_upload_lines(upload)]
+        self.assertEqual([line for line in lines if line], ['https://ä.example', 'https://b.example'])
+
+    def test_lone_carriage_returns_end_lines(self):
+        upload = File(io.BytesIO(b'https://a.example\rhttps://b.example\r\rhttps://c.example'))
+        upload.DEFAULT_CHUNK_SIZE = 4
+        self.assertEqual(
+            list(iter_upload_lines(upload)),
+            ['https://a.example', 'https://b.example', '', 'https://c.example'],
+        )
+        # A CRLF split between chunks is still one line break
+        upload = File(io.BytesIO(b'ab\r\ncd\r\n'))
+        upload.DEFAULT_CHUNK_SIZE = 3
+        self.assertEqual(list(iter_upload_lines(upload)), ['ab', 'cd', ''])
+
+    def test_over_long_lines_are_cut_without_buffering_them(self):
+        upload = File(io.BytesIO(b'x' * 100 + b'\nhttps://a.example\n'))
+        upload.DEFAULT_CHUNK_SIZE = 8
+        self.assertEqual(
+            list(iter_upload_lines(upload, max_line_length=20)),
+            ['x' * 20, 'https://a.example', ''],
+        )
+
+
+@override_settings(BULK_UPLOAD_WORKERS=0, MEDIA_ROOT=tempfile.mkdtemp())
+class BulkUploadJobTests(ShortenerTestCase):
+
+    def test_async_upload_returns_job_and_exposes_progress_and_results(self):
+        self.client.force_authenticate(self.user)
+        lines = [f'https://example.com/{n}' for n in range(30)] + ['bad url']
+        upload = SimpleUploadedFile('urls.txt', '\n'.join(lines).encode())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/urls/bulk/?async=true', {'file': upload}, format='multipart'
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+
+        job = self.client.get(f"/api/urls/bulk/jobs/{response.data['id']}/").data
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(
+            (job['total'], job['processed'], job['success'], job['failed']), (31, 31, 30, 1)
+        )
+
+        page = self.client.get(job['results_url'] + '?page=2').data
+        self.assertEqual(page['count'], 31)
+        self.assertEqual(page['results'][-1]['status'], 'failed')
+
+        download = self.client.get(job['results_url'] + '?download=csv')
+        self.assertEqual(len(b''.join(download.streaming_content).splitlines()), 32)
+        self.assertFalse(BulkUploadJob.objects.get().file)
+
+    def test_jobs_are_private_to_their_owner(self):
+        job = BulkUploadJob.objects.create(owner=self.user)
+        other = User.objects.create_user(
+            username='other', email='other@example.com', password='pass12345'
+        )
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(f'/api/urls/bulk/jobs/{job.pk}/').status_code, 404)
+        self.assertEqual(
+            self.client.get(f'/api/urls/bulk/jobs/{job.pk}/results/').status_code, 404
+        )
+
+    def test_jobs_interrupted_by_a_restart_resume_after_their_committed_lines(self):
+        lines = '\n'.join(f'https://example.com/{n}' for n in range(3))
+        stale = timezone.now() - timedelta(hours=1)
+        interrupted = BulkUploadJob.objects.create(
+            owner=self.user,
+            file=SimpleUploadedFile('urls.txt', lines.encode()),
+            status=BulkUploadJob.STATUS_RUNNING,
+            processed=1,
+            success=1,
+            heartbeat_at=stale,
+        )
+        lost = BulkUploadJob.objects.create(owner=self.user, heartbeat_at=stale)
+        active = BulkUploadJob.objects.create(
+            owner=self.user, status=BulkUploadJob.STATUS_RUNNING
+        )
+
+        self.assertEqual(recover_stale_jobs(dry_run=True), [lost, interrupted])
+        self.assertEqual(recover_stale_jobs(inline=True), [interrupted])
+
+        interrupted.refresh_from_db()
+        self.assertEqual(interrupted.status, 'completed')
+        self.assertEqual((interrupted.processed, interrupted.success), (3, 3))
+        self.assertEqual(
+            list(interrupted.results.values_list('line_number', flat=True)), [2, 3]
+        )
+        self.assertFalse(interrupted.file)
+        lost.refresh_from_db()
+        self.assertEqual(lost.status, 'failed')
+        active.refresh_from_db()
+        self.assertEqual(active.status, 'running')
+
+
+class URLListQueryTests(ShortenerTestCase):
+
+    def create_urls(self, count):
+        existing = ShortURL.objects.count()
+        for n in range(existing, existing + count):
+            url = self.make_url(code=f'list{n:02d}')
+            visit_pipeline.record(VisitEvent(url.pk, None, '127.0.0.1', '', timezone.now()))
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/urls/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.data['results']
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.client.force_authenticate(self.user)
+        self.create_urls(2)
+        small, _ = self.count_list_queries()
+        self.create_urls(20)
+        full, results = self.count_list_queries()
+        self.assertEqual(len(results), 20)
+        self.assertEqual(small, full)
+        self.assertIsNotNone(results[0]['last_visit'])
+        self.assertEqual(results[0]['owner_email'], self.user.email)
+
+    def test_anonymous_listing_is_constant_too(self):
+        self.create_urls(1)
+        small, _ = self.count_list_queries()
+        self.create_urls(19)
+        full, _ = self.count_list_queries()
+        self.assertEqual(small, full)
+
+
+class KeysetPaginationTests(ShortenerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for n in range(45):
+            self.make_url(code=f'page{n:02d}')
+
+    def codes(self, response):
+        return [row['short_code'] for row in response.data['results']]
+
+    def test_pages_are_stable_under_inserts_and_skip_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            first = self.client.get('/api/urls/?pagination=cursor')
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+        self.assertEqual(self.codes(first)[0], 'page44')
+        self.assertIsNone(first.data['previous'])
+
+        self.make_url(code='newest')
+        second = self.client.get(first.data['next'])
+        third = self.client.get(second.data['next'])
+        self.assertEqual(self.codes(second)[0], 'page24')
+        self.assertEqual(self.codes(third), ['page04', 'page03', 'page02', 'page01', 'page00'])
+        self.assertIsNone(third.data['next'])
+
+        back = self.client.get(third.data['previous'])
+        self.assertEqual(self.codes(back), self.codes(second))
+
+    def test_invalid_cursor_is_a_404(self):
+        self.assertEqual(self.client.get('/api/urls/?cursor=garbage').status_code, 404)
+
+    def test_page_number_pagination_is_still_the_default(self):
+        response = self.client.get('/api/urls/')
+        self.assertEqual(response.data['count'], 45)
+
+
+class VisitRollupTests(ShortenerTestCase):
+
+    def visit(self, url, ip, accessed_at):
+        visit_pipeline.record(VisitEvent(url.pk, None, ip, '', accessed_at))
+
+    def test_pipeline_maintains_last_visit_and_daily_rollup(self):
+        url = self.make_url()
+        today = timezone.now()
+        yesterday = today - timedelta(days=1)
+        self.visit(url, '10.0.0.1', yesterday)
+        self.visit(url, '10.0.0.1', today)
+        self.visit(url, '10.0.0.1', today)
+        self.visit(url, '10.0.0.2', today)
+
+        url.refresh_from_db()
+        self.assertEqual(url.last_visited_at, today)
+        rollup = {
+            row.date: (row.count, row.unique_ips) for row in URLVisitDaily.objects.all()
+        }
+        self.assertEqual(rollup, {today.date(): (3, 2), yesterday.date(): (1, 1)})
+        # Sparse sketches: a few bytes per visitor, not 4 KB per day
+        sketch = URLVisitDaily.objects.get(date=today.date()).visitor_sketch
+        self.assertEqual(len(sketch), 7)
+
+    def test_backfill_rebuilds_rollups_from_the_visit_log(self):
+        url = self.make_url()
+        now = timezone.now()
+        for ip in ('10.0.0.1', '10.0.0.1', '10.0.0.2'):
+            URLVisit.objects.create(short_url=url, ip_address=ip, accessed_at=now)
+
+        call_command('backfill_visit_rollups', chunk_size=1, stdout=io.StringIO())
+        call_command('backfill_visit_rollups', stdout=io.StringIO())
+
+        url.refresh_from_db()
+        self.assertEqual(url.last_visited_at, now)
+        row = URLVisitDaily.objects.get()
+        self.assertEqual((row.count, row.unique_ips), (3, 2))
+
+
+class VisitArchiveTests(ShortenerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir, ignore_errors=True)
+
+    def test_old_months_are_archived_and_deleted(self):
+        url = self.make_url()
+        now = datetime(2026, 5, 15, 12, tzinfo=dt_timezone.utc)
+        for accessed_at in (
+            datetime(2026, 1, 31, 23, 59, tzinfo=dt_timezone.utc),
+            datetime(2026, 2, 1, tzinfo=dt_timezone.utc),
+            datetime(2026, 3, 10, tzinfo=dt_timezone.utc),
+            now,
+        ):
+            URLVisit.objects.create(short_url=url, ip_address='10.0.0.1', accessed_at=accessed_at)
+
+        archived = archive_visits(2, self.archive_dir, now=now)
+
+        self.assertEqual(
+            [(month, rows) for month, _, rows in archived],
+            [(date(2026, 1, 1), 1), (date(2026, 2, 1), 1)],
+        )
+        with gzip.open(archived[0][1], 'rt') as archive:
+            rows = list(csv.reader(archive))
+        self.assertEqual(rows[0][0], 'id')
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(
+            sorted(URLVisit.objects.values_list('accessed_at', flat=True)),
+            [datetime(2026, 3, 10, tzinfo=dt_timezone.utc), now],
+        )
+        # Months already archived are not written twice
+        self.assertEqual(archive_visits(2, self.archive_dir, now=now), [])
+
+    def test_dry_run_writes_nothing(self):
+        URLVisit.objects.create(
+            short_url=self.make_url(), ip_address='10.0.0.1',
+            accessed_at=timezone.now() - timedelta(days=400),
+        )
+        out = io.StringIO()
+        call_command('archive_visits', retention_months=1, archive_dir=self.archive_dir,
+                     dry_run=True, stdout=out)
+        self.assertIn('1 months would be archived', out.getvalue())
+        self.assertEqual(URLVisit.objects.count(), 1)
+        self.assertEqual(os.listdir(self.archive_dir), [])
+
+
+class URLStatsTests(ShortenerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def visit(self, url, ip='10.0.0.1', accessed_at=None, **kwargs):
+        visit_pipeline.record(VisitEvent(
+            url.pk, None, ip, kwargs.get('user_agent', ''),
+            accessed_at or timezone.now(), kwargs.get('referrer', ''),
+        ))
+
+    def test_stats_come_from_rollups(self):
+        url = self.make_url()
+        now = timezone.now()
+        chrome = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36'
+        self.visit(url, '10.0.0.1', now, user_agent=chrome, referrer='https://www.google.com/search')
+        self.visit(url, '10.0.0.1', now, user_agent=chrome, referrer='https://google.com/')
+        self.visit(url, '10.0.0.2', now - timedelta(days=2), user_agent='curl/8.0')
+
+        with self.assertNumQueries(5):  # URL, daily rows, all-time sketch, two top lists
+            response = self.client.get(f'/api/urls/{url.pk}/stats/?bucket=day&count=7')
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual(len(data['buckets']), 7)
+        self.assertEqual(data['total_visits'], 3)
+        self.assertEqual(data['unique_visitors'], 2)
+        self.assertEqual([b['visits'] for b in data['buckets']][-3:], [1, 0, 2])
+        self.assertEqual(data['top_referrers'], [
+            {'value': 'google.com', 'visits': 2}, {'value': '(direct)', 'visits': 1},
+        ])
+        self.assertEqual(data['top_browsers'][0], {'value': 'Chrome', 'visits': 2})
+        self.assertEqual(data['all_time_unique_visitors'], 2)
+
+        hourly = self.client.get(f'/api/urls/{url.pk}/stats/?bucket=hour&count=1').data
+        self.assertEqual(hourly['total_visits'], 2)
+        self.assertIsNone(hourly['unique_visitors'])
+
+    def test_etag_revalidation(self):
+        url = self.make_url()
+        self.visit(url)
+        first = self.client.get(f'/api/urls/{url.pk}/stats/')
+        etag = first['ETag']
+
+        response = self.client.get(f'/api/urls/{url.pk}/stats/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.visit(url, accessed_at=timezone.now() + timedelta(seconds=1))
+        response = self.client.get(f'/api/urls/{url.pk}/stats/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['total_visits'], 2)
+
+    def test_only_the_owner_sees_stats(self):
+        other = User.objects.create_user(
+            username='other', email='other@example.com', password='pass12345'
+        )
+        url = self.make_url(owner=other)
+        self.assertEqual(self.client.get(f'/api/urls/{url.pk}/stats/').status_code, 404)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(f'/api/urls/{url.pk}/stats/').status_code, 401)
+
+    def test_invalid_bucket_is_rejected(self):
+        url = self.make_url()
+        response = self.client.get(f'/api/urls/{url.pk}/stats/?bucket=year')
+        self.assertEqual(response.status_code, 400)
+
+
+class HyperLogLogTests(TestCase):
+
+    def test_estimate_is_within_bounds(self):
+        sketch = HyperLogLog()
+        sketch.update(f'10.{n // 65536}.{n // 256 % 256}.{n % 256}' for n in range(20000))
+        self.assertLess(abs(sketch.count() - 20000) / 20000, 0.05)
+        self.assertEqual(len(sketch.to_bytes()), 4096)
+
+    def test_small_counts_are_exact_enough(self):
+        sketch = HyperLogLog()
+        sketch.update(['10.0.0.1', '10.0.0.2', '10.0.0.1'])
+        self.assertEqual(sketch.count(), 2)
+
+    def test_sketches_stay_sparse_until_a_quarter_of_the_registers_are_set(self):
+        sketch = HyperLogLog()
+        sketch.update(f'10.0.0.{n}' for n in range(100))
+        data = sketch.to_bytes()
+        self.assertLessEqual(len(data), 1 + 3 * 100)
+        loaded = HyperLogLog.from_bytes(data)
+        self.assertEqual(loaded.count(), sketch.count())
+        dense = HyperLogLog.from_bytes(bytes(4096)).merge(loaded)
+        self.assertEqual(dense.count(), sketch.count())
+        self.assertEqual(len(dense.to_bytes()), 4096)
+
+        sketch.update(range(2000))
+        self.assertEqual(len(sketch.to_bytes()), 4096)
+        self.assertLess(abs(sketch.count() - 2100) / 2100, 0.05)
+
+    def test_merge_is_a_union(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        first.update(range(0, 3000))
+        second.update(range(2000, 5000))
+        union = HyperLogLog.from_bytes(first.to_bytes()).merge(second)
+        self.assertLess(abs(union.count() - 5000) / 5000, 0.05)
+        with self.assertRaises(ValueError):
+            first.merge(HyperLogLog(precision=10))
+
+
+class RedirectFastPathTests(ShortenerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.inner_calls = []
+        self.app = RedirectFastPath(self.inner)
+        # Like Django's test client: don't let request signals close the test connection
+        signals.request_started.disconnect(close_old_connections)
+        signals.request_finished.disconnect(close_old_connections)
+        self.addCleanup(signals.request_started.connect, close_old_connections)
+        self.addCleanup(signals.request_finished.connect, close_old_connections)
+
+    def inner(self, environ, start_response):
+        self.inner_calls.append(environ['PATH_INFO'])
+        start_response('200 OK', [])
+        return [b'django']
+
+    def call(self, path, method='GET', **extra):
+        environ = RequestFactory().generic(method, path, **extra).environ
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = dict(headers)
+
+        response['body'] = b''.join(self.app(environ, start_response))
+        return response
+
+    def test_public_code_is_redirected_without_django(self):
+        url = self.make_url()
+        response = self.call('/abc123/', HTTP_REFERER='https://news.example/')
+        self.assertEqual(response['status'], '302 Found')
+        self.assertEqual(response['headers']['Location'], 'https://example.com')
+        self.assertEqual(self.inner_calls, [])
+        visit = URLVisit.objects.get(short_url=url)
+        self.assertEqual((visit.ip_address, visit.referrer), ('127.0.0.1', 'https://news.example/'))
+
+        with self.assertNumQueries(16):  # visit write only; the code comes from cache
+            self.call('/abc123/')
+
+    def test_everything_else_falls_through(self):
+        self.make_url(code='priv01', is_private=True)
+        with self.assertNumQueries(0):
+            self.call('/api/urls/')
+            self.call('/abc123/', method='POST')
+            self.call('/abc123/', HTTP_HOST='evil.example')
+        self.call('/priv01/')
+        self.call('/nope42/')
+        self.assertEqual(
+            self.inner_calls, ['/api/urls/', '/abc123/', '/abc123/', '/priv01/', '/nope42/']
+        )
+        self.assertEqual(URLVisit.objects.count(), 0)
+
+
+class AsyncViewTests(ShortenerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+
+    async def test_public_redirect(self):
+        url = await ShortURL.objects.acreate(
+            short_code='abc123', target_url='https://example.com', owner=self.user
+        )
+        request = self.factory.get('/abc123/')
+        response = await AsyncRedirectView.as_view()(request, short_code='abc123')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], 'https://example.com')
+        self.assertEqual(await URLVisit.objects.filter(short_url=url).acount(), 1)
+
+        # Second hit comes from the local cache tier
+        await AsyncRedirectView.as_view()(self.factory.get('/abc123/'), short_code='abc123')
+        self.assertEqual(resolution_cache.stats()['local_hits'], 1)
+
+    async def test_visits_by_authenticated_users_are_attributed_to_them(self):
+        url = await ShortURL.objects.acreate(
+            short_code='abc123', target_url='https://example.com', owner=self.user
+        )
+        token = AccessToken.for_user(self.user)
+        request = self.factory.get('/abc123/', headers={'Authorization': f'Bearer {token}'})
+        response = await AsyncRedirectView.as_view()(request, short_code='abc123')
+        self.assertEqual(response.status_code, 302)
+        visit = await URLVisit.objects.aget(short_url=url)
+        self.assertEqual(visit.user_id, self.user.pk)
+
+    async def test_private_redirect_needs_authentication(self):
+        await ShortURL.objects.acreate(
+            short_code='priv01', target_url='https://example.com', is_private=True,
+            owner=self.user,
+        )
+        request = self.factory.get('/priv01/')
+        response = await AsyncRedirectView.as_view()(request, short_code='priv01')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_shorten(self):
+        request = self.factory.post(
+            '/api/urls/shorten/', {'target_url': 'https://example.com/async'},
+            content_type='application/json',
+        )
+        response = await AsyncShortenURLView.as_view()(request)
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.content)
+        url = await ShortURL.objects.aget(short_code=data['short_code'])
+        self.assertEqual(url.target_url, 'https://example.com/async')
+        self.assertIsNone(url.owner_id)
+
+    async def test_shorten_reports_validation_errors_like_drf(self):
+        request = self.factory.post(
+            '/api/urls/shorten/', {'target_url': 'ftp://example.com'},
+            content_type='application/json',
+        )
+        response = await AsyncShortenURLView.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('target_url', json.loads(response.content))
+
+
+@override_settings(SHORT_CODE_FILTER_ENABLED=True, SHORT_CODE_FILTER_MIN_CAPACITY=1000)
+class ShortCodeFilterTests(ShortenerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.autostart, code_filter.autostart = code_filter.autostart, False
+        code_filter.reset()
+
+    def tearDown(self):
+        code_filter.reset()
+        code_filter.autostart = self.autostart
+        super().tearDown()
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        codes = [f'code{number}' for number in range(1000)]
+        for code in codes:
+            bloom.add(code)
+        self.assertTrue(all(code in bloom for code in codes))
+        false_positives = sum(f'other{number}' in bloom for number in range(1000))
+        self.assertLess(false_positives, 50)
+
+    def test_unknown_code_is_looked_up_once_then_cached_negatively(self):
+        self.make_url()
+        code_filter.build()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/nope42/').status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/nope42/').status_code, 404)
+        self.assertEqual(resolution_cache.stats()['filter_rejections'], 1)
+        self.assertEqual(self.client.get('/abc123/').status_code, 302)
+
+    def test_codes_the_filter_has_not_seen_yet_still_resolve(self):
+        code_filter.build()
+        # created by another worker since the last refresh
+        ShortURL.objects.bulk_create([
+            ShortURL(short_code='other1', target_url='https://example.com')
+        ])
+        self.assertFalse(code_filter.might_exist('other1'))
+        self.assertEqual(self.client.get('/other1/').status_code, 302)
+        self.assertEqual(resolution_cache.stats()['filter_stale'], 1)
+        self.assertTrue(code_filter.might_exist('other1'))
+
+    def test_everything_might_exist_until_built(self):
+        self.assertTrue(code_filter.might_exist('nope42'))
+        self.assertEqual(self.client.get('/nope42/').status_code, 404)
+        self.assertEqual(resolution_cache.stats()['misses'], 1)
+
+    def test_created_codes_are_added_and_cached(self):
+        code_filter.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_url(code='new001')
+        self.assertTrue(code_filter.might_exist('new001'))
+        with self.assertNumQueries(16):  # visit write only
+            self.assertEqual(self.client.get('/new001/').status_code, 302)
+
+    def test_refresh_picks_up_codes_created_elsewhere(self):
+        code_filter.build()
+        # bulk-inserted by another process: no signal, no on_commit here
+        ShortURL.objects.bulk_create([
+            ShortURL(short_code='other1', target_url='https://example.com')
+        ])
+        self.assertFalse(code_filter.might_exist('other1'))
+        code_filter.refresh()
+        self.assertTrue(code_filter.might_exist('other1'))
+
+    def test_random_generator_skips_uniqueness_query(self):
+        code_filter.build()
+        with self.assertNumQueries(0):
+            codes = RandomCodeGenerator().generate_many(20, 8)
+        self.assertEqual(len(set(codes)), 20)
+
+
+class CacheWarmupTests(ShortenerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        today = timezone.now().date()
+        self.quiet = self.make_url(code='quiet1', views=500)
+        self.busy = self.make_url(code='busy01', views=10)
+        self.old = self.make_url(code='old001', views=100)
+        URLVisitDaily.objects.create(short_url=self.busy, date=today, count=40)
+        URLVisitDaily.objects.create(short_url=self.old, date=today - timedelta(days=30), count=90)
+
+    def test_warms_most_recently_visited_first(self):
+        self.assertEqual(warm_resolution_cache(limit=1), (1, True))
+        with self.assertNumQueries(16):  # visit write only
+            self.assertEqual(self.client.get('/busy01/').status_code, 302)
+        with self.assertNumQueries(17):
+            self.assertEqual(self.client.get('/quiet1/').status_code, 302)
+
+    def test_recent_ranking_is_filled_up_by_views(self):
+        self.assertEqual(
+            ranked_ids(3), [self.busy.pk, self.quiet.pk, self.old.pk]
+        )
+        public = ShortURL.objects.exclude(pk=self.busy.pk)
+        self.assertEqual(ranked_ids(3, queryset=public), [self.quiet.pk, self.old.pk])
+
+    def test_ranking_by_views(self):
+        warm_resolution_cache(limit=2, ranking='views')
+        resolution_cache.local.clear()
+        self.client.get('/quiet1/')
+        self.client.get('/old001/')
+        self.client.get('/busy01/')
+        stats = resolution_cache.stats()
+        self.assertEqual((stats['shared_hits'], stats['misses']), (2, 1))
+
+    def test_time_limit_stops_loading(self):
+        self.assertEqual(warm_resolution_cache(limit=10, time_limit=0), (0, False))
+        self.assertEqual(self.client.get('/busy01/').status_code, 302)
+        self.assertEqual(resolution_cache.stats()['misses'], 1)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('warm_redirect_cache', '--limit', '10', stdout=out)
+        self.assertIn('Loaded 3 URLs', out.getvalue())
+
+
+class URLNormalizationTests(TestCase):
+
+    def test_equivalent_urls_normalize_the_same(self):
+        self.assertEqual(
+            normalize_url('HTTPS://Example.COM:443/a/./b/../c/%7euser?q=%2f#top'),
+            'https://example.com/a/c/~user?q=%2F#top',
+        )
+        self.assertEqual(normalize_url('http://example.com'), 'http://example.com/')
+        self.assertEqual(normalize_url('http://example.com:8080/'), 'http://example.com:8080/')
+        self.assertEqual(normalize_url('https://ä.example/'), 'https://xn--4ca.example/')
+
+    def test_query_order_and_fragment_still_matter(self):
+        self.assertNotEqual(hash_url('https://e.com/?a=1&b=2'), hash_url('https://e.com/?b=2&a=1'))
+        self.assertNotEqual(hash_url('https://e.com/#a'), hash_url('https://e.com/#b'))
+        self.assertEqual(len(hash_url('https://e.com/')), 32)
+
+
+@override_settings(SHORT_URL_DEDUP=True)
+class DeduplicationTests(ShortenerTestCase):
+
+    def shorten(self, target_url, is_private=False):
+        return self.client.post(
+            '/api/urls/shorten/', {'target_url': target_url, 'is_private': is_private},
+            format='json',
+        )
+
+    def test_same_owner_and_target_reuses_the_code(self):
+        self.client.force_authenticate(self.user)
+        first = self.shorten('https://example.com/page')
+        second = self.shorten('https://EXAMPLE.com:443/page')
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(first.data['short_code'], second.data['short_code'])
+        self.assertEqual(ShortURL.objects.count(), 1)
+
+    def test_privacy_and_owner_are_part_of_the_key(self):
+        self.client.force_authenticate(self.user)
+        public = self.shorten('https://example.com/page')
+        private = self.shorten('https://example.com/page', is_private=True)
+        self.client.force_authenticate(None)
+        anonymous = self.shorten('https://example.com/page')
+        codes = {public.data['short_code'], private.data['short_code'], anonymous.data['short_code']}
+        self.assertEqual(len(codes), 3)
+        self.assertEqual(self.shorten('https://example.com/page').data['short_code'],
+                         anonymous.data['short_code'])
+
+    @override_settings(SHORT_URL_DEDUP=False)
+    def test_off_by_default_creates_a_row_each_time(self):
+        self.shorten('https://example.com/page')
+        self.shorten('https://example.com/page')
+        self.assertEqual(ShortURL.objects.count(), 2)
+
+    def test_bulk_path_reuses_existing_and_repeated_urls(self):
+        existing = self.make_url(code='old001', target='https://example.com/a')
+        created = create_short_urls([
+            ('https://example.com/a', False),
+            ('https://example.com/b', False),
+            ('https://example.com/b/', False),
+            ('https://example.com/b', False),
+        ], owner=self.user)
+        self.assertEqual(created[0], existing)
+        self.assertEqual(created[1], created[3])
+        self.assertNotEqual(created[1], created[2])
+        self.assertEqual(ShortURL.objects.count(), 3)
+
+    def test_hash_follows_target_url_updates(self):
+        url = self.make_url(target='https://example.com/a')
+        url.target_url = 'https://example.com/b'
+        url.save(update_fields=['target_url'])
+        url.refresh_from_db()
+        self.assertEqual(url.target_url_hash, hash_url('https://example.com/b'))
+
+
+class ValidationTests(TestCase):
+
+    def test_messages(self):
+        self.assertIsNone(check_target_url('https://example.com/path?q=1'))
+        self.assertEqual(check_target_url('ftp://example.com/file'), INVALID_SCHEME)
+        self.assertEqual(check_target_url('www.example.com'), INVALID_URL)
+        self.assertEqual(check_target_url('https://exa mple.com'), INVALID_URL)
+        self.assertEqual(check_target_url('https://example.com/' + 'a' * 2048), URL_TOO_LONG)
+
+    def test_validate_many_keeps_order_and_checks_duplicates_once(self):
+        values = ['https://a.example', 'nope', 'https://a.example', 'nope']
+        with mock.patch('apps.urlshortener.validation.url_validator') as validator:
+            validator.side_effect = [None, DjangoValidationError('bad')]
+            errors = validate_many(values)
+        self.assertEqual(errors, [None, INVALID_URL, None, INVALID_URL])
+        self.assertEqual(validator.call_count, 2)
+
+    def test_bulk_failures_use_the_same_messages(self):
+        user = User.objects.create_user(username='bulk', password='pass12345')
+        client = APIClient()
+        client.force_authenticate(user)
+        upload = SimpleUploadedFile('urls.txt', b'ftp://example.com\nhttps://ok.example\n')
+        response = client.post('/api/urls/bulk/', {'file': upload}, format='multipart')
+        self.assertEqual(
+            [result.get('error') for result in response.data['results']],
+            [INVALID_SCHEME, None],
+        )
+
+
+class BatchCreateTests(ShortenerTestCase):
+
+    def post(self, data):
+        self.client.force_authenticate(self.user)
+        return self.client.post('/api/urls/batch/', data, format='json')
+
+    def test_creates_valid_items_and_reports_failures_by_index(self):
+        response = self.post([
+            {'target_url': 'https://a.example'},
+            {'target_url': 'ftp://b.example'},
+            {'target_url': 'https://c.example', 'is_private': True},
+            'https://d.example',
+            {'target_url': 'https://e.example', 'is_private': 'maybe'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['success'], response.data['failed']), (2, 3))
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results],
+                         ['success', 'failed', 'success', 'failed', 'failed'])
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3, 4])
+        private = ShortURL.objects.get(short_code=results[2]['short_code'])
+        self.assertTrue(private.is_private)
+        self.assertEqual(private.owner, self.user)
+
+    def test_inserts_are_set_based(self):
+        items = [{'target_url': f'https://example.com/{n}'} for n in range(200)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(items)
+        self.assertEqual(response.data['success'], 200)
+        self.assertLess(len(queries), 15)
+
+    @override_settings(MAX_URLS_PER_BATCH=2)
+    def test_rejects_non_arrays_and_oversized_batches(self):
+        self.assertEqual(self.post({'target_url': 'https://a.example'}).status_code, 400)
+        self.assertEqual(self.post([]).status_code, 400)
+        response = self.post([{'target_url': 'https://a.example'}] * 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ShortURL.objects.exists())
+
+    def test_requires_authentication(self):
+        response = self.client.post(
+            '/api/urls/batch/', [{'target_url': 'https://a.example'}], format='json'
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class RedirectSnapshotTests(ShortenerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'redirects.snap')
+        settings_override = self.settings(
+            REDIRECT_SNAPSHOT_PATH=self.path, REDIRECT_SNAPSHOT_CHECK_INTERVAL=0
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        redirect_snapshot.reset()
+        self.addCleanup(redirect_snapshot.reset)
+
+    def test_public_codes_resolve_without_a_query(self):
+        url = self.make_url()
+        self.make_url(code='priv01', is_private=True)
+        self.make_url(code='ABC123', target='https://example.org')
+        self.assertEqual(build_snapshot(), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(redirect_snapshot.lookup('abc123'), (url.pk, 'https://example.com', False))
+            self.assertEqual(redirect_snapshot.lookup('ABC123')[1], 'https://example.org')
+            self.assertIsNone(redirect_snapshot.lookup('priv01'))
+            self.assertIsNone(redirect_snapshot.lookup('zzz999'))
+        with self.assertNumQueries(16):  # visit write only
+            self.assertEqual(self.client.get('/abc123/').status_code, 302)
+
+    @override_settings(REDIRECT_SNAPSHOT_DELTA_INTERVAL=5)
+    def test_codes_made_private_are_not_redirected_from_the_snapshot(self):
+        url = self.make_url()
+        build_snapshot()
+        shared = resolution_cache.shared
+        with mock.patch.object(shared, 'set', wraps=shared.set) as cache_set:
+            self.assertEqual(self.client.get('/abc123/').status_code, 302)
+        # Snapshot rows are cached until the next delta at most
+        self.assertEqual(cache_set.call_args.args[2], 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            url.is_private = True
+            url.save()
+        resolution_cache.local.clear()
+        self.assertEqual(self.client.get('/abc123/').status_code, 401)
+
+    @override_settings(REDIRECT_SNAPSHOT_DELTA_INTERVAL=5)
+    def test_snapshots_are_ignored_once_the_delta_is_overdue(self):
+        url = self.make_url()
+        build_snapshot()
+        # Another worker makes the code private; no delta has been built since
+        ShortURL.objects.filter(pk=url.pk).update(is_private=True)
+        self.assertIsNotNone(redirect_snapshot.lookup('abc123'))
+        later = time.time() + 5 + DELTA_GRACE + 1
+        with mock.patch('apps.urlshortener.snapshot.time.time', return_value=later):
+            self.assertIsNone(redirect_snapshot.lookup('abc123'))
+            self.assertEqual(self.client.get('/abc123/').status_code, 401)
+        self.assertEqual(redirect_snapshot.stats()['stale_skips'], 2)
+
+    def test_delta_covers_changes_since_the_base(self):
+        edited = self.make_url(code='edit01')
+        hidden = self.make_url(code='hide01')
+        deleted = self.make_url(code='gone01')
+        build_snapshot()
+        new = self.make_url(code='new001', target='https://example.com/new')
+        edited.target_url = 'https://example.com/edited'
+        edited.save()
+        hidden.is_private = True
+        hidden.save()
+        deleted.delete()
+        self.assertEqual(build_snapshot(delta=True), 4)
+        self.assertEqual(redirect_snapshot.lookup('new001'), (new.pk, 'https://example.com/new', False))
+        self.assertEqual(redirect_snapshot.lookup('edit01')[1], 'https://example.com/edited')
+        self.assertIsNone(redirect_snapshot.lookup('hide01'))
+        self.assertIsNone(redirect_snapshot.lookup('gone01'))
+        self.assertEqual(redirect_snapshot.stats()['delta_codes'], 4)
+
+    def test_full_build_replaces_the_delta(self):
+        url = self.make_url()
+        build_snapshot()
+        url.target_url = 'https://example.org'
+        url.save()
+        build_snapshot(delta=True)
+        self.assertEqual(redirect_snapshot.lookup('abc123')[1], 'https://example.org')
+        build_snapshot()
+        self.assertEqual(redirect_snapshot.lookup('abc123')[1], 'https://example.org')
+        self.assertEqual(redirect_snapshot.stats()['delta_codes'], 0)
+
+    def test_command(self):
+        self.make_url()
+        out = io.StringIO()
+        call_command('build_redirect_snapshot', stdout=out)
+        call_command('build_redirect_snapshot', '--delta', stdout=out)
+        self.assertIn('Wrote 1 records', out.getvalue())
+        self.assertTrue(os.path.exists(self.path + '.delta'))
+
+
+class EdgeRedirectTests(ShortenerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_map_holds_the_busiest_public_codes(self):
+        self.make_url(code='hot001', target='https://example.com/hot', views=50)
+        self.make_url(code='warm01', views=5)
+        self.make_url(code='priv01', views=500, is_private=True)
+        self.make_url(code='odd001', target='https://example.com/$1', views=100)
+        text, count = render_nginx_map(limit=3, ranking='views')
+        self.assertEqual(count, 2)
+        self.assertIn('    /hot001/ "https://example.com/hot";', text)
+        self.assertNotIn('priv01', text)
+        self.assertNotIn('odd001', text)
+        self.assertTrue(text.rstrip().endswith('}'))
+
+    def test_map_file_is_replaced(self):
+        path = os.path.join(self.directory, 'redirects.map')
+        self.make_url()
+        self.assertEqual(write_nginx_map(path, limit=10), 1)
+        with open(path) as f:
+            self.assertIn('/abc123/', f.read())
+        self.assertEqual(os.listdir(self.directory), ['redirects.map'])
+
+    def log_line(self, uri, status=302, time='2026-01-02T03:04:05+00:00'):
+        return json.dumps({
+            'time': time, 'ip': '203.0.113.9', 'uri': uri, 'status': status,
+            'referrer': 'https://news.example/', 'user_agent': 'Mozilla/5.0',
+        }) + '\n'
+
+    def test_import_records_visits_and_resumes(self):
+        url = self.make_url()
+        log = os.path.join(self.directory, 'edge.log')
+        with open(log, 'w') as f:
+            f.write(self.log_line('/abc123/'))
+            f.write('garbage\n')
+            f.write(self.log_line('/nope42/'))
+            f.write(self.log_line('/abc123/')[:20])  # partially written
+        self.assertEqual(import_edge_visits(log), (1, 1))
+        visit = URLVisit.objects.get()
+        self.assertEqual((visit.short_url, visit.ip_address), (url, '203.0.113.9'))
+        self.assertEqual(visit.accessed_at, datetime(2026, 1, 2, 3, 4, 5, tzinfo=dt_timezone.utc))
+        self.assertEqual(URLVisitDaily.objects.get().count, 1)
+        url.refresh_from_db()
+        self.assertEqual(url.views, 1)
+
+        with open(log, 'a') as f:
+            f.write(self.log_line('/abc123/')[20:])
+        self.assertEqual(import_edge_visits(log), (1, 0))
+        self.assertEqual(import_edge_visits(log), (0, 0))
+        self.assertEqual(URLVisit.objects.count(), 2)
+        url.refresh_from_db()
+        self.assertEqual(url.views, 2)
+
+
+class FakePGConnection:
+    """Just enough of a psycopg2 connection for ConnectionPool"""
+
+    def __init__(self):
+        self.closed = 0
+        self.info = mock.Mock(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+    def cursor(self):
+        return mock.MagicMock()
+
+
+class ConnectionPoolTests(TestCase):
+
+    def test_connections_are_reused(self):
+        pool = ConnectionPool(max_size=2)
+        first = pool.get(FakePGConnection)
+        pool.put(first)
+        self.assertIs(pool.get(FakePGConnection), first)
+        self.assertEqual(pool.stats()['created'], 1)
+
+    def test_open_transactions_are_rolled_back_and_broken_ones_dropped(self):
+        pool = ConnectionPool(max_size=2)
+        in_transaction = pool.get(FakePGConnection)
+        broken = pool.get(FakePGConnection)
+        in_transaction.info.transaction_status = extensions.TRANSACTION_STATUS_INERROR
+        broken.info.transaction_status = extensions.TRANSACTION_STATUS_UNKNOWN
+        pool.put(in_transaction)
+        pool.put(broken)
+        self.assertEqual(in_transaction.rollbacks, 1)
+        self.assertTrue(broken.closed)
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_waits_for_a_free_slot_then_gives_up(self):
+        pool = ConnectionPool(max_size=1, timeout=0.01)
+        pool.get(FakePGConnection)
+        with self.assertRaises(OperationalError):
+            pool.get(FakePGConnection)
+
+    def test_stale_and_closed_connections_are_replaced(self):
+        pool = ConnectionPool(max_size=2, max_idle=0)
+        stale = pool.get(FakePGConnection)
+        pool.put(stale)
+        self.assertIsNot(pool.get(FakePGConnection), stale)
+        self.assertTrue(stale.closed)
+
+
+REPLICA = 'replica'
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA], REDIRECT_CACHE_ENABLED=False)
+class ReplicaRoutingTests(ShortenerTestCase):
+    """A second SQLite database stands in for a replica that hasn't caught up"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.settings[REPLICA] = connections.configure_settings({
+            'default': connections.settings['default'],
+            REPLICA: {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(cls.replica_dir, 'replica.sqlite3'),
+            },
+        })[REPLICA]
+        call_command('migrate', database=REPLICA, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        shutil.rmtree(cls.replica_dir)
+        super().tearDownClass()
+
+    def tearDown(self):
+        ShortURL.objects.using(REPLICA).all().delete()
+
+    def replicate(self, url):
+        ShortURL.objects.using(REPLICA).create(
+            pk=url.pk, short_code=url.short_code, target_url=url.target_url
+        )
+
+    def test_router_reads_from_replica_only_inside_the_block(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(ShortURL), 'default')
+        with replica_reads():
+            self.assertEqual(router.db_for_read(ShortURL), REPLICA)
+            self.assertEqual(router.db_for_write(ShortURL), 'default')
+            # Reads after a write see it
+            self.assertEqual(router.db_for_read(ShortURL), 'default')
+        self.assertEqual(router.db_for_read(ShortURL), 'default')
+
+    def test_listing_reads_from_replica(self):
+        self.replicate(self.make_url())
+        self.make_url(code='late01')
+        response = self.client.get('/api/urls/')
+        self.assertEqual(
+            [row['short_code'] for row in response.data['results']], ['abc123']
+        )
+
+    def test_shortening_pins_client_to_primary(self):
+        self.replicate(self.make_url())
+        response = self.client.post(
+            '/api/urls/shorten/', {'target_url': 'https://example.org'}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.client.get('/api/urls/')
+        self.assertEqual(response.data['count'], 2)
+        # Other clients still read from the replica
+        response = self.client.get('/api/urls/', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.data['count'], 1)
+
+    def test_update_pins_owner_to_primary(self):
+        url = self.make_url()
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(f'/api/urls/{url.pk}/').status_code, 404)
+        response = self.client.patch(
+            f'/api/urls/{url.pk}/update/', {'target_url': 'https://example.org'}
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(f'/api/urls/{url.pk}/')
+        self.assertEqual(response.data['target_url'], 'https://example.org')
+
+    def test_redirect_falls_back_to_primary_for_codes_replica_lacks(self):
+        self.make_url()
+        self.assertEqual(self.client.get('/abc123/').status_code, 302)
+        self.assertEqual(self.client.get('/nope42/').status_code, 404)
+
+    @override_settings(REDIRECT_CACHE_ENABLED=True)
+    def test_edits_replace_cached_resolution(self):
+        url = self.make_url()
+        self.replicate(url)
+        self.assertEqual(self.client.get('/abc123/')['Location'], 'https://example.com')
+        with self.captureOnCommitCallbacks(execute=True):
+            url.target_url = 'https://example.org'
+            url.save()
+        # The replica still has the old target, the cache has the new one
+        self.assertEqual(self.client.get('/abc123/')['Location'], 'https://example.org')
+        with self.captureOnCommitCallbacks(execute=True):
+            url.delete()
+        self.assertEqual(self.client.get('/abc123/').status_code, 404)
+
+
+SHARD = 'shard2'
+
+
+@override_settings(DATABASE_SHARDS=['default', SHARD], REDIRECT_CACHE_ENABLED=False)
+class ShardingTests(ShortenerTestCase):
+    """A second SQLite database is the second shard"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.shard_dir = tempfile.mkdtemp()
+        connections.settings[SHARD] = connections.configure_settings({
+            'default': connections.settings['default'],
+            SHARD: {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(cls.shard_dir, 'shard.sqlite3'),
+            },
+        })[SHARD]
+        call_command('migrate', database=SHARD, verbosity=0)
+        cls.codes = {'default': [], SHARD: []}
+        for number in range(200):
+            code = f'code{number:02d}'
+            cls.codes[shard_for_code(code, ['default', SHARD])].append(code)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections[SHARD].close()
+        del connections[SHARD]
+        del connections.settings[SHARD]
+        shutil.rmtree(cls.shard_dir)
+        super().tearDownClass()
+
+    def tearDown(self):
+        URLVisit.objects.using(SHARD).all().delete()
+        URLVisitDaily.objects.using(SHARD).all().delete()
+        ShortURL.objects.using(SHARD).all().delete()
+
+    def test_ids_and_codes_agree_on_the_shard(self):
+        for alias, codes in self.codes.items():
+            self.assertTrue(codes)
+            url = self.make_url(code=codes[0])
+            self.assertEqual(url._state.db, alias)
+            self.assertEqual(url.pk % SHARD_BUCKETS, bucket_for_code(url.short_code))
+            self.assertEqual(shard_for_pk(url.pk), alias)
+        self.assertEqual(ShortURL.objects.using(SHARD).count(), 1)
+        self.assertEqual(ShortURL.objects.count(), 1)
+
+    def test_ids_come_from_reserved_blocks(self):
+        allocate_ids(['code00'])
+        with self.assertNumQueries(0):
+            ids = allocate_ids(self.codes['default'][:5] + self.codes[SHARD][:5])
+        self.assertEqual(
+            [pk % SHARD_BUCKETS for pk in ids],
+            [bucket_for_code(code) for code in self.codes['default'][:5] + self.codes[SHARD][:5]],
+        )
+
+    def test_redirect_and_visits_use_the_code_shard(self):
+        code = self.codes[SHARD][0]
+        self.make_url(code=code)
+        response = self.client.get(f'/{code}/')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(URLVisit.objects.using(SHARD).count(), 1)
+        self.assertEqual(URLVisit.objects.count(), 0)
+
+    def test_listing_merges_shards(self):
+        first = self.make_url(code=self.codes['default'][0])
+        second = self.make_url(code=self.codes[SHARD][0])
+        third = self.make_url(code=self.codes['default'][1])
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/urls/')
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(
+            [row['id'] for row in response.data['results']], [third.pk, second.pk, first.pk]
+        )
+
+    def test_detail_update_and_delete_find_the_shard(self):
+        url = self.make_url(code=self.codes[SHARD][0])
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(f'/api/urls/{url.pk}/').status_code, 200)
+        response = self.client.patch(
+            f'/api/urls/{url.pk}/update/', {'target_url': 'https://example.org'}
+        )
+        self.assertEqual(response.status_code, 200)
+        url = ShortURL.objects.using(SHARD).get()
+        self.assertEqual(url.target_url, 'https://example.org')
+        self.assertEqual(self.client.delete(f'/api/urls/{url.pk}/delete/').status_code, 204)
+        self.assertFalse(ShortURL.objects.using(SHARD).exists())
+
+    def test_deleting_a_user_deletes_their_urls_on_every_shard(self):
+        url = self.make_url(code=self.codes[SHARD][0])
+        visited = self.make_url(code=self.codes[SHARD][1], owner=None)
+        for short_url in (url, visited):
+            URLVisit.objects.using(SHARD).create(
+                short_url=short_url, user=self.user, ip_address='10.0.0.1'
+            )
+        self.make_url(code=self.codes['default'][0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertFalse(ShortURL.objects.exists())
+        self.assertEqual(ShortURL.objects.using(SHARD).get(), visited)
+        self.assertIsNone(URLVisit.objects.using(SHARD).get().user_id)
+
+    def test_visit_retention_runs_on_every_shard(self):
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+        old = timezone.now() - timedelta(days=400)
+        for alias, codes in self.codes.items():
+            URLVisit.objects.using(alias).create(
+                short_url=self.make_url(code=codes[0]), ip_address='10.0.0.1', accessed_at=old
+            )
+        out = io.StringIO()
+        call_command('archive_visits', retention_months=1, archive_dir=archive_dir, stdout=out)
+        self.assertIn('2 months archived', out.getvalue())
+        self.assertFalse(URLVisit.objects.exists())
+        self.assertFalse(URLVisit.objects.using(SHARD).exists())
+        name = f'urlshortener_urlvisit_p{old:%Y%m}.csv.gz'
+        self.assertTrue(os.path.exists(os.path.join(archive_dir, name)))
+        self.assertTrue(os.path.exists(os.path.join(archive_dir, SHARD, name)))
+
+    def test_codes_in_use_checks_every_shard(self):
+        taken = [self.codes['default'][0], self.codes[SHARD][0]]
+        for code in taken:
+            self.make_url(code=code)
+        free = [self.codes['default'][1], self.codes[SHARD][1]]
+        self.assertEqual(codes_in_use(taken + free), set(taken))
+
+    def test_reshard_copies_renumbers_and_cleans_up(self):
+        with override_settings(DATABASE_SHARDS=['default']):
+            moving = self.make_url(code=self.codes[SHARD][0])
+            staying = self.make_url(code=self.codes['default'][0])
+            URLVisit.objects.create(short_url=moving, ip_address='10.0.0.1')
+            out = io.StringIO()
+            call_command('reshard_urls', shards=f'default,{SHARD}', stdout=out)
+        self.assertIn('1 rows were copied to a new shard, 1 were renumbered', out.getvalue())
+
+        copy = ShortURL.objects.using(SHARD).get()
+        self.assertEqual(copy.short_code, moving.short_code)
+        self.assertEqual(copy.created_at, moving.created_at)
+        self.assertEqual(shard_for_pk(copy.pk), SHARD)
+        self.assertEqual(URLVisit.objects.using(SHARD).get().short_url_id, copy.pk)
+        staying = ShortURL.objects.get(short_code=staying.short_code)
+        self.assertEqual(shard_for_pk(staying.pk), 'default')
+
+        # Running it again refreshes the copy instead of adding another
+        call_command('reshard_urls', shards=f'default,{SHARD}', stdout=io.StringIO())
+        self.assertEqual(ShortURL.objects.using(SHARD).count(), 1)
+        self.assertEqual(URLVisit.objects.using(SHARD).count(), 1)
+
+        out = io.StringIO()
+        call_command('reshard_urls', cleanup=True, stdout=out)
+        self.assertIn('1 stray rows were deleted', out.getvalue())
+        self.assertEqual(
+            list(ShortURL.objects.values_list('short_code', flat=True)), [staying.short_code]
+        )
+        self.assertEqual(self.client.get(f'/{moving.short_code}/').status_code, 302)
@@ -0,0 +1,262 @@
+"""
+Asynchronous, batched visit tracking.
+
+RedirectView hands every visit to ``visit_pipeline.record()``, which puts it
+on a bounded in-process queue and returns immediately. A daemon worker drains
+the queue and writes visits with ``bulk_create`` whenever a batch fills up or
+the flush interval elapses; whatever is still queued is written on shutdown.
+
+What happens when the queue is full is controlled by
+``settings.VISIT_QUEUE_FULL_POLICY``:
+
+- ``drop``: discard the visit (counted in ``stats()['dropped']``)
+- ``block``: wait up to ``VISIT_QUEUE_BLOCK_TIMEOUT`` seconds, then drop
+- ``inline``: write the visit synchronously in the request thread
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter, namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .analytics import update_rollups
+from .counters import view_counter
+from .models import ShortURL, URLVisit
+from .sharding import group_by_shard, on_shard, shard_for_pk
+
+logger = logging.getLogger(__name__)
+
+VisitEvent = namedtuple(
+    'VisitEvent',
+    ['short_url_id', 'user_id', 'ip_address', 'user_agent', 'accessed_at', 'referrer'],
+    defaults=[''],
+)
+
+_STOP = object()
+
+
+def build_visit_event(request, short_url_id):
+    """Capture everything needed to record a visit from the current request"""
+    user = getattr(request, 'user', None)
+    return visit_event_from_meta(
+        request.META,
+        short_url_id,
+        user_id=user.pk if user is not None and user.is_authenticated else None,
+    )
+
+
+def client_ip(meta):
+    """Client IP address from a WSGI environ or request.META"""
+    x_forwarded_for = meta.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0]
+    return meta.get('REMOTE_ADDR')
+
+
+def visit_event_from_meta(meta, short_url_id, user_id=None):
+    """Same as build_visit_event(), from a WSGI environ or request.META"""
+    return VisitEvent(
+        short_url_id=short_url_id,
+        user_id=user_id,
+        ip_address=client_ip(meta),
+        user_agent=meta.get('HTTP_USER_AGENT', '')[:500],
+        accessed_at=timezone.now(),
+        referrer=meta.get('HTTP_REFERER', '')[:500],
+    )
+
+
+def write_visits(events):
+    """
+    Persist a batch of visit events, its rollups and its view counts.
+    Visits to short URLs deleted since they were queued are skipped; returns
+    the number of visits written.
+    """
+    written = []
+    by_shard = group_by_shard(events, lambda event: shard_for_pk(event.short_url_id))
+    for alias, shard_events in by_shard.items():
+        with on_shard(alias), transaction.atomic(using=alias):
+            existing = set(
+                ShortURL.objects
+                .filter(pk__in={event.short_url_id for event in shard_events})
+                .values_list('pk', flat=True)
+            )
+            shard_events = [event for event in shard_events if event.short_url_id in existing]
+            update_rollups(shard_events)
+            URLVisit.objects.bulk_create(
+                [
+                    URLVisit(
+                        short_url_id=event.short_url_id,
+                        user_id=event.user_id,
+                        ip_address=event.ip_address,
+                        user_agent=event.user_agent,
+                        accessed_at=event.accessed_at,
+                        referrer=event.referrer,
+                    )
+                    for event in shard_events
+                ],
+                batch_size=settings.VISIT_BATCH_SIZE,
+            )
+        written += shard_events
+    for short_url_id, count in Counter(event.short_url_id for event in written).items():
+        view_counter.add(short_url_id, count)
+    return len(written)
+
+
+class VisitPipeline:
+    """Bounded queue of visit events flushed in batches by a worker thread"""
+
+    def __init__(self, autostart=True):
+        self.autostart = autostart
+        self._queue = queue.Queue(maxsize=settings.VISIT_QUEUE_MAX_SIZE)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._counters = Counter()
+
+    def stats(self):
+        data = {
+            name: self._counters[name]
+            for name in (
+                'enqueued', 'written', 'dropped', 'inline', 'failed', 'orphaned', 'flushes',
+            )
+        }
+        data['queued'] = self._queue.qsize()
+        data['worker_alive'] = bool(self._thread and self._thread.is_alive())
+        return data
+
+    def record(self, event):
+        """Queue a visit; never waits on the database unless policy says so"""
+        if not settings.VISIT_TRACKING_ASYNC:
+            self._write([event])
+            view_counter.flush()
+            return
+
+        if self.autostart:
+            self.start()
+
+        try:
+            self._queue.put_nowait(event)
+            self._counters['enqueued'] += 1
+            return
+        except queue.Full:
+            pass
+
+        policy = settings.VISIT_QUEUE_FULL_POLICY
+        if policy == 'block':
+            try:
+                self._queue.put(event, timeout=settings.VISIT_QUEUE_BLOCK_TIMEOUT)
+                self._counters['enqueued'] += 1
+                return
+            except queue.Full:
+                pass
+        elif policy == 'inline':
+            self._counters['inline'] += 1
+            self._write([event])
+            return
+        self._counters['dropped'] += 1
+
+    async def arecord(self, event):
+        """record() for async views"""
+        if settings.VISIT_TRACKING_ASYNC and settings.VISIT_QUEUE_FULL_POLICY == 'drop':
+            # Only ever a non-blocking put, fine on the event loop
+            self.record(event)
+        else:
+            await sync_to_async(self.record)(event)
+
+    def start(self):
+        """Start the worker thread (again, after a fork) if it isn't running"""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Queued events belong to the parent process
+                self._queue = queue.Queue(maxsize=settings.VISIT_QUEUE_MAX_SIZE)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name='visit-pipeline', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        batch_size = settings.VISIT_BATCH_SIZE
+        interval = settings.VISIT_FLUSH_INTERVAL
+        batch = []
+        deadline = time.monotonic() + interval
+        while True:
+            timeout = max(deadline - time.monotonic(), 0)
+            try:
+                event = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                event = None
+
+            if event is _STOP:
+                self._flush(batch)
+                view_counter.flush()
+                return
+            if event is not None:
+                batch.append(event)
+
+            if len(batch) >= batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + interval
+                view_counter.maybe_flush()
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        close_old_connections()
+        self._write(batch)
+        close_old_connections()
+
+    def _write(self, batch):
+        try:
+            written = write_visits(batch)
+        except Exception:
+            self._counters['failed'] += len(batch)
+            logger.exception('Failed to write %d visit(s)', len(batch))
+        else:
+            self._counters['written'] += written
+            self._counters['orphaned'] += len(batch) - written
+            self._counters['flushes'] += 1
+
+    def flush(self):
+        """Write everything currently queued from the calling thread"""
+        batch = []
+        while True:
+            try:
+                event = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if event is not _STOP:
+                batch.append(event)
+        for start in range(0, len(batch), settings.VISIT_BATCH_SIZE):
+            self._write(batch[start:start + settings.VISIT_BATCH_SIZE])
+        view_counter.flush()
+
+    def shutdown(self, timeout=None):
+        """Stop the worker after it drains the queue"""
+        if timeout is None:
+            timeout = settings.VISIT_SHUTDOWN_TIMEOUT
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            thread.join(timeout)
+        self._thread = None
+        self.flush()
+
+
+visit_pipeline = VisitPipeline()
+atexit.register(visit_pipeline.shutdown)
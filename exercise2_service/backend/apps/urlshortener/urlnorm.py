@@ -0,0 +1,76 @@
+"""
+Canonical form of target URLs, for finding duplicates.
+
+``normalize_url()`` applies the semantics-preserving normalizations of
+RFC 3986 section 6.2.2: lowercase scheme and host (IDNA-encoded), no default
+port, percent-escapes in upper case with unreserved characters decoded, dot
+segments removed and an empty path written as ``/``. Query strings keep their
+parameter order and fragments are kept, since either may change what the
+target page shows.
+
+``hash_url()`` is the fixed-size digest stored in
+``ShortURL.target_url_hash``, which is indexed where the 2048-character
+``target_url`` can't be.
+"""
+import hashlib
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+UNRESERVED = frozenset(
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~'
+)
+PERCENT_ESCAPE = re.compile(r'%([0-9A-Fa-f]{2})')
+
+
+def _normalize_escape(match):
+    char = chr(int(match.group(1), 16))
+    if char in UNRESERVED:
+        return char
+    return '%' + match.group(1).upper()
+
+
+def _remove_dot_segments(path):
+    output = []
+    for segment in path.split('/'):
+        if segment == '..':
+            if len(output) > 1:
+                output.pop()
+        elif segment != '.':
+            output.append(segment)
+    if path.endswith(('/.', '/..')):
+        output.append('')
+    return '/'.join(output)
+
+
+def _normalize_host(parts):
+    host = parts.hostname or ''
+    try:
+        host = host.encode('idna').decode('ascii')
+    except UnicodeError:
+        pass
+    if ':' in host:
+        host = f'[{host}]'
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host = f'{host}:{port}'
+    userinfo, at, _ = parts.netloc.rpartition('@')
+    return f'{userinfo}{at}{host}'
+
+
+def normalize_url(url):
+    """Canonical form of an absolute URL"""
+    parts = urlsplit(url.strip())
+    path = PERCENT_ESCAPE.sub(_normalize_escape, _remove_dot_segments(parts.path)) or '/'
+    query = PERCENT_ESCAPE.sub(_normalize_escape, parts.query)
+    return urlunsplit(
+        (parts.scheme.lower(), _normalize_host(parts), path, query, parts.fragment)
+    )
+
+
+def hash_url(url):
+    """Hex digest of the normalized URL (32 characters)"""
+    return hashlib.blake2b(normalize_url(url).encode(), digest_size=16).hexdigest()
@@ -1,20 +1,34 @@
+from django.conf import settings
 from django.urls import path
+from .async_views import AsyncShortenURLView
 from .views import (
     ShortenURLView,
     URLListView,
     URLDetailView,
     URLUpdateView,
     URLDeleteView,
+    URLStatsView,
     BulkUploadView,
+    BatchCreateView,
+    CacheStatsView,
+    BulkUploadJobView,
+    BulkUploadJobResultsView,
 )
 
+shorten_view = AsyncShortenURLView if settings.ASYNC_VIEWS else ShortenURLView
+
 app_name = 'urlshortener'
 
 urlpatterns = [
-    path('shorten/', ShortenURLView.as_view(), name='shorten'),
+    path('shorten/', shorten_view.as_view(), name='shorten'),
     path('bulk/', BulkUploadView.as_view(), name='bulk-upload'),
+    path('batch/', BatchCreateView.as_view(), name='batch-create'),
+    path('bulk/jobs/<uuid:pk>/', BulkUploadJobView.as_view(), name='bulk-job'),
+    path('bulk/jobs/<uuid:pk>/results/', BulkUploadJobResultsView.as_view(), name='bulk-job-results'),
+    path('cache/stats/', CacheStatsView.as_view(), name='cache-stats'),
     path('', URLListView.as_view(), name='list'),
     path('<int:pk>/', URLDetailView.as_view(), name='detail'),
     path('<int:pk>/update/', URLUpdateView.as_view(), name='update'),
     path('<int:pk>/delete/', URLDeleteView.as_view(), name='delete'),
+    path('<int:pk>/stats/', URLStatsView.as_view(), name='stats'),
 ]
@@ -1,24 +1,36 @@
+import csv
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import status, generics, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.db.models import F
-from .models import ShortURL, URLVisit
+from .analytics import bucket_window, visit_stats
+from .cache import resolution_cache
+from .jobs import submit_job
+from .tracking import build_visit_event, client_ip, visit_pipeline
+from .models import BulkUploadJob, ShortURL
+from .pagination import KeysetPagination
+from .replicas import ReplicaRoutingMixin
+from .sharding import across_shards, is_sharded, on_shard, on_shard_of_pk, shard_for_pk
 from .serializers import (
+    BulkUploadJobSerializer,
+    BulkUploadResultSerializer,
     ShortURLCreateSerializer,
     ShortURLSerializer,
     ShortURLUpdateSerializer,
+    URLStatsQuerySerializer,
 )
 
 
 def get_client_ip(request):
     """Extract client IP address from request"""
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
+    return client_ip(request.META)
 
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
@@ -30,7 +42,7 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         return obj.owner == request.user
 
 
-class ShortenURLView(generics.CreateAPIView):
+class ShortenURLView(ReplicaRoutingMixin, generics.CreateAPIView):
     """Create shortened URL"""
     serializer_class = ShortURLCreateSerializer
     permission_classes = [permissions.AllowAny]
@@ -42,49 +54,126 @@ class ShortenURLView(generics.CreateAPIView):
             serializer.save()
 
 
-class URLListView(generics.ListAPIView):
-    """List URLs with pagination"""
+def with_list_annotations(queryset):
+    """Everything ShortURLSerializer needs, without per-row queries"""
+    if is_sharded():
+        # Owners are on the default database, not on the URL's shard
+        return queryset.prefetch_related('owner')
+    return queryset.select_related('owner')
+
+
+class ShardedObjectMixin:
+    """Look the ``pk`` URL kwarg up on the shard its id points to"""
+
+    def get_queryset(self):
+        return on_shard_of_pk(ShortURL.objects.all(), self.kwargs['pk'])
+
+
+class URLListView(ReplicaRoutingMixin, generics.ListAPIView):
+    """
+    List URLs with pagination.
+    
+    Pass ?pagination=cursor (or a ?cursor=) for keyset pagination, which
+    skips the COUNT query and stays fast however deep you page.
+    """
     serializer_class = ShortURLSerializer
     permission_classes = [permissions.AllowAny]
     
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = KeysetPagination()
+        return super().paginator
+    
     def get_queryset(self):
         user = self.request.user
         if user.is_authenticated:
             # Authenticated users see their own URLs (public + private)
             if user.is_staff:
-                return ShortURL.objects.all().order_by('-created_at')
-            return ShortURL.objects.filter(owner=user).order_by('-created_at')
+                queryset = ShortURL.objects.all()
+            else:
+                queryset = ShortURL.objects.filter(owner=user)
         else:
             # Unauthenticated users see ALL public URLs
-            return ShortURL.objects.filter(is_private=False).order_by('-created_at')
+            queryset = ShortURL.objects.filter(is_private=False)
+        return across_shards(with_list_annotations(queryset), '-created_at', '-id')
 
 
-class URLDetailView(generics.RetrieveAPIView):
+class URLDetailView(ReplicaRoutingMixin, ShardedObjectMixin, generics.RetrieveAPIView):
     """Get single URL details"""
     serializer_class = ShortURLSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    queryset = ShortURL.objects.all()
+    
+    def get_queryset(self):
+        return with_list_annotations(super().get_queryset())
 
 
-class URLUpdateView(generics.UpdateAPIView):
+class URLUpdateView(ReplicaRoutingMixin, ShardedObjectMixin, generics.UpdateAPIView):
     """Update URL (owner only)"""
     serializer_class = ShortURLUpdateSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
-    queryset = ShortURL.objects.all()
 
 
-class URLDeleteView(generics.DestroyAPIView):
+class URLDeleteView(ReplicaRoutingMixin, ShardedObjectMixin, generics.DestroyAPIView):
     """Delete URL (owner only)"""
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
-    queryset = ShortURL.objects.all()
 
 
-class RedirectView(APIView):
+class URLStatsView(APIView):
+    """
+    Visit statistics of one URL (owner or staff only).
+    
+    ?bucket=hour|day|week&count=N&top=N. Served from the rollup tables; the
+    ETag changes whenever new visits are rolled up, so dashboards can poll
+    with If-None-Match and mostly get 304s.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request, pk):
+        queryset = on_shard_of_pk(ShortURL.objects.all(), pk)
+        if not request.user.is_staff:
+            queryset = queryset.filter(owner=request.user)
+        short_url = get_object_or_404(
+            queryset.only('pk', 'short_code', 'views', 'last_visited_at'), pk=pk
+        )
+        params = URLStatsQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        bucket, count, top = (
+            params.validated_data[name] for name in ('bucket', 'count', 'top')
+        )
+        
+        now = timezone.now()
+        _, end = bucket_window(bucket, count, now)
+        version = (
+            f'{short_url.pk}:{short_url.views}:{short_url.last_visited_at}:'
+            f'{bucket}:{count}:{top}:{end.isoformat()}'
+        )
+        digest = hashlib.md5(version.encode()).hexdigest()
+        etag = quote_etag(digest)
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        
+        cache = caches[settings.STATS_CACHE_ALIAS]
+        cache_key = f'shorturl:stats:{digest}'
+        data = cache.get(cache_key)
+        if data is None:
+            with on_shard(shard_for_pk(pk)):
+                data = visit_stats(short_url, bucket, count, top, now)
+            cache.set(cache_key, data, settings.STATS_CACHE_TTL)
+        return Response(data, headers=headers)
+
+
+class RedirectView(ReplicaRoutingMixin, APIView):
     """Redirect short URL to target with analytics tracking"""
     permission_classes = [permissions.AllowAny]
     
     def get(self, request, short_code):
-        short_url = get_object_or_404(ShortURL, short_code=short_code)
+        short_url = resolution_cache.resolve(short_code)
+        if short_url is None:
+            raise Http404
         
         # Check if private URL requires authentication
         if short_url.is_private and not request.user.is_authenticated:
@@ -93,22 +182,22 @@ class RedirectView(APIView):
                 status=status.HTTP_401_UNAUTHORIZED
             )
         
-        # Track visit
-        URLVisit.objects.create(
-            short_url=short_url,
-            user=request.user if request.user.is_authenticated else None,
-            ip_address=get_client_ip(request),
-            user_agent=request.META.get('HTTP_USER_AGENT', '')[:500]
-        )
-        
-        # Increment view count
-        short_url.increment_views()
+        # Track visit and view count in the background
+        visit_pipeline.record(build_visit_event(request, short_url.pk))
         
         return redirect(short_url.target_url)
 
 
-class BulkUploadView(APIView):
-    """Bulk URL upload from .txt file"""
+class CacheStatsView(APIView):
+    """Redirect resolution cache counters (staff only)"""
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        return Response(resolution_cache.stats())
+
+
+class BulkUploadView(ReplicaRoutingMixin, APIView):
+    """Bulk URL upload from .txt file (pass async=true to run it as a job)"""
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     throttle_scope = 'bulk_upload'
     
@@ -121,6 +210,17 @@ class BulkUploadView(APIView):
         )
         serializer.is_valid(raise_exception=True)
         
+        if self.is_async(request):
+            job = BulkUploadJob.objects.create(
+                owner=request.user,
+                file=serializer.validated_data['file'],
+            )
+            submit_job(job)
+            return Response(
+                BulkUploadJobSerializer(job, context={'request': request}).data,
+                status=status.HTTP_202_ACCEPTED
+            )
+        
         # Process the file
         results = serializer.process_file(
             serializer.validated_data['file'],
@@ -128,3 +228,82 @@ class BulkUploadView(APIView):
         )
         
         return Response(results, status=status.HTTP_200_OK)
+    
+    @staticmethod
+    def is_async(request):
+        value = request.query_params.get('async', request.data.get('async', ''))
+        return str(value).lower() in ('1', 'true', 'yes')
+
+
+class BatchCreateView(ReplicaRoutingMixin, APIView):
+    """Create many URLs from a JSON array of {target_url, is_private} objects"""
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'bulk_upload'
+    
+    def post(self, request):
+        from .serializers import BatchURLSerializer
+        
+        if not isinstance(request.data, list):
+            return Response(
+                {'detail': 'Expected a JSON array of {"target_url", "is_private"} objects.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = BatchURLSerializer(
+            data={'urls': request.data},
+            context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.create_urls(user=request.user), status=status.HTTP_200_OK)
+
+
+class BulkUploadJobView(generics.RetrieveAPIView):
+    """Status and progress of a background bulk upload (owner only)"""
+    serializer_class = BulkUploadJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        return BulkUploadJob.objects.filter(owner=self.request.user)
+
+
+class _Echo:
+    """File-like object whose write() hands the row back to csv.writer's caller"""
+    
+    def write(self, value):
+        return value
+
+
+class BulkUploadJobResultsView(generics.ListAPIView):
+    """Paged per-line results of a bulk upload job; ?download=csv for all of them"""
+    serializer_class = BulkUploadResultSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        job = get_object_or_404(
+            BulkUploadJob, pk=self.kwargs['pk'], owner=self.request.user
+        )
+        return job.results.order_by('line_number')
+    
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('download') != 'csv':
+            return super().list(request, *args, **kwargs)
+        
+        queryset = self.get_queryset()
+        base_url = settings.BASE_URL.rstrip('/')
+        writer = csv.writer(_Echo())
+        
+        def rows():
+            yield writer.writerow(['line_number', 'original_url', 'short_url', 'status', 'error'])
+            for result in queryset.iterator(chunk_size=1000):
+                yield writer.writerow([
+                    result.line_number,
+                    result.original_url,
+                    f'{base_url}/{result.short_code}' if result.short_code else '',
+                    result.status,
+                    result.error,
+                ])
+        
+        response = StreamingHttpResponse(rows(), content_type='text/csv')
+        response['Content-Disposition'] = (
+            f'attachment; filename="bulk-upload-{self.kwargs["pk"]}.csv"'
+        )
+        return response
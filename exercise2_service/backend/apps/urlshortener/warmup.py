@@ -0,0 +1,156 @@
+"""
+Preload the most visited short URLs into the resolution cache.
+
+After a deploy or restart every worker starts with an empty local tier (and,
+with the default in-process cache, an empty shared tier), so the first
+minutes of traffic all reach the database. ``warm_resolution_cache()`` ranks
+URLs by their visits in the last few days of daily rollups (then by all-time
+``views``) and loads the top ones into both tiers a chunk at a time, stopping
+at a row budget or a time limit, whichever comes first. On PostgreSQL the
+ranking queries are cancelled once the time limit is up, too.
+
+``warm_up_in_background()`` runs it in a daemon thread when a worker loads
+project/wsgi.py or project/asgi.py (starting the short code filter build
+first), so warming never delays readiness. The ``warm_redirect_cache``
+command runs it on demand, e.g. as a deploy step when the shared tier is
+Redis.
+"""
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import zip_longest
+
+from django.conf import settings
+from django.db import close_old_connections, connections, router, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .bloom import code_filter
+from .cache import resolution_cache
+from .models import ShortURL, URLVisitDaily
+from .sharding import group_by_shard, on_shard, shard_for_pk, shards
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+RANKINGS = ('recent', 'views')
+
+
+@contextmanager
+def _statement_timeout(seconds):
+    """Cancel the block's queries after ``seconds`` (PostgreSQL only)"""
+    alias = router.db_for_read(URLVisitDaily)
+    if seconds is None or connections[alias].vendor != 'postgresql':
+        yield
+        return
+    with transaction.atomic(using=alias):
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SET LOCAL statement_timeout = %s', [max(1, round(seconds * 1000))])
+        yield
+
+
+def ranked_ids(limit, ranking='recent', days=7, queryset=None, timeout=None):
+    """
+    Primary keys of the ``limit`` most visited short URLs, busiest first:
+    by visits in the last ``days`` days of daily rollups ('recent'), then by
+    all-time views. Queries are cancelled after ``timeout`` seconds.
+    """
+    if ranking not in RANKINGS:
+        raise ValueError(f'Unknown ranking {ranking!r}; expected one of {RANKINGS}')
+    urls = ShortURL.objects.all() if queryset is None else queryset
+    ids = []
+    with _statement_timeout(timeout):
+        if ranking == 'recent':
+            since = timezone.now().date() - timedelta(days=days)
+            recent = URLVisitDaily.objects.filter(date__gte=since)
+            if queryset is not None:
+                recent = recent.filter(short_url__in=queryset)
+            ids = list(
+                recent
+                .values('short_url_id')
+                .annotate(visits=Sum('count'))
+                .order_by('-visits', '-short_url_id')
+                .values_list('short_url_id', flat=True)[:limit]
+            )
+        if len(ids) < limit:
+            seen = set(ids)
+            by_views = urls.order_by('-views', '-pk').values_list('pk', flat=True)[:limit]
+            ids += [pk for pk in by_views if pk not in seen][:limit - len(ids)]
+    return ids
+
+
+def ranked_ids_across_shards(limit, ranking='recent', days=7, queryset=None, timeout=None):
+    """
+    ranked_ids() over every shard: the top ``limit / shards`` of each,
+    interleaved by rank. Codes spread traffic evenly over the shards, so
+    this is close to the global top ``limit``.
+    """
+    aliases = shards()
+    per_shard = math.ceil(limit / len(aliases))
+    ranked = []
+    for alias in aliases:
+        with on_shard(alias):
+            ranked.append(ranked_ids(per_shard, ranking, days, queryset, timeout))
+    return [pk for rank in zip_longest(*ranked) for pk in rank if pk is not None][:limit]
+
+
+def warm_resolution_cache(limit=None, time_limit=None, ranking=None, days=None):
+    """
+    Load the top ``limit`` URLs into the resolution cache, giving up after
+    ``time_limit`` seconds. Returns (URLs loaded, whether all were loaded).
+    """
+    limit = settings.REDIRECT_CACHE_WARMUP_LIMIT if limit is None else limit
+    time_limit = settings.REDIRECT_CACHE_WARMUP_TIME_LIMIT if time_limit is None else time_limit
+    ranking = ranking or settings.REDIRECT_CACHE_WARMUP_RANKING
+    days = settings.REDIRECT_CACHE_WARMUP_DAYS if days is None else days
+    if not settings.REDIRECT_CACHE_ENABLED or limit <= 0:
+        return 0, True
+
+    if time_limit <= 0:
+        return 0, False
+    deadline = time.monotonic() + time_limit
+    # Ranking each shard may take up to the whole time limit
+    ids = ranked_ids_across_shards(limit, ranking, days, timeout=time_limit)
+    loaded = 0
+    for start in range(0, len(ids), CHUNK_SIZE):
+        if time.monotonic() >= deadline:
+            return loaded, False
+        chunk = ids[start:start + CHUNK_SIZE]
+        for alias, pks in group_by_shard(chunk, shard_for_pk).items():
+            with on_shard(alias):
+                rows = list(
+                    ShortURL.objects
+                    .filter(pk__in=pks)
+                    .values_list('short_code', 'pk', 'target_url', 'is_private')
+                )
+            resolution_cache.prime_many(rows)
+            loaded += len(rows)
+    return loaded, True
+
+
+def _warm_up():
+    try:
+        if settings.SHORT_CODE_FILTER_ENABLED:
+            code_filter.start()
+        started = time.monotonic()
+        loaded, complete = warm_resolution_cache()
+        logger.info(
+            'Warmed the redirect cache with %d URLs in %.2fs%s', loaded,
+            time.monotonic() - started, '' if complete else ' (time limit reached)',
+        )
+    except Exception:
+        logger.exception('Redirect cache warm-up failed')
+    finally:
+        close_old_connections()
+
+
+def warm_up_in_background():
+    """Warm the caches without blocking worker startup (if enabled)"""
+    if not settings.REDIRECT_CACHE_WARMUP:
+        return None
+    thread = threading.Thread(target=_warm_up, name='redirect-cache-warmup', daemon=True)
+    thread.start()
+    return thread
@@ -9,8 +9,23 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+# Serve redirects and shortening with the async views under ASGI
+os.environ.setdefault('ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
+
+# Load hot short codes before traffic arrives, without delaying startup
+if settings.REDIRECT_CACHE_WARMUP:
+    from apps.urlshortener.warmup import warm_up_in_background
+
+    warm_up_in_background()
+
+# Pick up bulk upload jobs that a restart left unfinished
+if settings.BULK_UPLOAD_WORKERS > 0:
+    from apps.urlshortener.jobs import recover_in_background
+
+    recover_in_background()
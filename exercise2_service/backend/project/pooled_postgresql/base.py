@@ -0,0 +1,149 @@
+"""
+PostgreSQL backend that hands connections back to a per-process pool.
+
+Select it with ``DB_POOL=True`` (see settings.py). ``CONN_MAX_AGE`` is 0 in
+that mode: Django "closes" the connection at the end of every request, which
+here returns it to the pool instead, and the next request anywhere in the
+process checks it out again without a new TCP/TLS/auth handshake. Idle
+connections beyond ``MAX_IDLE`` seconds are dropped; when all ``MAX_SIZE``
+connections are busy a request waits up to ``TIMEOUT`` seconds for one.
+With ``CONN_HEALTH_CHECKS`` each checkout runs ``SELECT 1`` first, like
+Django's own health checks for persistent connections.
+
+Django 5.1 has native pooling for psycopg 3; this covers Django 4.2 with
+psycopg2.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """Thread-safe pool of raw psycopg2 connections to one database"""
+
+    def __init__(self, max_size=10, timeout=5.0, max_idle=300.0, health_checks=False):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.health_checks = health_checks
+        self._idle = deque()  # (connection, returned at)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self.created = 0
+
+    def get(self, connect):
+        """Check out an idle connection, or open one with ``connect()``"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise OperationalError(
+                f'No database connection available within {self.timeout}s '
+                f'(pool of {self.max_size})'
+            )
+        try:
+            while True:
+                with self._lock:
+                    connection, returned_at = self._idle.pop() if self._idle else (None, 0)
+                if connection is None:
+                    self.created += 1
+                    return connect()
+                if time.monotonic() - returned_at > self.max_idle or not self._usable(connection):
+                    self._discard(connection)
+                    continue
+                return connection
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def put(self, connection):
+        """Return a checked-out connection, rolling back anything left open"""
+        try:
+            status = connection.info.transaction_status if not connection.closed else None
+            if status == extensions.TRANSACTION_STATUS_IDLE:
+                pass
+            elif status in (extensions.TRANSACTION_STATUS_INTRANS,
+                            extensions.TRANSACTION_STATUS_INERROR):
+                connection.rollback()
+            else:
+                self._discard(connection)
+                return
+            with self._lock:
+                self._idle.append((connection, time.monotonic()))
+        except base.Database.Error:
+            self._discard(connection)
+        finally:
+            self._slots.release()
+
+    def _usable(self, connection):
+        if connection.closed:
+            return False
+        if not self.health_checks:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except base.Database.Error:
+            return False
+        return True
+
+    @staticmethod
+    def _discard(connection):
+        try:
+            connection.close()
+        except base.Database.Error:
+            pass
+
+    def stats(self):
+        with self._lock:
+            idle = len(self._idle)
+        return {'max_size': self.max_size, 'idle': idle, 'created': self.created}
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for connection, _ in idle:
+            self._discard(connection)
+
+
+def get_pool(alias, settings_dict):
+    """The current process's pool for a database alias"""
+    key = (alias, os.getpid())
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                options = settings_dict.get('POOL', {})
+                pool = _pools[key] = ConnectionPool(
+                    max_size=options.get('MAX_SIZE', 10),
+                    timeout=options.get('TIMEOUT', 5.0),
+                    max_idle=options.get('MAX_IDLE', 300.0),
+                    health_checks=settings_dict.get('CONN_HEALTH_CHECKS', False),
+                )
+    return pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict)
+
+    def get_new_connection(self, conn_params):
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        if isolation_level is None:
+            self.isolation_level = base.IsolationLevel.READ_COMMITTED
+        else:
+            self.isolation_level = base.IsolationLevel(isolation_level)
+        return self.pool.get(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.put(self.connection)
@@ -74,17 +74,64 @@ WSGI_APPLICATION = 'project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Connections are kept open between requests for DB_CONN_MAX_AGE seconds
+# (0 closes them after every request), checked with a
+# SELECT 1 before reuse when DB_CONN_HEALTH_CHECKS is on. DB_POOL=True
+# switches to project/pooled_postgresql, which returns connections to a
+# per-process pool of up to DB_POOL_MAX_SIZE at the end of each request.
+DB_POOL = env.bool('DB_POOL', default=False)
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'project.pooled_postgresql' if DB_POOL else 'django.db.backends.postgresql',
         'NAME': env('DB_NAME'),
         'USER': env('DB_USER'),
         'PASSWORD': env('DB_PASSWORD'),
         'HOST': env('DB_HOST'),
         'PORT': env('DB_PORT'),
+        'CONN_MAX_AGE': 0 if DB_POOL else env.int('DB_CONN_MAX_AGE', default=60),
+        'CONN_HEALTH_CHECKS': env.bool('DB_CONN_HEALTH_CHECKS', default=True),
+        'POOL': {
+            'MAX_SIZE': env.int('DB_POOL_MAX_SIZE', default=10),
+            'TIMEOUT': env.float('DB_POOL_TIMEOUT', default=5.0),
+            'MAX_IDLE': env.float('DB_POOL_MAX_IDLE', default=300.0),
+        },
     }
 }
 
+# Read replicas (optional): hosts streaming from the primary, with the same
+# database name and credentials. GET requests to the redirect, list and
+# detail views read from them (see apps/urlshortener/replicas.py); a client
+# reads from the primary for DB_REPLICA_PIN_SECONDS after changing a URL,
+# so keep it above the usual replication lag.
+DATABASE_REPLICAS = []
+for index, host in enumerate(env.list('DB_REPLICA_HOSTS', default=[]), 1):
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{index}')
+
+DB_REPLICA_PIN_SECONDS = env.int('DB_REPLICA_PIN_SECONDS', default=5)
+
+# Shards (optional): hosts of further databases that short URLs and their
+# visits are spread over by short code, alongside the default database (see
+# apps/urlshortener/sharding.py). Shards are placed by alias (shard1,
+# shard2, ...), so only ever append hosts, and move rows with reshard_urls.
+DATABASE_SHARDS = ['default']
+for index, host in enumerate(env.list('DB_SHARD_HOSTS', default=[]), 1):
+    DATABASES[f'shard{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+    }
+    DATABASE_SHARDS.append(f'shard{index}')
+
+DATABASE_ROUTERS = [
+    'apps.urlshortener.sharding.ShardRouter',
+    'apps.urlshortener.replicas.ReplicaRouter',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -184,9 +231,130 @@ SPECTACULAR_SETTINGS = {
 }
 
 SHORT_CODE_LENGTH = env.int('SHORT_CODE_LENGTH', default=6)
+# Sequence codes need no uniqueness query; RandomCodeGenerator is the old behaviour
+SHORT_CODE_GENERATOR = env(
+    'SHORT_CODE_GENERATOR',
+    default='apps.urlshortener.codegen.SequenceCodeGenerator',
+)
+SHORT_CODE_BLOCK_SIZE = env.int('SHORT_CODE_BLOCK_SIZE', default=100)
+SHORT_CODE_SCRAMBLE = env.bool('SHORT_CODE_SCRAMBLE', default=True)
+# Changing the key reshuffles future codes, which can then collide with
+# existing ones (handled by retrying, but better left alone once live)
+SHORT_CODE_SCRAMBLE_KEY = env('SHORT_CODE_SCRAMBLE_KEY', default='urlshortener')
+SHORT_CODE_MAX_ATTEMPTS = 5
+# Give back the existing short URL when an owner shortens the same
+# (normalized) target URL with the same privacy again, instead of a new code
+SHORT_URL_DEDUP = env.bool('SHORT_URL_DEDUP', default=False)
 BASE_URL = env('BASE_URL')
-MAX_FILE_SIZE = 5 * 1024 * 1024  # 5 MB
+# Uploads are streamed, so memory use doesn't grow with this limit
+MAX_FILE_SIZE = env.int('MAX_FILE_SIZE', default=5 * 1024 * 1024)  # 5 MB
 MAX_URLS_PER_UPLOAD = 1000
+# Items accepted by one request to the JSON batch endpoint (/api/urls/batch/)
+MAX_URLS_PER_BATCH = env.int('MAX_URLS_PER_BATCH', default=1000)
+# Uploads sent with async=true run as background jobs in this many threads
+# (0 runs them inline once the request's transaction commits)
+BULK_UPLOAD_WORKERS = env.int('BULK_UPLOAD_WORKERS', default=2)
+MAX_URLS_PER_ASYNC_UPLOAD = env.int('MAX_URLS_PER_ASYNC_UPLOAD', default=100000)
+# Pending or running jobs without progress for this many seconds were cut off
+# by a restart; workers resume them at startup (see recover_upload_jobs)
+BULK_UPLOAD_STALE_AFTER = env.int('BULK_UPLOAD_STALE_AFTER', default=600)
+
+# ==============================================================================
+# CACHING
+# ==============================================================================
+
+# Shared cache tier; point at Redis in production (e.g. redis://localhost:6379/1)
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# Short-code resolution cache used by the redirect view. The local tier is
+# per process, so keep its TTL short: it bounds how long other workers may
+# serve a URL after it was edited or deleted. The same goes for the shared
+# tier while CACHE_URL is the per-process default, so there its TTLs are
+# capped at the local one.
+REDIRECT_CACHE_ENABLED = env.bool('REDIRECT_CACHE_ENABLED', default=True)
+REDIRECT_CACHE_ALIAS = 'default'
+REDIRECT_CACHE_LOCAL_SIZE = env.int('REDIRECT_CACHE_LOCAL_SIZE', default=10000)
+REDIRECT_CACHE_LOCAL_TTL = env.int('REDIRECT_CACHE_LOCAL_TTL', default=10)
+REDIRECT_CACHE_SHARED_TTL = env.int('REDIRECT_CACHE_SHARED_TTL', default=300)
+REDIRECT_CACHE_NEGATIVE_TTL = env.int('REDIRECT_CACHE_NEGATIVE_TTL', default=30)
+
+# Preload the most visited URLs into the resolution cache when a worker
+# starts (in a background thread, see apps/urlshortener/warmup.py), ranked by
+# visits in the last WARMUP_DAYS days ('recent') or all-time views ('views')
+REDIRECT_CACHE_WARMUP = env.bool('REDIRECT_CACHE_WARMUP', default=True)
+REDIRECT_CACHE_WARMUP_LIMIT = env.int('REDIRECT_CACHE_WARMUP_LIMIT', default=5000)
+REDIRECT_CACHE_WARMUP_TIME_LIMIT = env.float('REDIRECT_CACHE_WARMUP_TIME_LIMIT', default=10.0)
+REDIRECT_CACHE_WARMUP_RANKING = env('REDIRECT_CACHE_WARMUP_RANKING', default='recent')
+REDIRECT_CACHE_WARMUP_DAYS = 7
+
+# In-memory Bloom filter of all short codes (see apps/urlshortener/bloom.py),
+# so random codes can be picked without a uniqueness query
+SHORT_CODE_FILTER_ENABLED = env.bool('SHORT_CODE_FILTER_ENABLED', default=True)
+SHORT_CODE_FILTER_ERROR_RATE = env.float('SHORT_CODE_FILTER_ERROR_RATE', default=0.001)
+SHORT_CODE_FILTER_MIN_CAPACITY = 100000
+SHORT_CODE_FILTER_REFRESH_INTERVAL = env.float('SHORT_CODE_FILTER_REFRESH_INTERVAL', default=5.0)
+SHORT_CODE_FILTER_REBUILD_INTERVAL = env.float('SHORT_CODE_FILTER_REBUILD_INTERVAL', default=3600.0)
+
+# Memory-mapped snapshot of public redirects shared by all workers on a host
+# (see apps/urlshortener/snapshot.py); written by build_redirect_snapshot.
+# Empty disables it.
+REDIRECT_SNAPSHOT_PATH = env('REDIRECT_SNAPSHOT_PATH', default='')
+REDIRECT_SNAPSHOT_CHECK_INTERVAL = env.float('REDIRECT_SNAPSHOT_CHECK_INTERVAL', default=1.0)
+# How often build_redirect_snapshot --delta runs; rows read from the
+# snapshot are cached no longer than this, and a snapshot whose last build is
+# older than this (plus a grace period) is ignored
+REDIRECT_SNAPSHOT_DELTA_INTERVAL = env.int('REDIRECT_SNAPSHOT_DELTA_INTERVAL', default=60)
+
+# nginx map of the busiest public codes, so nginx redirects them itself
+# (export_nginx_map; see apps/urlshortener/edge.py and frontend/nginx.conf)
+NGINX_MAP_PATH = env('NGINX_MAP_PATH', default='/etc/nginx/redirects/redirects.map')
+NGINX_MAP_LIMIT = env.int('NGINX_MAP_LIMIT', default=10000)
+
+# Serve public redirects from a WSGI wrapper in front of Django (see
+# apps/urlshortener/fastpath.py), skipping middleware and DRF.
+REDIRECT_FAST_PATH = env.bool('REDIRECT_FAST_PATH', default=True)
+# First path segments that belong to Django routes, never to short codes
+REDIRECT_FAST_PATH_RESERVED = ['admin', 'api', 'static', 'media']
+
+# Route redirects and shortening to the async views (async_views.py).
+# project/asgi.py turns this on unless the environment says otherwise.
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', default=False)
+
+# ==============================================================================
+# VISIT TRACKING
+# ==============================================================================
+
+# Visits are queued in-process and written in batches by a background thread.
+# Disable to write each visit inside the redirect request instead.
+VISIT_TRACKING_ASYNC = env.bool('VISIT_TRACKING_ASYNC', default=True)
+VISIT_QUEUE_MAX_SIZE = env.int('VISIT_QUEUE_MAX_SIZE', default=10000)
+VISIT_BATCH_SIZE = env.int('VISIT_BATCH_SIZE', default=500)
+VISIT_FLUSH_INTERVAL = env.float('VISIT_FLUSH_INTERVAL', default=1.0)
+# What to do when the queue is full: 'drop', 'block' or 'inline'
+VISIT_QUEUE_FULL_POLICY = env('VISIT_QUEUE_FULL_POLICY', default='drop')
+VISIT_QUEUE_BLOCK_TIMEOUT = env.float('VISIT_QUEUE_BLOCK_TIMEOUT', default=0.05)
+VISIT_SHUTDOWN_TIMEOUT = env.float('VISIT_SHUTDOWN_TIMEOUT', default=10.0)
+
+# View counts are accumulated and folded into ShortURL.views once per interval.
+# Shared mode keeps the deltas in the cache so all workers flush together.
+VIEW_COUNTER_FLUSH_INTERVAL = env.float('VIEW_COUNTER_FLUSH_INTERVAL', default=5.0)
+VIEW_COUNTER_SHARED = env.bool('VIEW_COUNTER_SHARED', default=False)
+VIEW_COUNTER_CACHE_ALIAS = 'default'
+
+# Stats responses are cached per URL, window and version of the rollups
+STATS_CACHE_ALIAS = 'default'
+STATS_CACHE_TTL = env.int('STATS_CACHE_TTL', default=300)
+STATS_MAX_BUCKETS = 366
+
+# On PostgreSQL the visit log is partitioned by month (see partitions.py).
+# create_visit_partitions keeps this many months ready ahead of time;
+# archive_visits keeps the current month plus VISIT_RETENTION_MONTHS previous
+# ones and moves older months to gzipped CSV files in VISIT_ARCHIVE_DIR.
+VISIT_PARTITION_MONTHS_AHEAD = env.int('VISIT_PARTITION_MONTHS_AHEAD', default=3)
+VISIT_RETENTION_MONTHS = env.int('VISIT_RETENTION_MONTHS', default=12)
+VISIT_ARCHIVE_DIR = env('VISIT_ARCHIVE_DIR', default=str(BASE_DIR / 'archive' / 'visits'))
 
 # ==============================================================================
 # CUSTOM USER MODEL
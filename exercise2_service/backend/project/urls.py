@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import (
@@ -5,8 +6,11 @@ from drf_spectacular.views import (
     SpectacularSwaggerView,
     SpectacularRedocView,
 )
+from apps.urlshortener.async_views import AsyncRedirectView
 from apps.urlshortener.views import RedirectView
 
+redirect_view = AsyncRedirectView if settings.ASYNC_VIEWS else RedirectView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     
@@ -20,5 +24,5 @@ urlpatterns = [
     path('api/urls/', include('apps.urlshortener.urls')),
     
     # Redirect short codes (must be last)
-    path('<str:short_code>/', RedirectView.as_view(), name='redirect'),
+    path('<str:short_code>/', redirect_view.as_view(), name='redirect'),
 ]
\ No newline at end of file
@@ -12,8 +12,27 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
 application = get_wsgi_application()
+
+# Load hot short codes before traffic arrives, without delaying startup
+if settings.REDIRECT_CACHE_WARMUP:
+    from apps.urlshortener.warmup import warm_up_in_background
+
+    warm_up_in_background()
+
+# Pick up bulk upload jobs that a restart left unfinished
+if settings.BULK_UPLOAD_WORKERS > 0:
+    from apps.urlshortener.jobs import recover_in_background
+
+    recover_in_background()
+
+# Public short code redirects skip Django's middleware and DRF entirely
+if settings.REDIRECT_FAST_PATH:
+    from apps.urlshortener.fastpath import RedirectFastPath
+
+    application = RedirectFastPath(application)